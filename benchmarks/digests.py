@@ -0,0 +1,84 @@
+"""Benchmark of the t-digest backends of the percentile statistic: one
+crick TDigest per grid cell ("crick") against the digests of all the
+grid cells in numpy arrays ("array"), the buffer of every value of the
+exact percentiles ("exact"), the fixed size DDSketches ("ddsketch") and,
+with --workers, the crick digests updated by that number of worker
+processes ("sharded"). Prints the time per time step of
+the updates, for chunks of --time time steps, and the time to extract
+the percentiles of every grid cell.
+
+Usage: python benchmarks/digests.py [--cells 100000] [--steps 96] [--time 1]
+                                   [--workers 4]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+# appended, so that a version of the package on PYTHONPATH is used first
+sys.path.append(path)
+
+from one_pass.statistics.array_tdigest import ArrayTDigest
+from one_pass.statistics.ddsketch import DDSketch
+from one_pass.statistics.sample_buffer import SampleBuffer
+from one_pass.statistics.sharded_digests import ShardedDigests
+
+PERCENTILES = np.linspace(0, 0.99, 100)
+
+
+class CrickDigests:
+    """The loop over the grid cells of update_statistics.update_tdigest
+    and get_final_statistics.get_percentile"""
+
+    def __init__(self, n_cells : int):
+        from crick import TDigest
+        self.digests = [TDigest(compression=1) for _ in range(n_cells)]
+
+    def update(self, values : np.ndarray):
+        if values.shape[0] == 1:
+            for j, digest in enumerate(self.digests):
+                digest.update(values[0, j])
+        else:
+            for j, digest in enumerate(self.digests):
+                digest.update(values[:, j])
+
+    def quantile(self, q):
+        return np.array([digest.quantile(q) for digest in self.digests]).T
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cells", type=int, default=100000)
+    parser.add_argument("--steps", type=int, default=96)
+    parser.add_argument("--time", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args()
+
+    values = np.random.default_rng(0).random((args.steps, args.cells))
+    print(f"{args.cells} cells, {args.steps} time steps in chunks of "
+          f"{args.time}")
+    backends = [("crick", CrickDigests(args.cells)),
+                ("array", ArrayTDigest(args.cells, 1)),
+                ("exact", SampleBuffer(args.steps, args.cells)),
+                ("ddsketch", DDSketch(args.cells))]
+    if args.workers:
+        backends.append(("sharded", ShardedDigests(args.cells, args.workers)))
+    for name, digests in backends:
+        start = time.perf_counter()
+        for i in range(0, args.steps, args.time):
+            digests.update(values[i:i + args.time])
+        update = (time.perf_counter() - start) / args.steps
+
+        start = time.perf_counter()
+        digests.quantile(PERCENTILES)
+        extract = time.perf_counter() - start
+        print(f"{name:<8}{update * 1e3:>10.2f} ms per step"
+              f"{extract:>10.2f} s for {PERCENTILES.size} percentiles")
+
+
+if __name__ == "__main__":
+    main()
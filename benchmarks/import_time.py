@@ -0,0 +1,62 @@
+"""Benchmark of the time taken to import one_pass in a fresh interpreter.
+Every module is imported in a new process, as the start up cost of the
+short lived worker processes is what is being measured.
+
+Usage: python benchmarks/import_time.py [--repeat N]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = ("numpy", "xarray", "one_pass", "one_pass.opa")
+HEAVY_MODULES = ("zarr", "numcodecs", "crick", "dask", "tqdm")
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def time_import(module : str, repeat : int):
+    """Median wall time, in seconds, of importing module in a new
+    interpreter, minus the time of starting an empty interpreter"""
+    def run(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=path, check=True)
+        return time.perf_counter() - start
+
+    empty = statistics.median(run("pass") for _ in range(repeat))
+    return statistics.median(
+        run(f"import {module}") for _ in range(repeat)
+    ) - empty
+
+
+def heavy_modules(module : str):
+    """Heavy dependencies that are loaded when importing module"""
+    code = (
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=path, check=True,
+        capture_output=True, text=True
+    )
+    return result.stdout.strip() or "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<16}{'import [s]':>12}  heavy modules loaded")
+    for module in MODULES:
+        print(
+            f"{module:<16}{time_import(module, args.repeat):>12.3f}  "
+            f"{heavy_modules(module)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
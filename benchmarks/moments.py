@@ -0,0 +1,69 @@
+"""Benchmark of the fused moments kernel against separate numpy
+reductions of the same chunk, as they were done before for a group of
+mean, var, min and max statistics.
+
+Usage: python benchmarks/moments.py [--time 24] [--ny 720] [--nx 1440]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+# appended, so that a version of the package on PYTHONPATH is used first
+sys.path.append(path)
+
+from one_pass.statistics.moments import compute_moments
+
+
+def separate_reductions(values : np.ndarray):
+    """Reductions of a mean, var, min and max group with one numpy call
+    per output, each reading the whole chunk"""
+    np.mean(values, axis=0, dtype=np.float64, keepdims=True)
+    np.mean(values, axis=0, dtype=np.float64, keepdims=True)
+    np.var(values, axis=0, dtype=np.float64, keepdims=True, ddof=1)
+    np.argmin(values, axis=0)
+    np.amin(values, axis=0, keepdims=True)
+    np.argmax(values, axis=0)
+    np.amax(values, axis=0, keepdims=True)
+
+
+def fused_reductions(values : np.ndarray):
+    """The same outputs from one call of the moments kernel"""
+    compute_moments(
+        values, ("mean", "m2", "min", "argmin", "max", "argmax")
+    )
+
+
+def best_time(function, values : np.ndarray, repeat : int):
+    """Fastest of repeat calls, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(values)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--time", type=int, default=24)
+    parser.add_argument("--ny", type=int, default=720)
+    parser.add_argument("--nx", type=int, default=1440)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    values = np.random.default_rng(0).random((args.time, args.ny, args.nx))
+    print(f"chunk {values.shape}, {values.nbytes / 1e6:.0f} MB")
+    for name, function in (("separate", separate_reductions),
+                           ("fused", fused_reductions)):
+        seconds = best_time(function, values, args.repeat)
+        print(f"{name:<10}{seconds * 1e3:>10.1f} ms"
+              f"{values.nbytes / seconds / 1e9:>10.2f} GB/s of chunk")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark of the update kernels of mean, var, sum, min and max for
+single time step chunks on a large grid. Every statistic is run in a new process,
+so that the peak resident memory (RSS) belongs to that statistic only.
+
+For each statistic it prints the time per step, the peak RSS of the
+process and the peak memory allocated by numpy during one step (with
+tracemalloc). To compare two versions of the package, run the script
+with PYTHONPATH pointing at each of them.
+
+Usage: python benchmarks/update_kernels.py [--ny 720] [--nx 1440] [--steps 48]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+STATS = ("mean", "var", "sum", "min", "max")
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+# appended, so that a version of the package on PYTHONPATH is used first
+sys.path.append(path)
+
+
+def run_stat(stat : str, ny : int, nx : int, steps : int):
+    """Passes steps single time step chunks to compute_numpy and returns
+    the timings and memory use"""
+    from one_pass.opa import Opa
+
+    opa_stat = Opa({
+        "stat": stat, "stat_freq": "continuous", "output_freq": "yearly",
+        "time_step": 60, "variable": "pr", "save": False,
+        "checkpoint": False,
+    })
+    rng = np.random.default_rng(0)
+    values = rng.random((1, ny, nx))
+    time_stamps = np.datetime64("2071-01-01T00", "ns") + np.arange(
+        steps + 4
+    ) * np.timedelta64(1, "h")
+
+    # first steps initialise the statistic and the scratch arrays
+    for i in range(2):
+        opa_stat.compute_numpy(values, time_stamps[i:i + 1])
+
+    start = time.perf_counter()
+    for i in range(2, steps + 2):
+        opa_stat.compute_numpy(values, time_stamps[i:i + 1])
+    time_per_step = (time.perf_counter() - start) / steps
+
+    tracemalloc.start()
+    opa_stat.compute_numpy(values, time_stamps[steps + 2:steps + 3])
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "stat": stat,
+        "time_per_step": time_per_step,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "peak_alloc_per_step": peak_alloc,
+        "grid_bytes": values.nbytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ny", type=int, default=720)
+    parser.add_argument("--nx", type=int, default=1440)
+    parser.add_argument("--steps", type=int, default=48)
+    parser.add_argument("--stat", choices=STATS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stat is not None:
+        print(json.dumps(run_stat(args.stat, args.ny, args.nx, args.steps)))
+        return
+
+    print(f"grid {args.ny} x {args.nx}, {args.steps} steps")
+    print(f"{'stat':<6}{'ms/step':>10}{'peak RSS [MB]':>16}"
+          f"{'alloc/step [grids]':>21}")
+    for stat in STATS:
+        result = subprocess.run(
+            [sys.executable, __file__, "--stat", stat, "--ny", str(args.ny),
+             "--nx", str(args.nx), "--steps", str(args.steps)],
+            cwd=path, check=True, capture_output=True, text=True,
+        )
+        result = json.loads(result.stdout.strip().splitlines()[-1])
+        print(
+            f"{stat:<6}{result['time_per_step'] * 1e3:>10.2f}"
+            f"{result['peak_rss'] / 1e6:>16.1f}"
+            f"{result['peak_alloc_per_step'] / result['grid_bytes']:>21.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -15,5 +15,6 @@ __all_ = [
         "check_request",
         "convert_time",
         "update_statistics",
-        "Opa"
+        "Opa",
+        "OpaGroup"
 ]
@@ -0,0 +1,153 @@
+"""Module for writing the outputs and checkpoints in background threads,
+so that compute returns as soon as the rolling summaries are updated.
+Writes to the same file are always done in the order they were given,
+and a process level record of the pending writes is kept so that a
+checkpoint is never read before it has been written."""
+
+from typing import Callable
+
+import os
+import queue
+import threading
+
+# default number of writes that can be waiting per writer thread before
+# compute is blocked
+WRITER_QUEUE_SIZE = 4
+
+# pending writes per file, shared by all writers in the process
+_pending_writes = {}
+_pending_condition = threading.Condition()
+
+def _add_pending(file_name : str):
+    with _pending_condition:
+        _pending_writes[file_name] = _pending_writes.get(file_name, 0) + 1
+
+def _remove_pending(file_name : str):
+    with _pending_condition:
+        _pending_writes[file_name] -= 1
+        if _pending_writes[file_name] == 0:
+            del _pending_writes[file_name]
+        _pending_condition.notify_all()
+
+def wait_for_pending_writes(file_name : str):
+    """Blocks until all the queued writes to file_name are finished.
+    Called before reading a checkpoint file."""
+    with _pending_condition:
+        _pending_condition.wait_for(lambda: file_name not in _pending_writes)
+
+def write_bytes(file_name : str, payload : bytes):
+    """Writes the (pickled) payload to a temporary file which then
+    replaces file_name, so that file_name is never partially written"""
+    temp_file_name = file_name + ".tmp"
+    with open(temp_file_name, 'wb') as file:
+        file.write(payload)
+    os.replace(temp_file_name, file_name)
+
+def remove_file(file_name : str):
+    """Removes file_name if it exists"""
+    if os.path.isfile(file_name):
+        os.remove(file_name)
+
+def write_data_set(dm, file_name : str):
+    """Saves an xr.Dataset to netcdf"""
+    dm.to_netcdf(path=file_name, mode="w")
+    dm.close()
+
+class BackgroundWriter:
+    """Pool of writer threads, each with a bounded queue. Writes are
+    sent to a thread depending on the file name, so all the writes to
+    one file are done by the same thread, in order. If the queue of that
+    thread is full, submit blocks until there is space (backpressure).
+    Exceptions raised while writing are raised again in the next call to
+    submit, flush or close.
+    """
+    def __init__(self, n_workers : int = 1,
+                 queue_size : int = WRITER_QUEUE_SIZE, logger = None
+                ):
+        """Initialisation. Starts the writer threads.
+
+        Arguments
+        ----------
+        n_workers : int. Number of writer threads.
+        queue_size : int. Number of writes that can be waiting for each
+                writer thread.
+        logger : logger of the Opa class.
+        """
+        self.logger = logger
+        self.errors = []
+        self.error_lock = threading.Lock()
+        # held while compute runs from acompute, so that the rolling
+        # summaries are only updated by one thread at a time
+        self.compute_lock = threading.Lock()
+        self.queues = [
+            queue.Queue(maxsize = queue_size) for _ in range(n_workers)
+        ]
+        self.threads = [
+            threading.Thread(
+                target = self._work, args = (write_queue,),
+                name = f"one_pass-writer-{i}", daemon = True
+            )
+            for i, write_queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self, write_queue : queue.Queue):
+        """Body of the writer threads"""
+        while True:
+            item = write_queue.get()
+            if item is None:
+                write_queue.task_done()
+                return
+            file_name, function, args = item
+            try:
+                function(*args)
+            except BaseException as exc: # pylint: disable=broad-except
+                with self.error_lock:
+                    self.errors.append(exc)
+            finally:
+                _remove_pending(file_name)
+                write_queue.task_done()
+
+    def raise_errors(self):
+        """Raises the first exception from the writer threads, if any"""
+        with self.error_lock:
+            if not self.errors:
+                return
+            exc = self.errors[0]
+            self.errors = []
+        raise exc
+
+    def submit(self, file_name : str, function : Callable, *args):
+        """Queues function(*args), which writes or removes file_name.
+
+        Arguments
+        ----------
+        file_name : str. The file that is written, used to keep the
+                writes to one file in order.
+        function : Callable. Function doing the write.
+        """
+        self.raise_errors()
+        write_queue = self.queues[hash(file_name) % len(self.queues)]
+        if write_queue.full() and self.logger is not None:
+            self.logger.debug(
+                "Write queue is full, waiting before writing %s", file_name
+            )
+        _add_pending(file_name)
+        write_queue.put((file_name, function, args))
+
+    def flush(self):
+        """Blocks until all the queued writes are finished"""
+        for write_queue in self.queues:
+            write_queue.join()
+        self.raise_errors()
+
+    def close(self):
+        """Finishes all the queued writes and stops the writer threads"""
+        try:
+            self.flush()
+        finally:
+            for write_queue in self.queues:
+                write_queue.put(None)
+            for thread in self.threads:
+                thread.join()
@@ -4,8 +4,12 @@ Will check that all key value pairs are present
 and any setting required for certain statistics
 """
 
+import math
 import os
 from datetime import date
+from numbers import Integral, Real
+
+import numpy as np
 
 required_keys_with_set_output = [
     "stat",
@@ -90,6 +94,52 @@ output_freq_options = [
     "10annually",
 ]
 
+# list of allowed options for the roll up frequencies
+rollup_freq_options = [
+    "hourly",
+    "2hourly",
+    "3hourly",
+    "6hourly",
+    "12hourly",
+    "daily",
+    "weekly",
+    "monthly",
+    "3monthly",
+    "annually",
+    "yearly",
+]
+
+# statistics that can be rolled up into coarser frequencies
+rollup_stat_options = [
+    "mean",
+    "std",
+    "var",
+    "min",
+    "max",
+    "sum",
+    "percentile",
+]
+
+# statistics of every sketch_backend, the backends other than crick are
+# created by initialise_statistics.SKETCH_BACKENDS
+sketch_backend_options = {
+    "crick" : ("percentile", "histogram"),
+    "array" : ("percentile", "histogram"),
+    "exact" : ("percentile", "histogram"),
+    "ddsketch" : ("percentile",),
+}
+
+# number of hours of the frequencies up to daily, used to check that
+# the roll up frequency is a whole multiple of the stat_freq
+sub_daily_hours = {
+    "hourly" : 1,
+    "2hourly" : 2,
+    "3hourly" : 3,
+    "6hourly" : 6,
+    "12hourly" : 12,
+    "daily" : 24,
+}
+
 ba_method_options = [
     "None",
     "multiplicative",
@@ -356,6 +406,27 @@ def check_histogram(request, logger):
                 "it will default to 10."
             )
 
+        hist_range = getattr(request, "range", None)
+        if hist_range is not None and not (
+                isinstance(hist_range, (list, tuple))
+                and len(hist_range) == 2
+                and all(isinstance(edge, Real) and math.isfinite(edge)
+                        for edge in hist_range)
+                and hist_range[0] < hist_range[1]
+            ):
+            raise ValueError(
+                f"range : {hist_range} is not valid, it must be a list of "
+                "two finite values, the lower and upper edges of the bins."
+            )
+        bins = getattr(request, "bins", None)
+        if bins is not None and (
+                isinstance(bins, bool) or not isinstance(bins, Integral)
+                or bins < 1
+            ):
+            raise ValueError(
+                f"bins : {bins} is not valid, it must be a positive integer."
+            )
+
         # if not hasattr(request, "range"):
         #     warnings.warn(
         #         "Optional key value 'range' : '[float, float]'. The lower and upper "
@@ -417,6 +488,26 @@ def check_iams(request):
             raise ValueError(
                 'Must set output_freq equal to yearly/annually when requesting'
                 ' iams statistic')
+        durations = request.iams_durations
+        if durations is not None:
+            if not isinstance(durations, list) or len(durations) == 0:
+                raise ValueError(
+                    "iams_durations must be a list of durations in minutes."
+                )
+            for duration in durations:
+                if (isinstance(duration, bool)
+                        or not isinstance(duration, int)
+                        or duration < request.time_step
+                        or duration % request.time_step != 0):
+                    raise ValueError(
+                        f"iams_durations : {duration} is not valid, every "
+                        "duration must be a whole multiple of the time_step "
+                        f"{request.time_step} minutes."
+                    )
+    elif request.iams_durations is not None:
+        raise ValueError(
+            "iams_durations can only be used with the iams statistic."
+        )
 
 def check_raw(request, logger):
     """Check that if raw has been selected as the statistic then the user knows that 
@@ -468,6 +559,278 @@ def check_compression(request, logger):
             )
 
 
+def rollup_fits(stat_freq, rollup_freq):
+    """Checks that every rollup_freq period is made of whole stat_freq
+    periods, e.g. days fit in months but weeks do not.
+    """
+    if rollup_freq in sub_daily_hours:
+        return (
+            stat_freq in sub_daily_hours
+            and sub_daily_hours[rollup_freq] > sub_daily_hours[stat_freq]
+            and sub_daily_hours[rollup_freq] % sub_daily_hours[stat_freq] == 0
+        )
+    if rollup_freq in ("weekly", "monthly"):
+        return stat_freq in sub_daily_hours
+    if rollup_freq == "3monthly":
+        return stat_freq in sub_daily_hours or stat_freq == "monthly"
+    # yearly
+    return stat_freq in sub_daily_hours or stat_freq in ("monthly", "3monthly")
+
+def check_rollup(request, logger):
+    """Checks the optional key rollup_freq, giving the coarser frequencies
+    that the finished stat_freq statistics are rolled up into. Converts a
+    single string into a list and 'annually' into 'yearly'.
+    """
+    if request.rollup_freq is None:
+        return
+
+    if isinstance(request.rollup_freq, str):
+        setattr(request, "rollup_freq", [request.rollup_freq])
+
+    if request.stat not in rollup_stat_options:
+        raise ValueError(
+            f"rollup_freq can not be used with the statistic {request.stat}, "
+            f"valid statistics are: {rollup_stat_options}"
+        )
+    if request.stat_freq == "continuous":
+        raise ValueError(
+            "rollup_freq can not be used with stat_freq : continuous."
+        )
+
+    rollup_freq_list = []
+    for rollup_freq in request.rollup_freq:
+        if rollup_freq not in rollup_freq_options:
+            missing_value("rollup_freq", rollup_freq, rollup_freq_options)
+        if rollup_freq == "annually":
+            logger.warning(
+                "The time request of 'annually' for rollup_freq has been "
+                "changed to 'yearly'."
+            )
+            rollup_freq = "yearly"
+        if not rollup_fits(request.stat_freq, rollup_freq):
+            raise ValueError(
+                f"Can not roll up stat_freq : {request.stat_freq} into "
+                f"{rollup_freq}. The rollup_freq must be greater than the "
+                "stat_freq and made of whole stat_freq periods."
+            )
+        if rollup_freq not in rollup_freq_list:
+            rollup_freq_list.append(rollup_freq)
+
+    setattr(request, "rollup_freq", rollup_freq_list)
+
+def check_batch(request):
+    """Checks the optional keys batch_size and batch_max_bytes used for
+    the micro-batching buffer. Both must be positive integers.
+    """
+    for key in ("batch_size", "batch_max_bytes"):
+        value = getattr(request, key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(
+                f"{key} : {value} is not valid, it must be a positive integer."
+            )
+        if request.stat in ("raw", "bias_correction"):
+            raise ValueError(
+                f"{key} can not be used with the statistic {request.stat}."
+            )
+
+def check_writer(request):
+    """Checks the optional keys writer_workers and writer_queue_size
+    used for the background writer. Both must be positive integers.
+    """
+    for key in ("writer_workers", "writer_queue_size"):
+        value = getattr(request, key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(
+                f"{key} : {value} is not valid, it must be a positive integer."
+            )
+
+def check_state_dtype(request):
+    """Checks the optional key state_dtype, the data type of the rolling
+    summaries. float32 is only supported for the statistics that are
+    summed in place: mean, sum, var and std.
+    """
+    if request.state_dtype is None:
+        return
+    if request.state_dtype not in ("float32", "float64"):
+        raise ValueError(
+            f"state_dtype : {request.state_dtype} is not valid, it must be "
+            "float32 or float64."
+        )
+    if (request.state_dtype == "float32"
+            and request.stat not in ("mean", "sum", "var", "std")):
+        raise ValueError(
+            f"state_dtype float32 can not be used with the statistic "
+            f"{request.stat}, only with mean, sum, var and std."
+        )
+
+def check_sketch_backend(request):
+    """Checks the optional key sketch_backend, the t-digests used by the
+    percentile and histogram statistics. The bias_correction digests
+    are always crick TDigest objects, as they are read by the bias
+    adjustment. The exact percentiles keep every time step of the
+    statistic, so they can not be continuous or rolled up. The exact
+    histograms count fixed bins, so they need the range of the bins.
+    Also checks relative_accuracy and sketch_buckets, the size of the
+    ddsketch sketches.
+    """
+    check_ddsketch(request)
+    if request.sketch_backend is None:
+        return
+    if request.sketch_backend not in sketch_backend_options:
+        raise ValueError(
+            f"sketch_backend : {request.sketch_backend} is not valid, valid "
+            f"options are: {list(sketch_backend_options)}"
+        )
+    if request.stat not in sketch_backend_options[request.sketch_backend]:
+        raise ValueError(
+            f"sketch_backend {request.sketch_backend} can not be used with "
+            f"the statistic {request.stat}, only with "
+            f"{sketch_backend_options[request.sketch_backend]}."
+        )
+    if request.sketch_backend != "exact":
+        return
+    if request.stat == "histogram":
+        if getattr(request, "range", None) is None:
+            raise ValueError(
+                "sketch_backend exact can only be used for histograms with "
+                "a range, e.g. 'range' : [0, 0.01]."
+            )
+    elif request.stat_freq == "continuous" or request.rollup_freq:
+        raise ValueError(
+            "sketch_backend exact can only be used for percentile "
+            "statistics that are not continuous and not rolled up."
+        )
+
+# statistics that can skip the NaN values of the data
+skipna_options = (
+    "mean", "sum", "var", "std", "min", "max", "thresh_exceed",
+    "percentile", "histogram"
+)
+
+def check_skipna(request):
+    """Checks the optional keys skipna and min_coverage. With skipna the
+    rolling summaries ignore the NaN values and count the valid time
+    steps of every cell, and min_coverage is the fraction of valid time
+    steps needed for a cell not to be NaN in the output. The valid
+    counts can not be rolled up."""
+    if not isinstance(request.skipna, bool):
+        raise ValueError(
+            f"skipna : {request.skipna} is not valid, it must be True or "
+            "False."
+        )
+    if request.min_coverage is not None:
+        if not request.skipna:
+            raise ValueError("min_coverage can only be used with skipna.")
+        if (isinstance(request.min_coverage, bool)
+                or not isinstance(request.min_coverage, Real)
+                or not 0 < request.min_coverage <= 1):
+            raise ValueError(
+                f"min_coverage : {request.min_coverage} is not valid, it "
+                "must be a fraction larger than 0 and up to 1."
+            )
+    if not request.skipna:
+        return
+    if request.stat not in skipna_options:
+        raise ValueError(
+            f"skipna can not be used with the statistic {request.stat}, "
+            f"only with {', '.join(skipna_options)}."
+        )
+    if request.rollup_freq:
+        raise ValueError("skipna can not be used with rollup_freq.")
+
+def check_mask(request):
+    """Checks the optional key mask, the active grid cells or the path
+    of a file holding them. The mask itself is only loaded when the
+    first chunk arrives, as its shape is checked against the data. The
+    raw data and the bias correction are always on the full grid."""
+    if request.mask is None:
+        return
+    if request.stat in ("raw", "bias_correction"):
+        raise ValueError(
+            f"mask can not be used with the statistic {request.stat}."
+        )
+    if isinstance(request.mask, (str, os.PathLike)):
+        if not os.path.isfile(request.mask):
+            raise ValueError(
+                f"mask : the mask file {request.mask} does not exist."
+            )
+        return
+    if np.ndim(request.mask) == 0 or np.size(request.mask) == 0:
+        raise ValueError(
+            "mask must be an array of the active grid cells, with the "
+            "shape of the grid without time, or the path of a file "
+            "holding it."
+        )
+
+def check_digest_workers(request):
+    """Checks the optional key digest_workers, the number of worker
+    processes updating the crick digests. The shards of the workers can
+    not be merged, so they can not be rolled up."""
+    if request.digest_workers is None:
+        return
+    if (isinstance(request.digest_workers, bool)
+            or not isinstance(request.digest_workers, Integral)
+            or request.digest_workers < 1):
+        raise ValueError(
+            f"digest_workers : {request.digest_workers} is not valid, it "
+            "must be a positive integer."
+        )
+    if request.stat not in ("percentile", "histogram"):
+        raise ValueError(
+            f"digest_workers can not be used with the statistic "
+            f"{request.stat}, only with percentile and histogram."
+        )
+    if request.sketch_backend not in (None, "crick"):
+        raise ValueError(
+            "digest_workers can only be used with sketch_backend : crick."
+        )
+    if request.rollup_freq:
+        raise ValueError("digest_workers can not be used with rollup_freq.")
+
+def check_extract_workers(request):
+    """Checks the optional key extract_workers, the number of threads
+    extracting the percentiles and histograms from the crick digests"""
+    if request.extract_workers is None:
+        return
+    if (isinstance(request.extract_workers, bool)
+            or not isinstance(request.extract_workers, Integral)
+            or request.extract_workers < 1):
+        raise ValueError(
+            f"extract_workers : {request.extract_workers} is not valid, it "
+            "must be a positive integer."
+        )
+
+def check_ddsketch(request):
+    """Checks the optional keys relative_accuracy and sketch_buckets,
+    which are only used by the ddsketch sketch_backend"""
+    for key in ("relative_accuracy", "sketch_buckets"):
+        if (getattr(request, key) is not None
+                and request.sketch_backend != "ddsketch"):
+            raise ValueError(
+                f"{key} can only be used with sketch_backend : ddsketch."
+            )
+    if request.relative_accuracy is not None and not (
+            isinstance(request.relative_accuracy, Real)
+            and 0 < request.relative_accuracy < 1
+        ):
+        raise ValueError(
+            f"relative_accuracy : {request.relative_accuracy} is not valid, "
+            "it must be between 0 and 1."
+        )
+    if request.sketch_buckets is not None and (
+            isinstance(request.sketch_buckets, bool)
+            or not isinstance(request.sketch_buckets, Integral)
+            or request.sketch_buckets < 2
+        ):
+        raise ValueError(
+            f"sketch_buckets : {request.sketch_buckets} is not valid, it "
+            "must be an integer of at least 2."
+        )
+
 def check_legacy_bias_adjustment(request, logger):
     """For older ways to call bias adjustment, check that if bias adjustment
     has been selected, the correct values have been set.
@@ -606,5 +969,14 @@ def check_request(request, logger):
     check_raw(request, logger)
     check_annually(request, logger)
     check_compression(request, logger)
+    check_rollup(request, logger)
+    check_batch(request)
+    check_writer(request)
+    check_state_dtype(request)
+    check_sketch_backend(request)
+    check_digest_workers(request)
+    check_extract_workers(request)
+    check_skipna(request)
+    check_mask(request)
     check_legacy_bias_adjustment(request, logger)
     check_bias_adjustment(request, logger)
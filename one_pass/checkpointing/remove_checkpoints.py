@@ -2,6 +2,9 @@
 import os
 import numpy as np
 
+from one_pass.background_writer import remove_file
+from one_pass.checkpointing import state_cache
+
 def remove_zarr_checkpoints(opa_self):
     """Will first check if the attribute matching_items
     is present which indicates that checkpointing has
@@ -30,17 +33,50 @@ def remove_zarr_checkpoints(opa_self):
                             )
                     os.rmdir(checkpoint_file_zarr)
 
+def remove_shard_checkpoints(opa_self):
+    """Removes the shard files written by the digest_workers. They are
+    written straight away, so they exist already."""
+    if not opa_self.request.digest_workers:
+        return
+    # imported here, as the statistics package imports the checkpointing
+    from one_pass.statistics.sharded_digests import find_shard_files
+
+    writer = getattr(opa_self, "writer", None)
+    for file_name in find_shard_files(opa_self.request.checkpoint_file):
+        if writer is not None:
+            # after the checkpoint pointing to them
+            writer.submit(
+                opa_self.request.checkpoint_file, remove_file, file_name
+            )
+        else:
+            os.remove(file_name)
+
 def remove_checkpoints(opa_self):
     """If Opa.keep_checkpoints is True, does nothing.
     Will first check if checkpointing is turned on.
     If yes, it will find the path for the checkpoint
     file and remove it. It will also call remove
-    zarr checkpoints.
+    zarr checkpoints. If the Opa has a background writer, the
+    removal is queued after the checkpoint writes.
     """
+    if opa_self.request.checkpoint:
+        # the state no longer matches the checkpoint file, even if
+        # the file is kept
+        state_cache.invalidate_state(opa_self.request.checkpoint_file)
     if opa_self.keep_checkpoints:
         return
     if opa_self.request.checkpoint:
-        if os.path.isfile(opa_self.request.checkpoint_file):
+        writer = getattr(opa_self, "writer", None)
+        if writer is not None:
+            # queued after the writes to the checkpoint, as the file
+            # may not have been written yet
+            opa_self.logger.debug('removing checkpoint')
+            writer.submit(
+                opa_self.request.checkpoint_file, remove_file,
+                opa_self.request.checkpoint_file
+            )
+        elif os.path.isfile(opa_self.request.checkpoint_file):
             opa_self.logger.debug('removing checkpoint')
             os.remove(opa_self.request.checkpoint_file)
         remove_zarr_checkpoints(opa_self)
+        remove_shard_checkpoints(opa_self)
@@ -0,0 +1,90 @@
+"""In-process cache of the checkpointed Opa states. When a checkpoint is
+written, the live Opa object is kept with the modification time and
+size of the checkpoint file. A new Opa created for the same checkpoint
+file in the same process then takes its state from the cache instead of
+loading the pickle (and zarr) files, as long as the checkpoint file has
+not changed since. The checkpoint files are still written as before, for
+crash recovery.
+
+The state is handed over: the cache entry is removed when it is taken,
+so any other Opa created for the same file loads its own copy from the
+checkpoint file, and the old Opa is marked as stale so that it can not
+update the state it no longer owns."""
+
+import os
+import threading
+
+from one_pass.background_writer import write_bytes
+
+# checkpoint file -> (modification time and size of the file, Opa)
+_states = {}
+# checkpoint file -> generation, increased whenever the Opa is updated,
+# so that a checkpoint written in the background is only cached if the
+# state has not been changed since it was pickled
+_generations = {}
+_lock = threading.Lock()
+
+def get_file_key(file_name : str):
+    """Modification time and size of a file, None if it doesn't exist"""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def get_generation(file_name : str):
+    """Current generation of the state of a checkpoint file"""
+    with _lock:
+        return _generations.get(file_name, 0)
+
+def register_state(file_name : str, opa_self : object, generation : int = None):
+    """Caches the Opa just written to the checkpoint file_name.
+
+    Arguments
+    ----------
+    file_name : str. Checkpoint file.
+    opa_self : Opa class.
+    generation : int. Generation when the state was pickled, if it was
+            written in the background. If the Opa has been updated since,
+            it is not cached.
+    """
+    file_key = get_file_key(file_name)
+    with _lock:
+        if (generation is not None
+                and generation != _generations.get(file_name, 0)):
+            return
+        if file_key is None:
+            _states.pop(file_name, None)
+        else:
+            _states[file_name] = (file_key, opa_self)
+
+def invalidate_state(file_name : str):
+    """Removes the cached state of a checkpoint file. Called when the
+    Opa is about to be updated, or when the checkpoint is removed."""
+    with _lock:
+        _generations[file_name] = _generations.get(file_name, 0) + 1
+        _states.pop(file_name, None)
+
+def take_state(file_name : str):
+    """Removes the cached Opa of the checkpoint file_name from the cache
+    and returns it, or None if there is none or the file has changed
+    since it was cached."""
+    file_key = get_file_key(file_name)
+    with _lock:
+        entry = _states.pop(file_name, None)
+        if entry is None or entry[0] != file_key:
+            return None
+        return entry[1]
+
+def clear_state_cache():
+    """Empties the cache, so that the next Opa loads its checkpoint file"""
+    with _lock:
+        _states.clear()
+
+def write_state(file_name : str, payload : bytes, opa_self : object,
+                generation : int
+            ):
+    """Writes a pickled checkpoint in the background writer and caches
+    the state it was pickled from"""
+    write_bytes(file_name, payload)
+    register_state(file_name, opa_self, generation)
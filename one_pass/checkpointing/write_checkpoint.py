@@ -3,10 +3,13 @@ The nature of the checkpoint file will be decided based on the size of the
 attributes. If any data is passed as a dask array, it will load it into
 memory before checkpointing.
 """
+import pickle
 import random
 import sys
 from one_pass.checkpointing.write_pickle import write_pickle
 from one_pass.checkpointing.write_zarr import write_zarr
+from one_pass.background_writer import wait_for_pending_writes
+from one_pass.checkpointing import state_cache
 
 def find_items_with_substr(pass_dict, target_substring):
     """Finds all attributes of dict (which is the whole Opa opa_self class)
@@ -50,7 +53,14 @@ def get_digest_total_size(opa_self, key : str, total_size : float):
             attribute class
     """
 
-    random_element = random.choice(getattr(opa_self.statistics, key).flat)
+    # imported here, as the statistics package imports the checkpointing
+    from one_pass.statistics.sketch import GridSketch
+
+    digests = getattr(opa_self.statistics, key)
+    if isinstance(digests, GridSketch):
+        return total_size + digests.nbytes/(10**9)
+
+    random_element = random.choice(digests.flat)
     total_size += (sys.getsizeof(
         random_element.centroids())*
         opa_self.data_set_info.size_data_source_tail/(10**9))
@@ -94,6 +104,12 @@ def get_total_size(opa_self, just_digests : bool = False):
                     total_size = get_digest_total_size(opa_self, element[0], total_size)
                 # both final_cum and final2_cum are xr.Datasets so size is checked
                 # differently
+                elif (element[0] in ("final_cum", "final2_cum")
+                        and isinstance(opa_self.statistics.final_cum, tuple)):
+                    # numpy output of compute_numpy (final statistic, meta)
+                    total_size += (
+                        opa_self.statistics.final_cum[0].nbytes/(10**9)
+                    )
                 elif element[0] == "final_cum" or element[0] == "final2_cum":
                     total_size += (
                             opa_self.statistics.final_cum[
@@ -133,6 +149,15 @@ def load_dask(opa_self, key):
                         getattr(opa_self, key).compute()
         )
 
+def save_shard_checkpoints(opa_self):
+    """Has the digest_workers write the shard files of the digests, just
+    before the checkpoint pointing to them is pickled"""
+    if not opa_self.request.digest_workers:
+        return
+    digests = getattr(opa_self.statistics, "digests_cum", None)
+    if digests is not None:
+        digests.save_shards()
+
 def write_checkpoint(opa_self):
     """Write checkpoint file. First, any array that is dask, must
     beloaded into memory otherwise pickle files get too large. 
@@ -144,19 +169,37 @@ def write_checkpoint(opa_self):
     """
     for element in opa_self.statistics.__dict__.items():
         load_dask(opa_self.statistics, element[0])
+    save_shard_checkpoints(opa_self)
 
     total_size = get_total_size(opa_self)
     # limit on a pickle file is 2GB
+    writer = getattr(opa_self, "writer", None)
+    checkpoint_file = opa_self.request.checkpoint_file
     if total_size < opa_self.fixed.pickle_limit:
-        # have to include opa_self here as the second input
-        write_pickle(opa_self)
+        if writer is not None:
+            # the state is pickled now, only writing the file (and
+            # caching the state) is left to the background writer
+            writer.submit(
+                checkpoint_file, state_cache.write_state, checkpoint_file,
+                pickle.dumps(opa_self), opa_self,
+                state_cache.get_generation(checkpoint_file)
+            )
+        else:
+            # have to include opa_self here as the second input
+            write_pickle(opa_self)
+            state_cache.register_state(checkpoint_file, opa_self)
         opa_self.logger.debug(
                 f'Writing pickle checkpoint with size {total_size} GB'
             )
 
     else:
+        if writer is not None:
+            # zarr checkpoints are always written straight away, after
+            # any pickle checkpoint still being written
+            wait_for_pending_writes(checkpoint_file)
         # this will pickle metaData inside as well
         write_zarr(opa_self)
+        state_cache.register_state(checkpoint_file, opa_self)
         opa_self.logger.debug(
                 f'Writing zarr checkpoint with size {total_size} GB'
             )
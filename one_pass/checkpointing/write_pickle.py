@@ -1,9 +1,11 @@
 """Functions to read and write pickle files"""
 
+import os
 import pickle
 
 def write_pickle(what_to_dump, file_name = None):
-    """ Writes pickle file
+    """ Writes pickle file. The file is first written under a temporary
+    name and then moved, so that a checkpoint is never partially written.
 
     Arguments
     ----------
@@ -11,11 +13,11 @@ def write_pickle(what_to_dump, file_name = None):
     file_name : optional file name if different from
             self.checkpoint_file. Used for bias_correction
     """
-    if file_name:
-        with open(file_name, 'wb') as file:
-            pickle.dump(what_to_dump, file)
-        file.close()
-    else:
-        with open(what_to_dump.request.checkpoint_file, 'wb') as file:
-            pickle.dump(what_to_dump, file)
-        file.close()
+    if not file_name:
+        file_name = what_to_dump.request.checkpoint_file
+
+    temp_file_name = file_name + ".tmp"
+    with open(temp_file_name, 'wb') as file:
+        pickle.dump(what_to_dump, file)
+    file.close()
+    os.replace(temp_file_name, file_name)
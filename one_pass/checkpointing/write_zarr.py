@@ -1,11 +1,9 @@
 """Module to write zarr checkpoint files. Called when opa_self.statistics.
-STAT_cum exceeds pickle size limit"""
+STAT_cum exceeds pickle size limit. zarr and numcodecs are only imported
+when a zarr file is written, as most runs never need them."""
 
 import os
-import zarr
 import numpy as np
-from numcodecs import Blosc
-from numcodecs import Pickle
 
 from one_pass.checkpointing.write_pickle import write_pickle
 
@@ -22,14 +20,26 @@ def write_zarr(opa_self : object):
     all elements of opa_self.statistics saved as zarr, other than the
     final_cum and final2_cum.
     pickle checkpoint file written with the rest of the Opa class.
+    The elements saved as zarr are put back in opa_self afterwards, so
+    that the same Opa can carry on being used.
     """
+    import zarr
+    from numcodecs import Blosc
+    from numcodecs import Pickle
+    from one_pass.statistics.sketch import GridSketch
+
     compressor = Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE)
+    zarr_elements = {}
 
     # looping through all the attributes with 'cum' - the big ones
     for element in opa_self.statistics.__dict__.items():
         if (element[0] != "final_cum" and
                 element[0] != "final2_cum" and
-                element[1] is not None
+                element[1] is not None and
+                # the sketches of all the grid cells are pickled with
+                # the rest, as pickle protocol 4 has no 2GB limit for
+                # numpy arrays
+                not isinstance(element[1], GridSketch)
             ):
             opa_self.time.using_zarr = True
             checkpoint_file_zarr = os.path.join(
@@ -64,12 +74,19 @@ def write_zarr(opa_self : object):
                         compressor=compressor,
                         overwrite=True,
                     )
-            # this will set everything that's need checkpointed to zarr to None
-            setattr(opa_self.statistics, element[0], None)
+            zarr_elements[element[0]] = element[1]
+
+    # this will set everything that's need checkpointed to zarr to None
+    for key in zarr_elements:
+        setattr(opa_self.statistics, key, None)
 
     # now pickling the other key info that needs to be carried
     # through
-    write_pickle(opa_self)
+    try:
+        write_pickle(opa_self)
+    finally:
+        for key, value in zarr_elements.items():
+            setattr(opa_self.statistics, key, value)
 
 def write_zarr_for_bc(opa_self : object, dm : np.array):
     """Write monthly digest files file as to zarr. This will be used when
@@ -86,6 +103,10 @@ def write_zarr_for_bc(opa_self : object, dm : np.array):
     zarr file containing the t-digest objects with file name
     opa_self.bc.monthly_digest_file_name
     """
+    import zarr
+    from numcodecs import Blosc
+    from numcodecs import Pickle
+
     compressor = Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE)
 
     opa_self.time.using_zarr = True
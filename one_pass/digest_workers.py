@@ -0,0 +1,277 @@
+"""Module for updating crick digests in persistent worker processes. Every
+worker owns the digests of one contiguous range of grid cells (a shard)
+of every sharded statistic, so that the loop over the grid cells runs on
+all the workers at once. The incoming chunk is copied once into a
+multiprocessing.shared_memory block, which all the workers read, and
+only the results (percentiles, histograms) are sent back.
+
+The workers are started with the "spawn" method, as the Opa may already
+be running writer or prefetch threads, so scripts creating them must
+guard their entry point with if __name__ == "__main__". The workers are
+shared by all the statistics of the process using the same number of
+workers and are stopped when the process exits."""
+
+import atexit
+import multiprocessing
+import pickle
+import threading
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from one_pass.background_writer import write_bytes
+
+# number of workers -> DigestWorkers, shared by the process
+_workers = {}
+_workers_lock = threading.Lock()
+
+def get_workers(n_workers : int):
+    """The DigestWorkers of the process with n_workers workers, started
+    on first use"""
+    with _workers_lock:
+        workers = _workers.get(n_workers)
+        if workers is None or not workers.is_alive():
+            workers = DigestWorkers(n_workers)
+            _workers[n_workers] = workers
+        return workers
+
+@atexit.register
+def close_workers():
+    """Stops all the workers of the process"""
+    with _workers_lock:
+        for workers in _workers.values():
+            workers.close()
+        _workers.clear()
+
+class DigestWorkers:
+    """Pool of worker processes, each connected by a pipe. Requests are
+    sent to all the workers and then all the answers are received, so
+    the workers run at the same time. Only one request is sent at a
+    time."""
+
+    def __init__(self, n_workers : int):
+        """Initialisation. Starts the worker processes.
+
+        Arguments
+        ----------
+        n_workers : int. Number of worker processes.
+        """
+        context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        # shards of statistics that no longer exist, dropped before the
+        # next request (see drop)
+        self.dropped = []
+        self.shared = None
+        self.connections = []
+        self.processes = []
+        for i in range(n_workers):
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target = run_worker, args = (child_connection,),
+                name = f"one_pass-digests-{i}", daemon = True
+            )
+            process.start()
+            child_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def __len__(self):
+        return len(self.processes)
+
+    def is_alive(self):
+        """True if all the workers are running"""
+        return bool(self.processes) and all(
+            process.is_alive() for process in self.processes
+        )
+
+    def drop(self, key : str):
+        """Drops the shards of key from the workers before the next
+        request. Called when a sharded statistic is garbage collected,
+        which can happen in the middle of a request."""
+        self.dropped.append(key)
+
+    def request(self, messages : list):
+        """Sends one message to every worker and returns their answers.
+
+        Arguments
+        ----------
+        messages : list of tuples, one per worker, starting with the
+                command.
+
+        Returns
+        ---------
+        list of the answers of the workers.
+        """
+        with self.lock:
+            return self._request(messages)
+
+    def request_update(self, key : str, values : np.ndarray):
+        """Publishes values of shape (time, cells) in shared memory and
+        asks every worker to update its shard of key"""
+        with self.lock:
+            if self.shared is None or self.shared.size < values.nbytes:
+                self._close_shared()
+                # room for larger chunks
+                self.shared = shared_memory.SharedMemory(
+                    create = True, size = max(2 * values.nbytes, 1)
+                )
+            shared_values = np.ndarray(
+                values.shape, dtype = np.float64, buffer = self.shared.buf
+            )
+            np.copyto(shared_values, values)
+            del shared_values
+            return self._request(
+                [("update", key, self.shared.name, values.shape)] * len(self)
+            )
+
+    def _request(self, messages : list):
+        while self.dropped:
+            key = self.dropped.pop()
+            self._send_all([("drop", key)] * len(self))
+        return self._send_all(messages)
+
+    def _send_all(self, messages : list):
+        for connection, message in zip(self.connections, messages):
+            connection.send(message)
+        answers = []
+        errors = []
+        for i, connection in enumerate(self.connections):
+            try:
+                status, answer = connection.recv()
+            except EOFError:
+                status, answer = "error", f"digest worker {i} has stopped"
+            if status == "error":
+                errors.append(answer)
+            answers.append(answer)
+        if errors:
+            raise RuntimeError(
+                "The digest workers failed with:\n" + "\n".join(errors)
+            )
+        return answers
+
+    def _close_shared(self):
+        if self.shared is not None:
+            self.shared.close()
+            self.shared.unlink()
+            self.shared = None
+
+    def close(self):
+        """Stops the workers and frees the shared memory"""
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.send(("close",))
+                except OSError:
+                    pass
+            for process in self.processes:
+                process.join(timeout = 10)
+                if process.is_alive():
+                    process.terminate()
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+            self.processes = []
+            self._close_shared()
+
+def run_worker(connection):
+    """Body of the worker processes. Keeps the digests of its shards in
+    a dictionary key -> (first cell, last cell + 1, list of TDigest) and
+    answers the requests until it is closed."""
+    shards = {}
+    shared = None
+    while True:
+        message = connection.recv()
+        command, args = message[0], message[1:]
+        if command == "close":
+            break
+        try:
+            if command == "update":
+                key, name, shape = args
+                if shared is None or shared.name != name:
+                    if shared is not None:
+                        shared.close()
+                    shared = shared_memory.SharedMemory(name = name)
+                start, stop, digests = shards[key]
+                values = np.ndarray(
+                    shape, dtype = np.float64, buffer = shared.buf
+                )[:, start:stop]
+                update_shard(digests, values)
+                del values
+                answer = None
+            else:
+                answer = WORKER_COMMANDS[command](shards, *args)
+        except Exception: # pylint: disable=broad-except
+            connection.send(("error", traceback.format_exc()))
+        else:
+            connection.send(("ok", answer))
+    if shared is not None:
+        shared.close()
+    connection.close()
+
+def update_shard(digests : list, values : np.ndarray):
+    """Updates the digests of a shard with values of shape (time, cells),
+    as update_statistics.update_tdigest"""
+    if values.shape[0] == 1:
+        for j, digest in enumerate(digests):
+            digest.update(values[0, j])
+    else:
+        for j, digest in enumerate(digests):
+            digest.update(values[:, j])
+
+def create_shard(shards : dict, key : str, start : int, stop : int,
+                 compression : float, file_name : str = None,
+                 digests : list = None
+                ):
+    """Creates the digests of the cells start to stop, loaded from the
+    shard file file_name or the given digests if there are any"""
+    if file_name is not None:
+        with open(file_name, "rb") as file:
+            digests = pickle.load(file)
+    elif digests is None:
+        # crick is only imported by the workers
+        from crick import TDigest
+        digests = [TDigest(compression = compression)
+                   for _ in range(stop - start)]
+    shards[key] = (start, stop, digests)
+
+def quantile_shard(shards : dict, key : str, q) -> np.ndarray:
+    """Percentiles of shape (len(q), cells) of a shard"""
+    digests = shards[key][2]
+    percentiles = np.empty((np.size(q), len(digests)))
+    for j, digest in enumerate(digests):
+        percentiles[:, j] = digest.quantile(q)
+    return percentiles
+
+def histogram_shard(shards : dict, key : str, bins : int, hist_range = None):
+    """Counts and edges of shape (bins, cells) and (bins + 1, cells) of
+    a shard"""
+    digests = shards[key][2]
+    counts = np.empty((bins, len(digests)))
+    edges = np.empty((bins + 1, len(digests)))
+    for j, digest in enumerate(digests):
+        counts[:, j], edges[:, j] = digest.histogram(
+            bins = bins, range = hist_range
+        )
+    return counts, edges
+
+def save_shard(shards : dict, key : str, file_name : str):
+    """Pickles the digests of a shard to its own checkpoint file"""
+    write_bytes(file_name, pickle.dumps(shards[key][2]))
+
+def get_shard(shards : dict, key : str) -> list:
+    """The digests of a shard"""
+    return shards[key][2]
+
+def drop_shard(shards : dict, key : str):
+    """Removes the digests of a shard"""
+    shards.pop(key, None)
+
+WORKER_COMMANDS = {
+    "create": create_shard,
+    "quantile": quantile_shard,
+    "histogram": histogram_shard,
+    "save": save_shard,
+    "get": get_shard,
+    "drop": drop_shard,
+}
@@ -0,0 +1,159 @@
+"""Module for the plain numpy input of Opa.compute_numpy. The incoming
+values and time stamps are held in a light weight container that has
+the few parts of the xr.DataArray interface used by the time checks and
+the update_* functions, so that the same code runs on plain arrays
+without the xarray overhead."""
+
+from typing import Dict, Sequence
+
+import numpy as np
+
+class TimeCoord:
+    """Time co-ordinate of an ArrayChunk. Like the time co-ordinate
+    of an xr.DataArray, the time stamps are found in both data and
+    values.
+    """
+    def __init__(self, time_stamps : np.ndarray):
+        self.data = time_stamps
+        self.values = time_stamps
+        self.attrs = {}
+
+class ArrayChunk:
+    """Incoming data chunk given as a numpy array with time as the
+    first dimension and an array of datetime64 time stamps.
+    """
+    def __init__(self, values : np.ndarray, time_stamps : np.ndarray,
+                 name : str = None, dims : Sequence[str] = None,
+                 attrs : Dict = None
+                ):
+        """Initialisation of the array chunk
+
+        Arguments
+        ----------
+        values : np.ndarray. Incoming data, with time as the first
+                dimension.
+        time_stamps : np.ndarray. Time stamps of the first dimension of
+                values, converted to datetime64[ns].
+        name : str. Name of the variable.
+        dims : Sequence[str]. Names of the dimensions of values, starting
+                with 'time'. If not given they are set to 'time',
+                'dim_1', 'dim_2' ...
+        attrs : dict. Attributes of the variable.
+        """
+        values = np.asarray(values)
+        time_stamps = np.asarray(time_stamps, dtype="datetime64[ns]")
+
+        if values.ndim == 0 or time_stamps.ndim != 1:
+            raise ValueError(
+                "compute_numpy needs values with a time dimension first "
+                "and a one dimensional array of time stamps."
+            )
+        if np.size(time_stamps) != np.shape(values)[0]:
+            raise ValueError(
+                f"Got {np.size(time_stamps)} time stamps for "
+                f"{np.shape(values)[0]} time steps of data."
+            )
+
+        if dims is None:
+            dims = ["time"] + [f"dim_{i}" for i in range(1, values.ndim)]
+        dims = tuple(dims)
+        if len(dims) != values.ndim or dims[0] != "time":
+            raise ValueError(
+                f"dims {dims} do not match the {values.ndim} dimensions of "
+                "the data, with 'time' as the first dimension."
+            )
+
+        self.data = values
+        self.time = TimeCoord(time_stamps)
+        self.name = name
+        self.dims = dims
+        self.attrs = {} if attrs is None else attrs
+
+    @property
+    def values(self):
+        """Incoming data as a numpy array"""
+        return self.data
+
+    @property
+    def shape(self):
+        """Shape of the incoming data"""
+        return self.data.shape
+
+    @property
+    def size(self):
+        """Size of the incoming data"""
+        return self.data.size
+
+    @property
+    def dtype(self):
+        """Data type of the incoming data"""
+        return self.data.dtype
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the incoming data"""
+        return self.data.nbytes
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.data, dtype=dtype)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __mul__(self, other):
+        return self._new(self.data * other, self.time.data)
+
+    __rmul__ = __mul__
+
+    def _new(self, values : np.ndarray, time_stamps : np.ndarray):
+        """Creates a new ArrayChunk with the same name, dims and attrs"""
+        chunk = ArrayChunk.__new__(ArrayChunk)
+        chunk.data = values
+        chunk.time = TimeCoord(time_stamps)
+        chunk.name = self.name
+        chunk.dims = self.dims
+        chunk.attrs = self.attrs
+        return chunk
+
+    def get_axis_num(self, dim : str):
+        """Time is always the first dimension"""
+        return self.dims.index(dim)
+
+    def isel(self, time : slice):
+        """Selects a slice of the time dimension"""
+        return self._new(self.data[time], self.time.data[time])
+
+    def tail(self, time : int = 1):
+        """Selects the last time steps"""
+        return self.isel(time=slice(-time, None))
+
+    def copy(self, data : np.ndarray = None):
+        """Copy with, optionally, new data of the same shape"""
+        if data is None:
+            data = self.data.copy()
+        return self._new(np.asarray(data), self.time.data)
+
+    # reductions used by the two-pass functions of the update_statistics
+    # module (numpy passes the reduction on to these methods). The time
+    # stamp of the reduced chunk is its last time stamp.
+    def mean(self, axis=None, dtype=None, out=None, keepdims=False, **kwargs):
+        return self._new(
+            np.mean(self.data, axis=axis, dtype=dtype, keepdims=keepdims,
+                    **kwargs),
+            self.time.data[-1:]
+        )
+
+    def sum(self, axis=None, dtype=None, out=None, keepdims=False, **kwargs):
+        return self._new(
+            np.sum(self.data, axis=axis, dtype=dtype, keepdims=keepdims,
+                   **kwargs),
+            self.time.data[-1:]
+        )
+
+    def var(self, axis=None, dtype=None, out=None, ddof=0, keepdims=False,
+            **kwargs):
+        return self._new(
+            np.var(self.data, axis=axis, dtype=dtype, ddof=ddof,
+                   keepdims=keepdims, **kwargs),
+            self.time.data[-1:]
+        )
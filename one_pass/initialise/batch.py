@@ -0,0 +1,92 @@
+"""Module for the micro-batching buffer. When batch_size or
+batch_max_bytes is given in the request, incoming chunks are held
+in memory and passed to the statistic together, so that single time
+step chunks use the weight > 1 update. The buffer is pickled with the
+rest of the Opa, so it is kept in the checkpoint."""
+
+from typing import List
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+class Batch:
+    """Buffer holding the incoming chunks that have not yet been
+    passed to the statistic.
+    """
+    def __init__(self):
+        """Initialisation of the batch class
+
+        data : List[xr.DataArray]. Buffered chunks, in the order they
+                were given.
+        weight : int. Total number of buffered time steps.
+        nbytes : int. Total size in bytes of the buffered chunks.
+        last_time_stamp : pd.Timestamp. Last buffered time stamp.
+        """
+        self.data : List[xr.DataArray] = []
+        self.weight : int = 0
+        self.nbytes : int = 0
+        self.last_time_stamp : pd.Timestamp = None
+
+    def reset_batch_attributes(self):
+        """Empties the buffer once it has been passed to the statistic"""
+        self.data = []
+        self.weight = 0
+        self.nbytes = 0
+        self.last_time_stamp = None
+
+    def is_contiguous(self, opa_self : object, data_source : xr.DataArray):
+        """Checks if the incoming chunk directly follows the buffered
+        time steps. If it doesn't, the buffer has to be flushed first so
+        that the time stamp checks see the data as it was given.
+        """
+        if self.weight == 0:
+            return True
+        first_time_stamp = pd.to_datetime(np.min(data_source.time.data))
+        min_diff = (first_time_stamp - self.last_time_stamp).total_seconds() / 60
+        return min_diff == opa_self.request.time_step
+
+    def add(self, data_source : xr.DataArray):
+        """Adds an incoming chunk to the buffer"""
+        self.data.append(data_source)
+        self.weight += np.size(data_source.time.data)
+        self.nbytes += data_source.nbytes
+        self.last_time_stamp = pd.to_datetime(np.max(data_source.time.data))
+
+    def should_flush(self, opa_self : object):
+        """Checks if the buffer needs to be passed to the statistic. This
+        is when it holds batch_size time steps or batch_max_bytes bytes,
+        when the statistic has not been initialised yet (the time checks
+        need to see the data to find the start of the statistic) or when
+        the buffer reaches the end of the statistic (or of the output_freq
+        for continuous statistics), so that finished statistics are output
+        as soon as they are complete.
+        """
+        if self.weight == 0:
+            return False
+        request = opa_self.request
+        if request.batch_size is not None and self.weight >= request.batch_size:
+            return True
+        if (request.batch_max_bytes is not None
+                and self.nbytes >= request.batch_max_bytes):
+            return True
+        if opa_self.time.n_data is None or opa_self.time.count is None:
+            return True
+        return opa_self.time.count + self.weight >= opa_self.time.n_data
+
+    def pop(self):
+        """Empties the buffer
+
+        Returns
+        ---------
+        data_source : xr.DataArray. All the buffered chunks concatenated
+                along the time dimension, None if the buffer is empty.
+        """
+        if self.weight == 0:
+            return None
+        if len(self.data) == 1:
+            data_source = self.data[0]
+        else:
+            data_source = xr.concat(self.data, "time")
+        self.reset_batch_attributes()
+        return data_source
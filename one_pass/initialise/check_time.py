@@ -405,7 +405,26 @@ def check_have_seen(opa_self, time_stamp_min : int):
 
     return already_seen
 
-def check_time_stamp(opa_self, data_source : xr.DataArray, weight : int):
+def get_time_stamp_list(data_source : xr.DataArray):
+    """Creates the sorted list of pandas time stamps of the incoming
+    data. Assumes that the incoming data has a time dimension.
+
+    Arguments
+    ----------
+    data_source : xr.DataArray. Incoming data with associated timestamp(s)
+
+    Returns
+    ---------
+    time_stamp_list : List[pd.Timestamp]. Sorted list of the time stamps
+    """
+    time_stamp_sorted = sorted(data_source.time.data)
+    time_stamp_list = [pd.to_datetime(x) for x in time_stamp_sorted]
+
+    return time_stamp_list
+
+def check_time_stamp(opa_self, data_source : xr.DataArray, weight : int,
+        time_stamp_list : List[pd.Timestamp] = None
+    ):
     """Function to check the incoming timestamps of the data and check if it is
     the first one of the required statistic. If there are multiple incoming
     timestamps, (weight > 1) it will loop through them. First the time stamp
@@ -433,6 +452,10 @@ def check_time_stamp(opa_self, data_source : xr.DataArray, weight : int):
     opa_self : Opa class
     data_source: Incoming xr.DataArray with associated timestamp(s)
     weight: the length along the time-dimension of the incoming array
+    time_stamp_list : List[pd.Timestamp]. Optional sorted list of the incoming
+            time stamps. If already built (e.g. by OpaGroup, which shares it
+            between all of its statistics) it is used as is, otherwise it is
+            created here from data_source.
 
     Returns
     ---------
@@ -457,9 +480,8 @@ def check_time_stamp(opa_self, data_source : xr.DataArray, weight : int):
             and weight is greater than 1, it will check the other incoming pieces
             of data to see if they correspond to the initial statistic
     """
-    # assuming that incoming data has a time dimension
-    time_stamp_sorted = sorted(data_source.time.data)
-    time_stamp_list = [pd.to_datetime(x) for x in time_stamp_sorted]
+    if time_stamp_list is None:
+        time_stamp_list = get_time_stamp_list(data_source)
 
     index = 0
     # boolean flag, don't exit the loop unless this is set to True
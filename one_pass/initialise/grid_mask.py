@@ -0,0 +1,180 @@
+"""Module for the request key mask. Only the active cells of the grid
+(e.g. land or a region) are computed: every incoming chunk is gathered
+once into a compressed chunk of shape (time, active cells), all the
+rolling summaries, digests and checkpoints only hold the active cells,
+and the outputs are scattered back onto the full grid, with NaN for the
+inactive cells, when the final statistic is created. Integer outputs,
+such as the counts of a histogram, are then float64."""
+
+import os
+
+import numpy as np
+import xarray as xr
+
+from one_pass.initialise.array_chunk import ArrayChunk
+
+# name of the dimension of the active cells in the compressed chunks
+MASK_DIM = "active_cell"
+
+def load_mask(mask) -> np.ndarray:
+    """Boolean mask of the active cells from the request key mask.
+
+    Arguments
+    ----------
+    mask : array like (np.ndarray, xr.DataArray, nested lists) with the
+            shape of the grid, or the path of a file holding one
+            variable which xr.open_dataarray can read. Non zero values
+            are active, zeros and NaN are not. A time dimension of the
+            mask (as in many land sea masks) is dropped.
+
+    Returns
+    ---------
+    mask : np.ndarray of bool.
+    """
+    if isinstance(mask, (str, os.PathLike)):
+        with xr.open_dataarray(mask) as mask_file:
+            mask = mask_file.load()
+
+    if isinstance(mask, xr.DataArray) and "time" in mask.dims:
+        mask = mask.isel(time=0)
+
+    mask = np.asarray(mask)
+    if mask.dtype.kind == "f":
+        # NaN is not active
+        mask = np.nan_to_num(mask)
+    mask = mask != 0
+    if not np.any(mask):
+        raise ValueError("The mask does not have any active cells.")
+    return mask
+
+class GridMask:
+    """Active cells of the grid of a masked request. Created from the
+    request key mask when the first chunk arrives, and not pickled, as
+    the mask is in the request.
+
+    Attributes
+    ----------
+    grid_shape : tuple. Shape of the grid, without time.
+    cells : np.ndarray. Flat indexes of the active cells.
+    dims : tuple. Names of the dimensions of the incoming data, for the
+            outputs.
+    template : xr.DataArray or ArrayChunk. Last time step of the last
+            incoming chunk on the full grid, only used for the names,
+            dimensions and co-ordinates of the outputs.
+    """
+
+    def __init__(self, mask):
+        mask = load_mask(mask)
+        self.grid_shape = mask.shape
+        self.cells = np.flatnonzero(mask)
+        self.dims = None
+        self.template = None
+
+    @property
+    def n_cells(self):
+        """Number of active cells"""
+        return np.size(self.cells)
+
+    def compress(self, data_source):
+        """Gathers the active cells of an incoming chunk.
+
+        Arguments
+        ----------
+        data_source : xr.DataArray or ArrayChunk on the full grid.
+
+        Returns
+        ---------
+        data_source : the same type, of shape (time, active cells), with
+                the name, attributes and time co-ordinate of data_source.
+        """
+        if data_source.get_axis_num("time") != 0:
+            data_source = data_source.transpose("time", ...)
+
+        values = np.asarray(data_source.values)
+        if values.shape[1:] != self.grid_shape:
+            raise ValueError(
+                f"The mask has the shape {self.grid_shape} but the data "
+                f"has the shape {values.shape[1:]} without time."
+            )
+        self.dims = tuple(data_source.dims)
+        self.template = data_source.isel(time=slice(-1, None))
+
+        compressed = np.take(
+            np.reshape(values, (values.shape[0], -1)), self.cells, axis=1
+        )
+        if isinstance(data_source, ArrayChunk):
+            chunk = data_source._new(compressed, data_source.time.data)
+            chunk.dims = ("time", MASK_DIM)
+            return chunk
+
+        return xr.DataArray(
+            compressed, dims=("time", MASK_DIM),
+            coords={"time": data_source.time}, name=data_source.name,
+            attrs=data_source.attrs
+        )
+
+    def expand(self, values : np.ndarray, fill=None) -> np.ndarray:
+        """Scatters values with the active cells as the last dimension
+        back onto the full grid.
+
+        Arguments
+        ----------
+        values : np.ndarray of shape (..., active cells).
+        fill : value of the inactive cells, NaN by default and NaT for
+                time stamps. Integer and boolean values (e.g. the counts of
+                a histogram) are converted to float64, so that the inactive
+                cells are NaN and can not be mistaken for empty bins.
+
+        Returns
+        ---------
+        values : np.ndarray of shape (..., *grid_shape).
+        """
+        values = np.asarray(values)
+        if fill is None:
+            if values.dtype.kind == "M":
+                fill = np.datetime64("NaT")
+            else:
+                if values.dtype.kind in "iub":
+                    values = values.astype(np.float64)
+                fill = np.nan
+        full = np.full(
+            (*values.shape[:-1], int(np.prod(self.grid_shape))), fill,
+            dtype=values.dtype
+        )
+        full[..., self.cells] = values
+        return np.reshape(full, (*values.shape[:-1], *self.grid_shape))
+
+def get_grid_mask(opa_self : object):
+    """The GridMask of a masked request, created from the request on
+    first use. None if the request has no mask."""
+    if opa_self.request.mask is None:
+        return None
+    if getattr(opa_self, "grid_mask", None) is None:
+        opa_self.grid_mask = GridMask(opa_self.request.mask)
+    return opa_self.grid_mask
+
+def mask_chunk(opa_self : object, data_source):
+    """Compresses an incoming chunk to the active cells of the mask, or
+    returns it unchanged if the request has no mask"""
+    grid_mask = get_grid_mask(opa_self)
+    if grid_mask is None:
+        return data_source
+    return grid_mask.compress(data_source)
+
+def unmask_cells(opa_self : object, values : np.ndarray, fill=None):
+    """Scatters an output of the active cells back onto the full grid
+    (see GridMask.expand), or returns it unchanged if the request has
+    no mask"""
+    grid_mask = get_grid_mask(opa_self)
+    if grid_mask is None:
+        return values
+    return grid_mask.expand(values, fill)
+
+def get_output_template(opa_self : object, data_source):
+    """The incoming data on the full grid used to create the outputs:
+    the last time step of the last chunk for masked requests, otherwise
+    data_source itself"""
+    grid_mask = get_grid_mask(opa_self)
+    if grid_mask is None or grid_mask.template is None:
+        return data_source
+    return grid_mask.template
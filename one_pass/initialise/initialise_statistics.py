@@ -3,10 +3,101 @@ from typing import List
 import logging
 
 import numpy as np
-import dask.array as da
 import xarray as xr
-from crick import TDigest
-import tqdm
+
+# default durations in minutes of the iams statistic, used when the
+# request does not set iams_durations
+IAMS_DURATIONS = (5,10,15,20,30,45,60,90,120,180,240,
+    360,540,720,1080,1440,2880,4320,5760,7200,8640,10080)
+
+# largest number of time steps of percentile statistics that keep all
+# their values by default. At 8 bytes per value, the buffer of a grid
+# cell is then at most 2 KB, about the memory of one crick TDigest
+EXACT_PERCENTILE_MAX_N = 256
+
+def get_sketch_backend(opa_self : object):
+    """Backend of the digests of percentile, histogram and bias_correction
+    set by the request key sketch_backend. By default, percentile
+    statistics of up to EXACT_PERCENTILE_MAX_N time steps keep all their
+    values for exact percentiles, histograms with a range count their
+    fixed bins exactly, and the others use crick. The digest_workers
+    always update crick digests."""
+    sketch_backend = getattr(opa_self.request, "sketch_backend", None)
+    if sketch_backend is not None:
+        return sketch_backend
+    if getattr(opa_self.request, "digest_workers", None):
+        return "crick"
+    if (opa_self.request.stat == "histogram"
+            and getattr(opa_self.request, "range", None) is not None):
+        return "exact"
+    if (opa_self.request.stat == "percentile"
+            and opa_self.request.stat_freq != "continuous"
+            and not opa_self.request.rollup_freq
+            and opa_self.time.n_data <= EXACT_PERCENTILE_MAX_N):
+        return "exact"
+    return "crick"
+
+def get_compression(opa_self : object):
+    """Compression of the t-digests set by the request key compression,
+    1 by default"""
+    compression = opa_self.request.compression
+    if compression is None:
+        compression = 1
+    return compression
+
+# the sketches are imported when they are created, as the statistics
+# package imports this module
+def init_array_tdigest(opa_self : object, n_cells : int):
+    """ArrayTDigest of all the grid cells"""
+    from one_pass.statistics.array_tdigest import ArrayTDigest
+    return ArrayTDigest(n_cells, get_compression(opa_self))
+
+def init_exact(opa_self : object, n_cells : int):
+    """BinCounts of the fixed bins of histograms, or SampleBuffer of all
+    the time steps of percentiles"""
+    if opa_self.request.stat == "histogram":
+        from one_pass.statistics.bin_counts import BinCounts
+        return BinCounts(
+            n_cells, getattr(opa_self.request, "bins", None) or 10,
+            opa_self.request.range
+        )
+    from one_pass.statistics.sample_buffer import SampleBuffer
+    return SampleBuffer(opa_self.time.n_data, n_cells)
+
+def init_ddsketch(opa_self : object, n_cells : int):
+    """DDSketch of all the grid cells, with the request keys
+    relative_accuracy and sketch_buckets"""
+    from one_pass.statistics import ddsketch
+    return ddsketch.DDSketch(
+        n_cells,
+        opa_self.request.relative_accuracy or ddsketch.RELATIVE_ACCURACY,
+        opa_self.request.sketch_buckets or ddsketch.N_BUCKETS
+    )
+
+# functions creating the GridSketch of every sketch_backend other than
+# crick, from the Opa class and the number of grid cells
+SKETCH_BACKENDS = {
+    "array": init_array_tdigest,
+    "exact": init_exact,
+    "ddsketch": init_ddsketch,
+}
+
+def get_state_dtype(opa_self : object):
+    """Data type of the rolling summaries of mean, sum, var and std set by
+    the request key state_dtype, float64 by default"""
+    state_dtype = getattr(opa_self.request, "state_dtype", None)
+    return np.dtype(state_dtype or np.float64)
+
+def get_count_dtype(opa_self : object):
+    """Smallest unsigned integer type holding the counts of one statistic,
+    used for the thresh_exceed counters. Continuous statistics keep
+    counting after every output, so they use uint32."""
+    if opa_self.request.stat_freq == "continuous":
+        return np.dtype(np.uint32)
+    for dtype in (np.uint8, np.uint16):
+        if opa_self.time.n_data <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint32)
 
 class OpaStatistics:
     """Class that contains all of the cumulative statistics. Everything
@@ -56,6 +147,17 @@ class OpaStatistics:
             self.histogram_bin_edges_cum : np.ndarray[float] = None
             self.final2_cum : xr.Dataset = None
 
+        if opa_self.request.skipna:
+            # number of valid (not NaN) time steps of every cell
+            self.valid_count_cum : np.ndarray[int] = None
+
+        if get_state_dtype(opa_self) == np.float32:
+            # rounding errors of the float32 rolling summaries, see
+            # update_statistics.get_compensation
+            for key in ("mean_cum", "var_cum", "sum_cum"):
+                if hasattr(self, key):
+                    setattr(self, key.replace("_cum", "_comp_cum"), None)
+
         if opa_self.request.stat == "bias_correction":
             # dpening on the variable we either want daily aggregations
             # as mean values or as summuation values.
@@ -78,23 +180,19 @@ class OpaStatistics:
         durations : modified list of durations without ones
                 that are too short
         """
-        # loop over duration windows that fall in the range of the time step
-        durations = [d for d in durations if d >= opa_self.request.time_step]
-
-        # only select whole numbers
-        for d in durations:
-            if d%opa_self.request.time_step != 0:
-                durations.remove(d)
+        # duration windows that fall in the range of the time step and
+        # are whole multiples of it
+        durations = [
+            int(d) for d in durations if d >= opa_self.request.time_step
+            and d % opa_self.request.time_step == 0
+        ]
 
-        # creates integer list
-        durations = list(map(int, durations))
-
-        return durations
+        return sorted(set(durations))
 
     def _init_ndata_durations(self, opa_self : object, value : np.ndarray):
-        """This function picks the longest duration window
-        and create a zero filled array with one dimension equal to the length
-        of the maximum duration divided by the time step
+        """This function works out the number of time steps in every
+        duration window and creates the ring buffer of running sums,
+        which has to hold one more time step than the longest duration
 
         Attributes
         ----------
@@ -104,34 +202,17 @@ class OpaStatistics:
 
         Returns
         ----------
-        opa_self.iams.n_data_duration : number of time steps for each duration that
-                need to be stored
-        opa_self.iams.rolling_data : empty array to store the maximum value of
-                n_data_duration
-        opa_self.iams.count_duration : count to know how far through the rolling
-                window the statistic is
+        opa_self.iams.n_data_durations : number of time steps for each duration
+        opa_self.iams.rolling_sums : zero filled ring buffer of the running
+                sums of the data
         """
-        n_data_duration = np.zeros(np.size(opa_self.iams.durations))
-        # loop to calculate n data for each duration period
-        for i in range(np.size(opa_self.iams.durations)):
-            # calculate n_data_duration for each duration period
-            n_data_duration[i] = int(
-                (opa_self.iams.durations[i])/opa_self.request.time_step
-            )
-
-        # set attribute containing list all n_data_durations
-        opa_self.iams.n_data_durations = n_data_duration
-            # set count at 0 for each duration, each count in a list
-        opa_self.iams.count_durations = np.zeros(np.size(opa_self.iams.durations))
-        # setting count_durations_full = 0, this is do count + full_length
-        opa_self.iams.count_durations_full = np.zeros(np.size(opa_self.iams.durations))
+        opa_self.iams.n_data_durations = (
+            np.array(opa_self.iams.durations) // opa_self.request.time_step
+        ).astype(np.int64)
 
-        # create empty array to store the maximum number of time steps we need
-        # using the last (max) value of n_data_duration
-        new_shape = (int(n_data_duration[-1]), np.shape(value)[1:])
-        # unpack the nested tuple
-        new_shape_whole = (new_shape[0], *new_shape[1])
-        opa_self.iams.rolling_data = np.zeros(new_shape_whole)
+        new_shape = (int(opa_self.iams.n_data_durations[-1]) + 1,
+                     *np.shape(value)[1:])
+        opa_self.iams.rolling_sums = np.zeros(new_shape)
 
     def init_digests(self, opa_self : object):
         """Function to initalise a flat array full of empty 
@@ -144,8 +225,32 @@ class OpaStatistics:
         Returns
         ---------
         opa_self.digests_cum : a flat array of of the size of data_source_tail
-                full of empty t digest objects with compression = 1
+                full of empty t digest objects with compression = 1, or one
+                GridSketch of all the grid cells for the other sketch
+                backends
         """
+        sketch_backend = get_sketch_backend(opa_self)
+        if sketch_backend != "crick":
+            setattr(self, "digests_cum", SKETCH_BACKENDS[sketch_backend](
+                opa_self, opa_self.data_set_info.size_data_source_tail
+            ))
+            return
+
+        compression = get_compression(opa_self)
+
+        if opa_self.request.digest_workers:
+            from one_pass.statistics.sharded_digests import ShardedDigests
+            setattr(self, "digests_cum", ShardedDigests(
+                opa_self.data_set_info.size_data_source_tail,
+                opa_self.request.digest_workers, compression,
+                opa_self.request.checkpoint_file
+                if opa_self.request.checkpoint else None
+            ))
+            return
+
+        # crick is only imported for the statistics that use digests
+        from crick import TDigest
+
         # list of dictionaries for each grid cell, preserves order
         digest_list = [{} for _ in range(
                 opa_self.data_set_info.size_data_source_tail
@@ -155,12 +260,8 @@ class OpaStatistics:
                 digest_list, opa_self.data_set_info.size_data_source_tail
             )
 
-        # Read the compression from request. If it wasn't passed, set to 1
-        compression = opa_self.request.compression
-        if compression is None:
-            compression = 1
-
         if opa_self.logger.isEnabledFor(logging.DEBUG):
+            import tqdm
             for j in tqdm.tqdm(
                     range(opa_self.data_set_info.size_data_source_tail),
                     desc="Initialising digests"
@@ -195,20 +296,27 @@ class OpaStatistics:
                     if element[0] != "final2_cum":
                         setattr(self, element[0], None)
 
-    def _initialise_simple_attrs(self, opa_self : object, value : np.ndarray):
+    def _initialise_simple_attrs(self, opa_self : object, value : np.ndarray,
+                                 data_dtype : np.dtype
+                                ):
         """Initialise data structures for 'simple' cumulative stats
         that just require the flatted array shape. For the standard
         deviation need both the mean and variance throughout only
         create std_cum at the end when count = n_data and remove it
-        again to avoid checkpointing another value uncessarily
+        again to avoid checkpointing another value uncessarily. The
+        minimum and maximum only select incoming values, so they keep
+        the data type of the incoming data, data_dtype.
         """
         if opa_self.request.stat in ("var", "std"):
+            # separate arrays, as both are updated in place
             setattr(self, "mean_cum", value)
-            setattr(self, "var_cum", value)
+            setattr(self, "var_cum", value.copy())
 
         elif opa_self.request.stat in ("min", "max"):
-            setattr(self, opa_self.request.stat + "_cum", value)
-            setattr(self, "timings_cum", value)
+            setattr(self, opa_self.request.stat + "_cum",
+                    np.zeros(value.shape, dtype=data_dtype))
+            # time stamps as int64 nanoseconds since 1970
+            setattr(self, "timings_cum", np.zeros(value.shape, dtype=np.int64))
         else:
             setattr(self, opa_self.request.stat + "_cum", value)
 
@@ -233,32 +341,50 @@ class OpaStatistics:
                 compressed incoming data.
         opa_self.data_set_info.size_data_source_tail : storing the size of the
                 compressed incoming data
+        opa_self.data_set_info.dims : storing the dimension names of the
+                incoming data, on the full grid for masked requests
 
         Maybe Returns:
         -------
         opa_self.count_continuous : like opa_self.count, counts the number of
                 pieces of data seen but never gets reset
+        self.valid_count_cum : for skipna requests, zero filled counts of
+                the valid time steps of every cell
         """
         data_source_tail = data_source.tail(time=1)
         opa_self.data_set_info.shape_data_source_tail = np.shape(data_source_tail)
         opa_self.data_set_info.size_data_source_tail = np.size(data_source_tail)
+        grid_mask = getattr(opa_self, "grid_mask", None)
+        if grid_mask is not None and grid_mask.dims is not None:
+            # the rolling summaries only hold the active cells
+            opa_self.data_set_info.dims = grid_mask.dims
+        else:
+            opa_self.data_set_info.dims = tuple(data_source.dims)
 
-        # forcing computation in float64, empty numpy array
+        # forcing computation in float64 (or the float32 of state_dtype),
+        # empty numpy array
         value = np.zeros(
-                opa_self.data_set_info.shape_data_source_tail, dtype=np.float64
+                opa_self.data_set_info.shape_data_source_tail,
+                dtype=get_state_dtype(opa_self)
             )
 
         if opa_self.request.stat_freq == "continuous":
             opa_self.time.count_continuous = 0
             opa_self.time.init_count_time_stamp = opa_self.time.time_stamp
 
+        if opa_self.request.skipna:
+            setattr(self, "valid_count_cum", np.zeros(
+                opa_self.data_set_info.shape_data_source_tail,
+                dtype=get_count_dtype(opa_self)
+            ))
+
         if opa_self.request.stat not in ("bias_correction",
                         "percentile",
                         "histogram",
                         "iams",
                         "thresh_exceed"):
 
-            self._initialise_simple_attrs(opa_self, value)
+            self._initialise_simple_attrs(opa_self, value, data_source.dtype)
 
         elif opa_self.request.stat == "thresh_exceed":
             new_shape = (np.shape(value)[0],
@@ -266,19 +392,20 @@ class OpaStatistics:
                             np.shape(value)[1:]
                         )
             new_shape_whole = (new_shape[0], new_shape[1], *new_shape[2])
-            if hasattr(data_source, "compute"):
-                opa_self.new_shape_whole = new_shape_whole
-                thresh_value = da.zeros(new_shape_whole)
-            else:
-                thresh_value = np.zeros(new_shape_whole)
+            # compact integer counters, see get_count_dtype
+            thresh_value = np.zeros(
+                new_shape_whole, dtype=get_count_dtype(opa_self)
+            )
 
             setattr(self, opa_self.request.stat + "_cum", thresh_value)
 
         elif opa_self.request.stat == "iams":
 
-            # list all of all possible durations in minutes for iams stat
-            durations = (5,10,15,20,30,45,60,90,120,180,240,
-                360,540,720,1080,1440,2880,4320,5760,7200,8640,10080)
+            # durations in minutes for iams stat, from the request or the
+            # defaults
+            durations = getattr(opa_self.request, "iams_durations", None)
+            if durations is None:
+                durations = IAMS_DURATIONS
             # removing durations smaller than time step and not full
             # multiples
             opa_self.iams.durations = self._duration_pick(opa_self, durations)
@@ -2,10 +2,10 @@
 from typing import Dict, List, Optional
 from dataclasses import dataclass
 
+import asyncio
 import os
 import pickle
 import logging
-import zarr
 
 import numpy as np
 import xarray as xr
@@ -15,8 +15,13 @@ from one_pass.check_request import check_request
 from one_pass.initialise import initialise_statistics
 from one_pass.initialise import initialise_time
 from one_pass.initialise import time_append
+from one_pass.initialise.array_chunk import ArrayChunk
+from one_pass.initialise.batch import Batch
 from one_pass.initialise.check_time import check_time_stamp
+from one_pass.initialise.check_time import get_time_stamp_list
 from one_pass.initialise.check_variable import check_variable
+from one_pass.initialise.grid_mask import mask_chunk
+from one_pass.checkpointing import state_cache
 from one_pass.checkpointing.write_checkpoint import write_checkpoint
 from one_pass.checkpointing.remove_checkpoints import remove_checkpoints
 from one_pass.statistics import bias_correction
@@ -24,11 +29,21 @@ from one_pass.statistics.raw_data import check_raw
 from one_pass.statistics.raw_data import check_raw_for_bc
 from one_pass.statistics.get_final_statistics import get_final_statistics
 from one_pass.statistics.update_statistics import update_statistics
+from one_pass.statistics import segmented_reduction
+from one_pass.statistics.snapshot import get_snapshot
+from one_pass.statistics.rollup import RollUp
+from one_pass.saving.create_arrays import array_output_to_data_set
+from one_pass.saving.create_arrays import create_array_output
+from one_pass.background_writer import BackgroundWriter
+from one_pass.background_writer import WRITER_QUEUE_SIZE
+from one_pass.background_writer import wait_for_pending_writes
 from one_pass.saving.create_file_names import create_file_name
 from one_pass.saving.create_data_sets import create_data_set
 from one_pass.saving.remove_attributes import remove_attributes_continuous
 from one_pass.saving.modify_attributes import update_attributes
 from one_pass.saving.save_final import save_output_nc
+from one_pass.streaming import iter_chunks
+from one_pass.streaming import prefetch_chunks
 
 @dataclass
 class Fixed:
@@ -94,6 +109,61 @@ class Request:
     checkpoint_file : str. Not actually defined in the request but made
             later, attaches checkpoint_filepath with the name of the
             checkpoint file.
+    rollup_freq : List[str]. Optional list of frequencies coarser than
+            stat_freq. Every finished stat_freq statistic is merged into
+            one rolled up statistic per frequency, without passing the raw
+            data again.
+    batch_size : int. Optional number of time steps to buffer in memory
+            before updating the statistic in one batched update.
+    batch_max_bytes : int. Optional size in bytes of the buffer at which
+            it is passed to the statistic.
+    writer_workers : int. Optional number of background threads writing
+            the outputs and checkpoints, so that compute does not wait
+            for the writes.
+    writer_queue_size : int. Optional number of writes that can wait for
+            each writer thread before compute is blocked.
+    iams_durations : List[int]. Optional lengths in minutes of the
+            rolling windows of the iams statistic. Defaults to durations
+            from 5 minutes to 7 days.
+    state_dtype : str. Optional data type of the rolling summaries of
+            mean, sum, var and std, "float64" (default) or "float32".
+            With "float32" every update is computed in float64 and
+            rounded once into the float32 rolling summary, keeping the
+            rounding error in a float32 compensation.
+    sketch_backend : str. Optional backend of the t-digests of the
+            percentile and histogram statistics, "crick" (one crick
+            TDigest per grid cell), "array" (the digests of all the grid
+            cells in numpy arrays, updated for the whole grid at once),
+            "exact" (every value kept for percentiles, exact counts
+            of the fixed bins of the range for histograms) or "ddsketch"
+            (percentile only, fixed memory and relative error). Defaults
+            to "exact" for percentiles of up to 256 time steps and for
+            histograms with a range, and "crick" otherwise.
+    relative_accuracy : float. Optional relative accuracy of the
+            percentiles of the "ddsketch" sketch_backend, 0.01 by
+            default.
+    sketch_buckets : int. Optional number of buckets per grid cell of
+            the "ddsketch" sketch_backend (for the positive and for the
+            negative values), 1024 by default.
+    digest_workers : int. Optional number of worker processes updating
+            the crick digests of the percentile and histogram statistics,
+            each owning a contiguous range of grid cells and writing its
+            own shard of the checkpoint.
+    extract_workers : int. Optional number of threads extracting the
+            percentiles and histograms from the crick digests when a
+            statistic is finished, one per core by default.
+    skipna : bool. Optional, if True the statistics ignore the NaN
+            values of the data and count the valid time steps of every
+            grid cell, which divide the mean and variance of the cell.
+    min_coverage : float. Optional fraction of the time steps of the
+            statistic that a grid cell needs to have valid, otherwise it
+            is NaN in the output. By default only the cells without any
+            valid value are NaN. Only used with skipna.
+    mask : np.ndarray, xr.DataArray or str. Optional mask of the active
+            grid cells, with the shape of the grid without time, or the
+            path of a file holding it. Only the non zero cells are
+            computed and kept in the rolling summaries and checkpoints,
+            the other cells are NaN in the output.
     """
     stat : str = None
     time_step : int = None
@@ -106,6 +176,21 @@ class Request:
     save_filepath : str = None
     checkpoint_file : str = None
     compression : int = None
+    rollup_freq : List[str] = None
+    batch_size : int = None
+    batch_max_bytes : int = None
+    writer_workers : int = None
+    writer_queue_size : int = None
+    iams_durations : List[int] = None
+    state_dtype : str = None
+    sketch_backend : str = None
+    relative_accuracy : float = None
+    sketch_buckets : int = None
+    digest_workers : int = None
+    extract_workers : int = None
+    skipna : bool = False
+    min_coverage : float = None
+    mask : object = None
     bias_adjust: bool = False          # run bias_adjust on input xr.DataArray
     ba_reference_dir: str = None       # directory where reference tdigest pkl are stored
     ba_lower_threshold: float = -np.inf   # do not apply ba on values beyond lower_threshold
@@ -137,12 +222,14 @@ class DataSetInfo:
             (i.e. output_freq > stat_freq) and corresponds to the
             timestamp of the first piece of data in the final appended
             statistic. Used in the final file name.
+    dims : tuple. Names of the dimensions of the incoming data.
     """
     shape_data_source_tail : tuple = None
     size_data_source_tail :int = None
     data_var_attr : dict = None
     data_set_attr: dict = None
     final_time_file_str : str = None
+    dims : tuple = None
 
 @dataclass
 class Iams:
@@ -153,23 +240,15 @@ class Iams:
     durations : List[int]. list of integer values of minutes giving
             the length of the duration windows to be summed
             across.
-    n_data_durations : List[int]. list of integer values in units of
-            time_step (probably hours). durations / request.time_step.
-    count_durations : numpy array of integer values giving the
-            the current count of how many n_data_durations we
-            have completed. Same shape as n_data_durations
-    count_durations_full : numpy array of integer values giving the
-            the current count of how many n_data_durations we
-            have completed. It will not reset after filling the
-            longest duration. Same shape as n_data_durations
-    rolling_data : numpy array containing a subset of the
-            incoming data source.
+    n_data_durations : np.ndarray[int]. number of time steps in every
+            duration, durations / request.time_step.
+    rolling_sums : numpy array holding the running sums of the incoming
+            data of the last n_data_durations[-1] + 1 time steps, as a
+            ring buffer.
     """
     durations : List[int] = None
-    n_data_durations : List[int] = None
-    count_durations : np.ndarray[int] = None
-    count_durations_full : np.ndarray[int] = None
-    rolling_data : np.ndarray[np.float64] = 0
+    n_data_durations : np.ndarray[int] = None
+    rolling_sums : np.ndarray[np.float64] = None
 
 class Opa:
     """The main class. This can have up 8 nested dataclasses or
@@ -219,6 +298,27 @@ class Opa:
                 bias correction which requires different outputs from other
                 statistics. Initialised as BiasCorrection class in
                 bias_correction.
+        rollup : class. Class that will only be initialised if the request
+                contains rollup_freq. Holds the rolled up statistics for
+                each rollup_freq. Initialised as RollUp class in rollup.
+        batch : class. Class that will only be initialised if the request
+                contains batch_size or batch_max_bytes. Buffers the incoming
+                chunks until they are passed to the statistic. Initialised
+                as Batch class in batch.
+        writer : class. Background writer for the outputs and checkpoints.
+                Only started if the request contains writer_workers or
+                when acompute is called, otherwise None. Never pickled.
+        scratch : dict. Work arrays reused by the in-place update kernels
+                of mean, var and sum. Never pickled.
+        moments_cache : MomentsCache. Moments of the incoming data shared
+                with the other statistics of an OpaGroup, otherwise None.
+                Never pickled.
+        grid_mask : GridMask. Active cells of the grid if the request has
+                a mask, created when the first chunk arrives. Never
+                pickled.
+        stale : bool. True once a new Opa has taken over the state of
+                this one from the state cache, after which this Opa can
+                not be computed any more.
         logger : logger class.
         """
         user_request = util.parse_request(user_request)
@@ -227,6 +327,11 @@ class Opa:
         self.keep_checkpoints = keep_checkpoints
         self.data_set_info = DataSetInfo()
         self.fixed = Fixed()
+        self.writer = None
+        self.scratch = {}
+        self.moments_cache = None
+        self.grid_mask = None
+        self.stale = False
         self.logger = self._get_logger(logging_level=logging_level)
         self._process_request(user_request)
         # will check for errors in specified request
@@ -240,12 +345,37 @@ class Opa:
             self.bc = bias_correction.BiasCorrection()
             if self.request.stat == "iams":
                 self.iams = Iams()
+            if self.request.rollup_freq is not None:
+                self.rollup = RollUp(self)
+            if self._batching():
+                self.batch = Batch()
 
         if self.request.checkpoint and self.request.stat != 'raw':
             # Will check for checkpoint file and load if one
             # exists. will never checkpoint for raw data
             self._check_checkpoint()
 
+        if self.request.writer_workers is not None:
+            self._start_writer()
+
+    def __getstate__(self):
+        """The background writer holds threads so is not pickled in
+        the checkpoint, nor are the scratch arrays of the update
+        kernels, the moments shared in an OpaGroup or the grid mask,
+        which is created again from the request"""
+        state = self.__dict__.copy()
+        state["writer"] = None
+        state["scratch"] = {}
+        state["moments_cache"] = None
+        state["grid_mask"] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def _load_pickle(self, file_path : str):
         """Function that will load pickled data from a
         checkpoint file
@@ -270,7 +400,10 @@ class Opa:
     def _check_checkpoint(self):
         """Takes user request and creates the file name of the checkpoint
         file. If the checkpoint file is there it will update the nested
-        class with data from the checkpoint
+        class with data from the checkpoint, or with the state cached when
+        the checkpoint was written if that was done in this process and
+        the file has not changed since, in which case the previous Opa
+        can not be used any more.
 
         Returns:
         --------
@@ -291,8 +424,23 @@ class Opa:
             f"{self.request.stat}.pkl",
         )
 
+        # a previous Opa in this process may still be writing it
+        wait_for_pending_writes(self.request.checkpoint_file)
+
+        # state written by an Opa in this process, no need to load it
+        cached = state_cache.take_state(self.request.checkpoint_file)
+        if cached is not None:
+            self.logger.debug(
+                "Using the cached state of %s", self.request.checkpoint_file
+            )
+            for key, value in vars(cached).items():
+                if key not in ("writer", "stale"):
+                    setattr(self, key, value)
+            # the state now belongs to this Opa
+            cached.stale = True
+
         # see if the checkpoint file exists
-        if os.path.exists(self.request.checkpoint_file):
+        elif os.path.exists(self.request.checkpoint_file):
             self._load_pickle(self.request.checkpoint_file)
 
             # if using a zarr file
@@ -310,11 +458,27 @@ class Opa:
                         )
 
                         if os.path.exists(checkpoint_file_zarr):
+                            import zarr
                             setattr(self.statistics,
                                 element[0],
                                 zarr.load(store=checkpoint_file_zarr),
                             )
 
+            self._check_iams_checkpoint()
+
+    def _check_iams_checkpoint(self):
+        """Checks that an iams checkpoint was not written by an older
+        version, which kept the raw data instead of the ring buffer of
+        running sums and so can not be continued."""
+        if (self.request.stat == "iams"
+                and self.statistics.iams_cum is not None
+                and getattr(self.iams, "rolling_sums", None) is None):
+            raise ValueError(
+                f"The iams checkpoint {self.request.checkpoint_file} was "
+                "written by an older version of one_pass and can not be "
+                "continued, please remove it and start the statistic again."
+            )
+
     def _process_request(self, user_request : dict):
         """Assigns all class attributes from the given user request
 
@@ -389,8 +553,92 @@ class Opa:
         data_source = data_source.isel(time=slice(how_much_left, weight))
         if self.request.stat == "bias_correction":
             Opa.compute_bias_correction(self, data_source)
+        elif segmented_reduction.can_reduce_segments(self, data_source):
+            self._compute_segments(data_source)
         else:
-            Opa.compute(self, data_source, bias_adjust=False)
+            self._compute_remaining(data_source)
+
+    def _compute_remaining(self, data_source : xr.DataArray):
+        """Passes the remaining data of a chunk that spanned the end of
+        the statistic straight to the statistic. It does not bias adjust
+        the data again and it does not go through the micro-batch buffer.
+        """
+        data_source = check_variable(self, data_source)
+        self._compute_data_array(data_source)
+
+    def _compute_segments(self, data_source : xr.DataArray):
+        """Called from _call_recursive instead of passing the remaining
+        data back through compute one statistic at a time. The boundaries
+        of all the complete statistics in the remaining data are found once
+        and every complete statistic is reduced in one vectorised step.
+        Each of them is then finished (saved, appended) as in compute,
+        without writing checkpoints, and only the partial tail is passed
+        to compute to be carried in the rolling summaries.
+
+        Arguments
+        ----------
+        data_source : xr.DataArray. Remaining data, starting at the first
+                time stamp after the statistic that has just finished.
+        """
+        weight = np.size(data_source.time.data)
+        time_stamp_list = get_time_stamp_list(data_source)
+        starts, ends = segmented_reduction.find_complete_periods(
+            self, time_stamp_list
+        )
+
+        if np.size(starts) == 0:
+            self._compute_remaining(data_source)
+            return
+
+        self.logger.debug(
+            "Reducing %s complete %s statistics in one step.",
+            np.size(starts), self.request.stat_freq
+        )
+        reduced = segmented_reduction.reduce_segments(
+            self, data_source, starts, ends
+        )
+
+        for k, (start, end) in enumerate(zip(starts, ends)):
+            # initialises the time and the statistic from the
+            # first time stamp of the period
+            (
+                _,
+                _,
+                already_seen,
+                n_data_att_exist,
+                _,
+            ) = check_time_stamp(
+                self, data_source.isel(time=slice(start, start + 1)), 1,
+                time_stamp_list[start:start + 1]
+            )
+            if (already_seen or n_data_att_exist is False
+                    or self.time.n_data != end - start):
+                # boundaries don't match what compute would do, so
+                # go back to passing the data one statistic at a time
+                self._compute_remaining(
+                    data_source.isel(time=slice(start, weight))
+                )
+                return
+
+            data_source_tail = data_source.isel(time=slice(end - 1, end))
+            check_variable(self, data_source_tail)
+            segmented_reduction.set_segment_state(self, reduced, k)
+            self.time.time_stamp = time_stamp_list[end - 1]
+            self._finish_statistic(
+                1, 1, data_source_tail, checkpoint=False
+            )
+
+        if ends[-1] < weight:
+            self._compute_remaining(
+                data_source.isel(time=slice(ends[-1], weight))
+            )
+
+        if self.request.checkpoint and (
+                self.append.append_checkpoint_flag
+                or (ends[-1] == weight and self._rollup_in_progress())
+            ):
+            write_checkpoint(self)
+            self.append.append_checkpoint_flag = False
 
     def _full_continuous_data(self, data_source : xr.DataArray,
                               how_much_left : int, weight : int):
@@ -424,9 +672,24 @@ class Opa:
             return dm, dm2
         return dm
 
+    def _rollup_in_progress(self):
+        """Checks if a rolled up statistic has started but is not
+        complete, meaning the checkpoint is still required even though
+        the stat_freq statistic is finished.
+        """
+        return (self.request.rollup_freq is not None
+                and self.rollup.in_progress())
+
+    def _write_rollup_checkpoint(self, checkpoint : bool = True):
+        """Writes the checkpoint after a finished statistic if a rolled
+        up statistic is still in progress."""
+        if (checkpoint and self.request.checkpoint
+                and self._rollup_in_progress()):
+            write_checkpoint(self)
+
     def _finished_no_append(
             self, how_much_left  : int, weight : int,
-            data_source : xr.DataArray
+            data_source : xr.DataArray, checkpoint : bool = True
         ):
         """ Called when n_data = count and append.time_append = 1, meaning
         the final xr.Dataset will have a time dimension of 1 and statistics do
@@ -456,12 +719,16 @@ class Opa:
         # if there's more to compute - call before return
         if how_much_left < weight:
             self._call_recursive(how_much_left, weight, data_source)
+        else:
+            self._write_rollup_checkpoint(checkpoint)
 
         if self.request.stat == "histogram":
             return dm, dm2
         return dm
 
-    def _final_append(self, how_much_left, weight, data_source):
+    def _final_append(self, how_much_left, weight, data_source,
+                      checkpoint : bool = True
+                    ):
         """Last call when both n_data == count and the overall
         count_append = time_append. It will first save
         """
@@ -480,9 +747,15 @@ class Opa:
         # if there's more to compute - call before return
         if how_much_left < weight:
             self._call_recursive(how_much_left, weight, data_source)
+        else:
+            self._write_rollup_checkpoint(checkpoint)
 
-    def _middle_append(self, how_much_left, weight, data_source):
-        """Appending to the final xr.Dataset this isn't full yet"""
+    def _middle_append(self, how_much_left, weight, data_source,
+                       checkpoint : bool = True
+                    ):
+        """Appending to the final xr.Dataset this isn't full yet. If
+        checkpoint is False, the checkpoint is left to the caller
+        (used by _compute_segments)."""
 
         self.append.append_checkpoint_flag = True
         # for histograms and percentiles we don't need to checkpoint
@@ -499,17 +772,19 @@ class Opa:
         # checkpoint the data once after all the recursive calls are
         # finished. Without, it would checkpoint but go back and checkpoint
         # all the previous states again
-        if self.request.checkpoint and self.append.append_checkpoint_flag:
+        if (checkpoint and self.request.checkpoint
+                and self.append.append_checkpoint_flag):
             write_checkpoint(self)
             self.append.append_checkpoint_flag = False
 
     def _first_append(self, how_much_left : int, weight :int,
-                    data_source : xr.DataArray
+                    data_source : xr.DataArray, checkpoint : bool = True
                 ):
         """First time that the finished statistc gets appended to
         the output data set. This will initiate some append attributes
         and set self.append.count_append = 1 (otherwise done when
-        data is appended)
+        data is appended). If checkpoint is False, the checkpoint is
+        left to the caller (used by _compute_segments).
         """
         if self.request.save:
             final_time_file_str = create_file_name(self)
@@ -529,25 +804,26 @@ class Opa:
         if how_much_left < weight:
             self._call_recursive(how_much_left, weight, data_source)
 
-        if self.request.checkpoint and self.append.append_checkpoint_flag:
+        if (checkpoint and self.request.checkpoint
+                and self.append.append_checkpoint_flag):
             write_checkpoint(self)
             self.append.append_checkpoint_flag = False
 
     def _finished_with_append(
             self, how_much_left : int, weight : int,
-            data_source : xr.DataArray
+            data_source : xr.DataArray, checkpoint : bool = True
         ):
         """Function called when n_data == count but output_freq is
         greater than stat_freq so the final dataset will contain
         multiple statistics."""
         if self.append.count_append == 0:
-            self._first_append(how_much_left, weight, data_source)
+            self._first_append(how_much_left, weight, data_source, checkpoint)
 
         elif self.append.count_append < self.append.time_append:
-            self._middle_append(how_much_left, weight, data_source)
+            self._middle_append(how_much_left, weight, data_source, checkpoint)
 
         elif self.append.count_append == self.append.time_append:
-            self._final_append(how_much_left, weight, data_source)
+            self._final_append(how_much_left, weight, data_source, checkpoint)
 
     ############## defining class methods ####################
     def compute(self, data_source : xr.Dataset, bias_adjust : bool = True):
@@ -576,6 +852,9 @@ class Opa:
         frequency after enough data has been passed to it.
         """
 
+        self._check_not_stale()
+        self._invalidate_cached_state()
+
         # convert from a data_set to a data_array if required
         data_source = check_variable(self, data_source)
 
@@ -583,6 +862,356 @@ class Opa:
         if bias_adjust and self.request.bias_adjust:
             data_source = bias_correction.call_bias_adjust(data_source, self.request)
 
+        # only the active cells of a masked request are computed
+        data_source = mask_chunk(self, data_source)
+
+        if self._batching():
+            return self._compute_batch(data_source)
+
+        return self._compute_data_array(data_source)
+
+    def _batching(self):
+        """Checks if the micro-batch buffer has been requested"""
+        return (self.request.stat not in ("raw", "bias_correction") and (
+            self.request.batch_size is not None
+            or self.request.batch_max_bytes is not None
+        ))
+
+    def _compute_batch(self, data_source : xr.DataArray):
+        """Adds the incoming data to the micro-batch buffer and passes
+        the buffer to the statistic if it is full, if it reaches the end
+        of the statistic or if the incoming data does not directly follow
+        the buffered data. If the data is only buffered, the checkpoint
+        is written with the buffer, so that an Opa created again from the
+        checkpoint carries on with the buffered time steps.
+
+        Arguments
+        ----------
+        data_source : xr.DataArray. Incoming data for the variable of
+                interest.
+
+        Returns
+        ---------
+        The outputs of compute for the last flush, or None if the data
+        has only been buffered.
+        """
+        dm = None
+        if not self.batch.is_contiguous(self, data_source):
+            dm = self._flush_batch()
+
+        self.batch.add(data_source)
+        if self.batch.should_flush(self):
+            dm = self._flush_batch()
+        elif self.request.checkpoint:
+            write_checkpoint(self)
+
+        return dm
+
+    def flush(self):
+        """Passes all the time steps held in the micro-batch buffer to the
+        statistic in one batched update, then waits for all the writes
+        queued to the background writer. The buffer is flushed
+        automatically when it is full or reaches the end of the statistic,
+        but flush should also be called once the data stream has finished
+        so that the last buffered time steps are added to the statistic.
+
+        Returns
+        ---------
+        The outputs of compute, or None if the buffer was empty.
+        """
+        dm = self._flush_batch()
+        if self.writer is not None:
+            self.writer.flush()
+        return dm
+
+    def close(self):
+        """Flushes the micro-batch buffer and the background writer, then
+        stops the writer threads. Called when leaving a with block.
+
+        Returns
+        ---------
+        The outputs of flush, None if the Opa is stale, as its buffer
+        has been taken over with the rest of its state.
+        """
+        dm = None
+        try:
+            if not self.stale:
+                dm = self.flush()
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+        return dm
+
+    def _start_writer(self):
+        """Starts the background writer, if it is not already running"""
+        if self.writer is None:
+            self.writer = BackgroundWriter(
+                self.request.writer_workers or 1,
+                self.request.writer_queue_size or WRITER_QUEUE_SIZE,
+                self.logger
+            )
+
+    def _locked_compute(self, data_source, bias_adjust : bool):
+        """compute called from acompute, one call at a time"""
+        with self.writer.compute_lock:
+            return self.compute(data_source, bias_adjust)
+
+    async def acompute(self, data_source, bias_adjust : bool = True):
+        """Asynchronous version of compute. The statistic is updated in a
+        worker thread, so the event loop is not blocked, and the outputs
+        and checkpoints are queued to the background writer (started here
+        if the request did not contain writer_workers). It returns as soon
+        as the rolling summaries are updated, or waits if the write queue
+        is full. Calls on the same Opa should be awaited in the order of
+        the data. Call flush or close to wait for the queued writes.
+
+        Incoming
+        ----------
+        data_source : xr.Dataset or xr.DataArray.
+        bias_adjust : bool, optional
+            Passed on to compute, by default True
+
+        Outputs
+        ---------
+        The same outputs as compute.
+        """
+        self._start_writer()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self._locked_compute, data_source, bias_adjust
+        )
+
+    def _flush_batch(self):
+        """Passes the micro-batch buffer to the statistic
+
+        Returns
+        ---------
+        The outputs of compute, or None if the buffer was empty.
+        """
+        if not self._batching():
+            return None
+
+        self._check_not_stale()
+        self._invalidate_cached_state()
+        data_source = self.batch.pop()
+        if data_source is None:
+            return None
+
+        self.logger.debug(
+            "Flushing %s buffered time stamps to the statistic.",
+            np.size(data_source.time.data)
+        )
+        return self._compute_data_array(data_source)
+
+    def stream(self, data, chunk_size : int = 1, prefetch : int = 2,
+               bias_adjust : bool = True
+            ):
+        """Compute one_pass statistics over a whole stream of data. The
+        next chunks are read and loaded into memory by a background
+        thread while the current one is passed to compute, so for data
+        opened lazily from disk most of the reading time is hidden.
+
+        Incoming
+        ----------
+        data : xr.Dataset or xr.DataArray with a time dimension (which
+            can be opened lazily, e.g. with xr.open_dataset), split into
+            chunks of chunk_size time steps. Can also be any iterator
+            of xr.Dataset or xr.DataArray chunks.
+        chunk_size : int, optional
+            Number of time steps passed to compute at a time, if data is
+            not already an iterator of chunks, by default 1
+        prefetch : int, optional
+            Number of chunks loaded ahead of the one being computed,
+            0 to load them only when they are needed, by default 2
+        bias_adjust : bool, optional
+            Passed on to compute, by default True
+
+        Outputs
+        ---------
+        Generator yielding the outputs of compute as the statistics are
+        complete (all of the appended statistics if output_freq is larger
+        than stat_freq). If the micro-batch buffer is used, it is flushed
+        once the stream has finished.
+        """
+        chunks = prefetch_chunks(iter_chunks(data, chunk_size), prefetch)
+        try:
+            for chunk in chunks:
+                output = self.compute(chunk, bias_adjust)
+                if self._is_finished_output(output):
+                    yield output
+
+            output = self.flush()
+            if self._is_finished_output(output):
+                yield output
+        finally:
+            # stops the reading thread if the generator is not used
+            # until the end
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    def _is_finished_output(self, output):
+        """Checks if an output of compute is a complete statistic, as
+        opposed to None, the data returned when it has been skipped, or
+        the xr.Dataset of a statistic that is still being appended to.
+        """
+        if not isinstance(output, (xr.Dataset, tuple)):
+            return False
+        return self.append.count_append == 0
+
+    def _check_not_stale(self):
+        """Raises an error if a new Opa has taken over the state of this
+        one from the state cache, as both would update the same state"""
+        if self.stale:
+            raise RuntimeError(
+                "The state of this Opa has been taken over by a new Opa "
+                "created from the same checkpoint, please use the new one."
+            )
+
+    def _invalidate_cached_state(self):
+        """Removes this state from the state cache before it is updated,
+        as it will no longer match the checkpoint file"""
+        if self.request.checkpoint and self.request.checkpoint_file:
+            state_cache.invalidate_state(self.request.checkpoint_file)
+
+    def _check_numpy_request(self):
+        """Checks that the request can be computed by compute_numpy.
+        Saving, appending to files, roll ups and the micro-batch buffer
+        all need the xr.Dataset, as do the raw data and bias correction.
+        """
+        if self.request.stat in ("raw", "bias_correction"):
+            raise ValueError(
+                f"The {self.request.stat} statistic can not be computed with "
+                "compute_numpy, please use compute."
+            )
+        for key in ("save", "bias_adjust"):
+            if getattr(self.request, key):
+                raise ValueError(
+                    f"compute_numpy does not support '{key}', please use "
+                    "compute or set it to False."
+                )
+        for key in ("rollup_freq", "batch_size", "batch_max_bytes"):
+            if getattr(self.request, key) is not None:
+                raise ValueError(
+                    f"compute_numpy does not support '{key}', please use "
+                    "compute."
+                )
+
+    def compute_numpy(self, values : np.ndarray, time_stamps : np.ndarray,
+                      as_xarray : bool = False, dims : List[str] = None,
+                      coords : Dict = None
+                    ):
+        """Compute one_pass statistics from plain numpy arrays. Runs the
+        same time checks and statistic updates as compute, without
+        creating any xarray objects. Finished statistics are returned as
+        an np.ndarray with a dictionary of metadata (see
+        saving.create_arrays.get_array_meta), unless as_xarray is True.
+
+        The same Opa object should either be called with compute or with
+        compute_numpy, not both.
+
+        Incoming
+        ----------
+        values : np.ndarray. Incoming data with time as the first dimension.
+        time_stamps : np.ndarray. datetime64 time stamps of the first
+            dimension of values.
+        as_xarray : bool, optional
+            If True the finished statistics are returned as the
+            xr.Dataset compute would return, by default False
+        dims : List[str], optional
+            Names of the dimensions of values, starting with 'time'. Only
+            used for the output metadata.
+        coords : dict, optional
+            Co-ordinates of the dimensions of values other than time.
+            Only used if as_xarray is True.
+
+        Outputs
+        ---------
+        None if no statistic has been completed. Otherwise a tuple of the
+        final statistic and its metadata (for histograms the bin counts,
+        with the bin edges in the metadata), or the xr.Dataset(s) if
+        as_xarray is True.
+        """
+        self._check_numpy_request()
+        self._check_not_stale()
+        self._invalidate_cached_state()
+
+        data_source = ArrayChunk(
+            values, time_stamps, name = self.request.variable, dims = dims
+        )
+        data_source = check_variable(self, data_source)
+        data_source = mask_chunk(self, data_source)
+
+        output = self._compute_data_array(data_source)
+        if output is None or isinstance(output, ArrayChunk):
+            # no finished statistic, or data that was skipped
+            return None
+
+        if self.request.stat == "histogram":
+            output = output[0]
+
+        if as_xarray:
+            return array_output_to_data_set(self, *output, coords)
+
+        return output
+
+    def snapshot(self, as_xarray : bool = False, coords : Dict = None):
+        """Returns the partial statistic of the period that is currently
+        being computed, without finishing it. The rolling summaries are
+        only read, so the following calls to compute carry on as if the
+        snapshot had not been taken, and no checkpoint is written. Data
+        still in the micro-batch buffer is not included, call flush
+        first to add it.
+
+        Incoming
+        ----------
+        as_xarray : bool, optional
+            If True the partial statistic is returned as an xr.Dataset,
+            by default False
+        coords : dict, optional
+            Co-ordinates of the dimensions of the data other than time.
+            Only used if as_xarray is True.
+
+        Outputs
+        ---------
+        None if no data has been added to the current statistic.
+        Otherwise a tuple of the partial statistic and its metadata
+        (see statistics.snapshot.get_snapshot), or the xr.Dataset(s)
+        if as_xarray is True.
+        """
+        self._check_not_stale()
+        if self.writer is not None:
+            # not while acompute is updating the statistic
+            with self.writer.compute_lock:
+                output = get_snapshot(self)
+        else:
+            output = get_snapshot(self)
+
+        if output is None or not as_xarray:
+            return output
+
+        return array_output_to_data_set(self, *output, coords)
+
+    def _compute_data_array(self, data_source : xr.DataArray,
+                            time_stamp_list : List = None
+                        ):
+        """Body of compute once the variable has been extracted from
+        the incoming data (and potentially bias adjusted). Split out
+        so that OpaGroup can check the variable and build the list of
+        time stamps once for all of its statistics.
+
+        Arguments
+        ----------
+        data_source : xr.DataArray. Incoming data for the variable of
+                interest.
+        time_stamp_list : List[pd.Timestamp]. Optional sorted list of
+                time stamps of data_source. Created in check_time_stamp
+                if not given.
+
+        Returns
+        ---------
+        The same outputs as compute.
+        """
         # this checks if there are multiple time stamps
         weight = np.size(data_source.time.data)
 
@@ -597,7 +1226,7 @@ class Opa:
             already_seen,
             n_data_att_exist,
             time_stamp_list,
-        ) = check_time_stamp(self, data_source, weight)
+        ) = check_time_stamp(self, data_source, weight, time_stamp_list)
 
         if already_seen:
             # stop code as we have already seen this data
@@ -612,49 +1241,76 @@ class Opa:
             )
 #################### count = ndata #############################
         if self.time.count == self.time.n_data:
+            return self._finish_statistic(how_much_left, weight, data_source)
 
-            get_final_statistics(self)
-            update_attributes(self)
-            create_data_set(self, data_source)
+    def _finish_statistic(self, how_much_left : int, weight : int,
+                          data_source : xr.DataArray, checkpoint : bool = True
+                        ):
+        """Called when n_data == count. Creates the final statistic and
+        the final xr.Dataset then, depending on the request, saves and/or
+        appends it.
 
-            if self.request.stat_freq == "continuous":
+        Arguments
+        ----------
+        how_much_left : int. how much of the incoming data was used to
+                fill the statistic.
+        weight : int. size of the time dimension of the incoming data.
+        data_source : xr.DataArray. incoming data.
+        checkpoint : bool. If False, no checkpoint is written when the
+                statistic is appended (used by _compute_segments).
 
-                if self.request.stat == "histogram":
-                    dm, dm2 = self._full_continuous_data(
-                            data_source, how_much_left, weight
-                        )
-                    return dm, dm2
+        Returns
+        ---------
+        The outputs of compute.
+        """
+        if self.request.rollup_freq is not None:
+            self.rollup.update(self, data_source)
 
-                dm = self._full_continuous_data(
+        get_final_statistics(self)
+        update_attributes(self)
+        if isinstance(data_source, ArrayChunk):
+            create_array_output(self, data_source)
+        else:
+            create_data_set(self, data_source)
+
+        if self.request.stat_freq == "continuous":
+
+            if self.request.stat == "histogram":
+                dm, dm2 = self._full_continuous_data(
                         data_source, how_much_left, weight
                     )
-                return dm
+                return dm, dm2
 
-            # not continuous
-            if self.append.time_append == 1:
+            dm = self._full_continuous_data(
+                    data_source, how_much_left, weight
+                )
+            return dm
 
-                if self.request.stat == "histogram":
-                    dm, dm2 = self._finished_no_append(
-                            how_much_left, weight, data_source
-                        )
-                    return dm, dm2
+        # not continuous
+        if self.append.time_append == 1:
 
-                dm = self._finished_no_append(
-                        how_much_left, weight, data_source
+            if self.request.stat == "histogram":
+                dm, dm2 = self._finished_no_append(
+                        how_much_left, weight, data_source, checkpoint
                     )
-                return dm
+                return dm, dm2
 
-            # time append > 1
-            if self.request.stat == "histogram":
-                self._finished_with_append(
-                    how_much_left, weight, data_source
+            dm = self._finished_no_append(
+                    how_much_left, weight, data_source, checkpoint
                 )
-                return self.statistics.final_cum, self.statistics.final2_cum
+            return dm
 
+        # time append > 1
+        if self.request.stat == "histogram":
             self._finished_with_append(
-                how_much_left, weight, data_source
+                how_much_left, weight, data_source, checkpoint
             )
-            return self.statistics.final_cum
+            return self.statistics.final_cum, self.statistics.final2_cum
+
+        self._finished_with_append(
+            how_much_left, weight, data_source, checkpoint
+        )
+        return self.statistics.final_cum
 
     def compute_bias_correction(self, data_source):
         """Compute one_pass statistic for bias correction.
@@ -681,6 +1337,9 @@ class Opa:
                 file will be created unless one already exisits for that
                 year.
         """
+        self._check_not_stale()
+        self._invalidate_cached_state()
+
         # convert from a data_set to a data_array if required
         data_source = check_variable(self, data_source)
 
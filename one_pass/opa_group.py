@@ -0,0 +1,222 @@
+"""Module for computing several one_pass statistics on the same
+incoming data stream with a single ingest pass"""
+from typing import Dict, List, Optional
+
+import os
+import pickle
+
+from one_pass import util
+from one_pass.opa import Opa
+from one_pass.checkpointing.write_pickle import write_pickle
+from one_pass.initialise.check_time import get_time_stamp_list
+from one_pass.initialise.check_variable import check_variable
+from one_pass.initialise.grid_mask import mask_chunk
+from one_pass.statistics.moments import MomentsCache
+from one_pass.statistics.moments import get_stat_moments
+
+class OpaGroup:
+    """Holds one Opa object per user request. All the requests must
+    be for the same variable and the same time_step. Every incoming
+    data chunk has its variable extracted and its time stamps parsed
+    once, and the same in-memory xr.DataArray is then passed to all
+    of the statistics. If several statistics need moments of the data
+    (sum, mean, M2, min or max) these are computed for all of them in
+    one sweep over the data. The rolling summaries of all the
+    statistics are written to one combined checkpoint file.
+    """
+
+    def __init__(
+        self,
+        user_requests: List[Dict],
+        keep_checkpoints: bool = False,
+        logging_level : Optional[str]="INFO"
+    ):
+        """
+        Initalisation. Will create an Opa object for every request,
+        with the individual checkpointing turned off, then if a
+        combined checkpoint file exists it will re-load the previous
+        state of all the statistics from it.
+
+        Attributes:
+        ------------
+        opas : List[Opa]. One Opa object per request, in the order of
+                user_requests.
+        checkpoint : bool. True if any of the requests asked for
+                checkpointing.
+        checkpoint_file : str. Full path of the combined checkpoint file.
+        keep_checkpoints : bool. If True the combined checkpoint file is
+                never removed.
+        moments_cache : MomentsCache. Moments of the incoming data shared
+                by the statistics, None if less than two need them.
+        """
+        user_requests = [
+            util.parse_request(user_request) for user_request in user_requests
+        ]
+        if len(user_requests) == 0:
+            raise ValueError("OpaGroup needs at least one request.")
+
+        for key in ("variable", "time_step"):
+            values = {user_request.get(key) for user_request in user_requests}
+            if len(values) > 1:
+                raise ValueError(
+                    f"All requests in an OpaGroup must have the same {key}, "
+                    f"found {sorted(values, key=str)}."
+                )
+
+        for user_request in user_requests:
+            if user_request.get("stat") == "bias_correction":
+                raise ValueError(
+                    "The bias_correction statistic can not be computed in "
+                    "an OpaGroup, please use Opa.compute_bias_correction."
+                )
+
+        self.keep_checkpoints = keep_checkpoints
+        self.checkpoint = False
+        self.checkpoint_file = None
+
+        self.opas = []
+        for user_request in user_requests:
+            if user_request.get("checkpoint") and self.checkpoint is False:
+                self.checkpoint = True
+                checkpoint_filepath = user_request.get("checkpoint_filepath")
+            # the group writes one checkpoint for all the statistics
+            member_request = dict(user_request, checkpoint = False)
+            self.opas.append(
+                Opa(member_request, keep_checkpoints, logging_level)
+            )
+
+        self.logger = self.opas[0].logger
+
+        if self.checkpoint:
+            self._check_checkpoint(checkpoint_filepath)
+
+        self._share_moments()
+
+    def _share_moments(self):
+        """Gives the statistics that reduce the data with the moments
+        kernel one shared MomentsCache, if there is more than one of
+        them. Bias adjusted and masked statistics get different data so
+        don't share it."""
+        sharing = [
+            opa for opa in self.opas
+            if get_stat_moments(opa.request) and not opa.request.bias_adjust
+            and opa.request.mask is None
+        ]
+        self.moments_cache = None
+        if len(sharing) > 1:
+            self.moments_cache = MomentsCache(
+                set().union(*(get_stat_moments(opa.request) for opa in sharing))
+            )
+        for opa in sharing:
+            opa.moments_cache = self.moments_cache
+
+    def _check_checkpoint(self, checkpoint_filepath : str):
+        """Creates the file name of the combined checkpoint file from
+        all of the requests. If the checkpoint file is there it will
+        replace the Opa objects with the ones stored in it.
+
+        Arguments
+        ----------
+        checkpoint_filepath : str. File path where the checkpoint is stored.
+        """
+        if checkpoint_filepath is None or not os.path.exists(checkpoint_filepath):
+            raise KeyError(
+                "Please pass a valid file path for the checkpoint_filepath."
+            )
+
+        request = self.opas[0].request
+        stats = "_".join(
+            f"{opa.request.stat_freq}_{opa.request.output_freq}_{opa.request.stat}"
+            for opa in self.opas
+        )
+        self.checkpoint_file = os.path.join(
+            checkpoint_filepath,
+            f"checkpoint_group_{request.variable}_"
+            f"timestep_{request.time_step}_"
+            f"{stats}.pkl",
+        )
+
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'rb') as f:
+                self.opas = pickle.load(f)
+            f.close()
+
+    def _in_progress(self):
+        """Checks if any of the statistics holds a rolling summary that
+        has not been completed yet and so needs to be checkpointed.
+
+        Returns
+        ---------
+        in_progress : bool.
+        """
+        for opa in self.opas:
+            if opa.request.stat == "raw" or opa.time.n_data is None:
+                continue
+            if (opa.request.stat_freq == "continuous"
+                    or opa.time.count < opa.time.n_data
+                    or opa.append.count_append > 0
+                    or opa._rollup_in_progress()):
+                return True
+        return False
+
+    def _update_checkpoint(self):
+        """Writes the combined checkpoint file if any statistic is still
+        in progress, otherwise removes it (unless keep_checkpoints is True).
+        """
+        if self._in_progress():
+            write_pickle(self.opas, self.checkpoint_file)
+        elif (not self.keep_checkpoints
+                and os.path.isfile(self.checkpoint_file)):
+            self.logger.debug('removing group checkpoint')
+            os.remove(self.checkpoint_file)
+
+    def compute(self, data_source, bias_adjust : bool = True):
+        """Compute all the one_pass statistics of the group. The variable
+        is extracted from the data and the time stamps are parsed once,
+        then every statistic is updated with the same data.
+
+        Incoming
+        ----------
+        data_source : this is the data provided by the user.
+            It must be either an xr.Dataset or xr.DataArray.
+        bias_adjust : bool, optional
+            Whether to bias adjust the data for the requests that have
+            turned it on, by default True
+
+        Outputs
+        ---------
+        List with one entry per request, in the order of the requests,
+        containing what Opa.compute would have returned for that request.
+        """
+        # convert from a data_set to a data_array once for all statistics
+        data_array = check_variable(self.opas[0], data_source)
+        # same attributes as check_variable would give, copied as the
+        # attributes are modified separately for each statistic
+        is_data_set = hasattr(data_source, "data_vars")
+        for opa in self.opas[1:]:
+            opa.data_set_info.data_var_attr = data_array.attrs.copy()
+            if is_data_set or opa.data_set_info.data_set_attr is None:
+                opa.data_set_info.data_set_attr = data_source.attrs.copy()
+
+        time_stamp_list = get_time_stamp_list(data_array)
+
+        outputs = []
+        try:
+            for opa in self.opas:
+                if bias_adjust and opa.request.bias_adjust:
+                    # bias adjusted data has different values so can't be
+                    # shared
+                    outputs.append(opa.compute(data_array))
+                else:
+                    outputs.append(opa._compute_data_array(
+                        mask_chunk(opa, data_array), time_stamp_list
+                    ))
+        finally:
+            # don't keep the data in memory until the next chunk
+            if self.moments_cache is not None:
+                self.moments_cache.clear()
+
+        if self.checkpoint:
+            self._update_checkpoint()
+
+        return outputs
@@ -0,0 +1,230 @@
+"""Create the final numpy outputs of Opa.compute_numpy. These replace
+the final xr.Datasets of create_data_sets with the final statistic as
+an np.ndarray and a small dictionary of metadata. The xr.Dataset is
+only created from them if requested."""
+
+import numpy as np
+import xarray as xr
+
+from one_pass.initialise.grid_mask import get_output_template
+from one_pass.initialise.grid_mask import unmask_cells
+from one_pass.saving.mask_coverage import mask_low_coverage
+
+def get_timings(opa_self : object):
+    """The time stamps of the minimum or maximum values as datetime64[ns].
+    timings_cum holds int64 nanoseconds, which are viewed as time stamps
+    when the statistic is finished, as the rolling summaries are reset
+    afterwards. Continuous statistics and snapshots get a new array, as
+    timings_cum carries on being updated in place."""
+    timings = np.asarray(opa_self.statistics.timings_cum)
+    if (opa_self.request.stat_freq != "continuous"
+            and opa_self.time.count == opa_self.time.n_data
+            and timings.dtype == np.int64):
+        return timings.view("datetime64[ns]")
+    return timings.astype("datetime64[ns]")
+
+def get_array_final_stat(opa_self : object):
+    """Extracts the final statistic from the rolling summaries, with the
+    same shape as the data of the final xr.Dataset (on the full grid for
+    masked requests). It is a copy for continuous statistics, which carry
+    on being updated in place.
+
+    Returns
+    --------
+    final_stat : np.ndarray.
+    """
+    stat = opa_self.request.stat
+    if stat == "histogram":
+        final_stat = opa_self.statistics.histogram_cum
+    else:
+        final_stat = getattr(opa_self.statistics, stat + "_cum")
+
+    if stat == "iams":
+        # adding time dimension in final stat
+        final_stat = np.expand_dims(final_stat, axis=0)
+
+    if stat == "thresh_exceed":
+        # float64 counts, as in the outputs of compute
+        final_stat = np.array(final_stat, dtype=np.float64)
+    elif opa_self.request.stat_freq == "continuous":
+        final_stat = np.array(final_stat)
+    else:
+        final_stat = np.asarray(final_stat)
+
+    # cells without enough valid data are NaN for skipna requests
+    return unmask_cells(opa_self, mask_low_coverage(opa_self, final_stat))
+
+def get_array_meta(opa_self : object, variable : str, dims : tuple,
+                   bin_edges : np.ndarray = None
+                ):
+    """Creates the metadata of the final statistic.
+
+    Arguments
+    ---------
+    opa_self : Opa class
+    variable : str. name of the variable.
+    dims : tuple. names of the dimensions of the incoming data.
+    bin_edges : np.ndarray. Optional histogram bin edges, taken from
+            opa_self.statistics.histogram_bin_edges_cum if not given. The
+            bin edges and timings of masked requests are scattered back
+            onto the full grid.
+
+    Returns
+    --------
+    meta : dict. With keys
+        variable : name of the variable.
+        stat : the statistic.
+        stat_freq : the statistic frequency.
+        dims : names of the dimensions of the final statistic.
+        time : np.ndarray of datetime64[ns]. First time stamp of every
+                statistic in the output.
+        and, depending on the statistic, the extra co-ordinate
+        'thresholds', 'percentile' or 'durations', for histograms
+        the 'bin_edges' as an np.ndarray, or for min and max the
+        'timings' of the minimum or maximum values as an np.ndarray
+        of datetime64[ns].
+    """
+    stat = opa_self.request.stat
+    dims = list(dims)
+    meta = {
+        "variable" : variable,
+        "stat" : stat,
+        "stat_freq" : opa_self.request.stat_freq,
+        "time" : np.array(
+            [opa_self.time.init_time_stamp], dtype="datetime64[ns]"
+        ),
+    }
+
+    if stat == "thresh_exceed":
+        dims.insert(1, "thresholds")
+        meta["thresholds"] = np.array(opa_self.request.thresh_exceed)
+
+    elif stat == "percentile":
+        dims.insert(1, "percentile")
+        meta["percentile"] = np.array(opa_self.request.percentile_list)
+
+    elif stat == "iams":
+        dims.insert(1, "durations")
+        meta["durations"] = np.array(opa_self.iams.durations)
+
+    elif stat == "histogram":
+        dims.insert(1, "bin_count")
+        if bin_edges is None:
+            bin_edges = opa_self.statistics.histogram_bin_edges_cum
+        meta["bin_edges"] = unmask_cells(
+            opa_self, mask_low_coverage(opa_self, np.array(bin_edges))
+        )
+
+    elif stat in ("min", "max"):
+        meta["timings"] = unmask_cells(opa_self, mask_low_coverage(
+            opa_self, get_timings(opa_self)
+        ))
+
+    meta["dims"] = tuple(dims)
+    return meta
+
+def append_array_output(opa_self : object, final_stat : np.ndarray,
+                        meta : dict
+                    ):
+    """Appends the final statistic along the time dimension if
+    output_freq is larger than stat_freq, sorted in time as in
+    Append.data_output_append.
+
+    Returns
+    ---------
+    opa_self.statistics.final_cum : appended (final_stat, meta)
+    opa_self.append.count_append : updated count append
+    """
+    old_stat, old_meta = opa_self.statistics.final_cum
+
+    time_stamps = np.concatenate([old_meta["time"], meta["time"]])
+    order = np.argsort(time_stamps, kind="stable")
+    meta["time"] = time_stamps[order]
+    final_stat = np.concatenate([old_stat, final_stat])[order]
+    for key in ("bin_edges", "timings"):
+        if key in meta:
+            meta[key] = np.concatenate([old_meta[key], meta[key]])[order]
+
+    opa_self.statistics.final_cum = (final_stat, meta)
+    opa_self.append.count_append = opa_self.append.count_append + 1
+    opa_self.logger.debug(
+        f"Appended {opa_self.append.count_append} out of "
+        f"{opa_self.append.time_append} completed "
+        f"{opa_self.request.stat_freq} statistics to final output"
+    )
+
+def create_array_output(opa_self : object, data_source : object):
+    """Numpy version of create_data_set.
+
+    Arguments
+    ----------
+    opa_self : Opa class
+    data_source : ArrayChunk. incoming data.
+
+    Returns
+    ---------
+    opa_self.statistics.final_cum : tuple of the final statistic and
+            its metadata (see get_array_meta).
+    opa_self.statistics.final2_cum : for histograms, the bin edges.
+    """
+    final_stat = get_array_final_stat(opa_self)
+    # the full grid of a masked request
+    data_source = get_output_template(opa_self, data_source)
+    meta = get_array_meta(opa_self, data_source.name, data_source.dims)
+
+    if opa_self.append.count_append == 0:
+        opa_self.statistics.final_cum = (final_stat, meta)
+    else:
+        append_array_output(opa_self, final_stat, meta)
+
+    if opa_self.request.stat == "histogram":
+        opa_self.statistics.final2_cum = (
+            opa_self.statistics.final_cum[1]["bin_edges"]
+        )
+
+def array_output_to_data_set(opa_self : object, final_stat : np.ndarray,
+                             meta : dict, coords : dict = None
+                        ):
+    """Creates the xr.Dataset from a numpy output, with the attributes
+    the xr.Dataset of Opa.compute would have.
+
+    Arguments
+    ----------
+    final_stat : np.ndarray. final statistic.
+    meta : dict. metadata of the final statistic.
+    coords : dict. Optional co-ordinates for the dimensions that are not
+            created by Opa.
+
+    Returns
+    ---------
+    dm : xr.Dataset. For histograms, a tuple of the xr.Datasets holding
+            the bin counts and the bin edges.
+    """
+    dims = meta["dims"]
+    new_coords = dict(coords or {})
+    new_coords["time"] = meta["time"]
+    for coord in ("thresholds", "percentile", "durations"):
+        if coord in meta:
+            new_coords[coord] = meta[coord]
+
+    def data_set(dims, values):
+        return xr.Dataset(
+            data_vars=dict(
+                [(str(meta["variable"]), (
+                    dims, values,
+                    dict(opa_self.data_set_info.data_var_attr or {})
+                ))],
+            ),
+            coords=new_coords,
+            attrs=dict(opa_self.data_set_info.data_set_attr or {}),
+        )
+
+    dm = data_set(dims, final_stat)
+    if "timings" in meta:
+        dm = dm.assign(timings = (dims, meta["timings"]))
+
+    if meta["stat"] == "histogram":
+        edge_dims = (dims[0], "bin_edges", *dims[2:])
+        return dm, data_set(edge_dims, meta["bin_edges"])
+
+    return dm
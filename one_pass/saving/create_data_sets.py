@@ -3,6 +3,10 @@
 import numpy as np
 import xarray as xr
 
+from one_pass.initialise.grid_mask import get_output_template
+from one_pass.initialise.grid_mask import unmask_cells
+from one_pass.saving.create_arrays import get_timings
+from one_pass.saving.mask_coverage import mask_low_coverage
 from one_pass.saving.modify_attributes import get_datetime_str
 
 def change_data_source_shape(
@@ -107,9 +111,12 @@ def create_final_dataset(opa_self,
             depending on the statistic this will be extracted, potenitally
             re-gridded and set into a dataset with the original attributes
             (including updated attributes) and a time stamp corresponding
-            to the first time stamp of the statistic
+            to the first time stamp of the statistic. For masked requests
+            final_stat only holds the active cells and is scattered back
+            onto the full grid here.
     """
     attributes = opa_self.data_set_info.data_var_attr
+    final_stat = unmask_cells(opa_self, final_stat)
 
     dm = xr.Dataset(
         data_vars=dict(
@@ -128,8 +135,10 @@ def create_final_dataset(opa_self,
             " calculated using one_pass algorithm\n"
         )
         timing_attrs = {'history' : new_attr_str}
-        dm = dm.assign(timings = (data_source.dims,
-                                opa_self.statistics.timings_cum.data, timing_attrs))
+        timings = unmask_cells(opa_self, mask_low_coverage(
+            opa_self, get_timings(opa_self)
+        ))
+        dm = dm.assign(timings = (data_source.dims, timings, timing_attrs))
 
     return dm
 
@@ -149,6 +158,8 @@ def create_data_set(opa_self, data_source : xr.DataArray):
             class. This is given the name 'final_cum' so that it
             can be removed easily
     """
+    # the full grid of a masked request
+    data_source = get_output_template(opa_self, data_source)
     # compress the dataset down to 1 dimension in time
     data_source = data_source.tail(time=1)
     # re-label the time coordinate
@@ -182,8 +193,18 @@ def create_data_set(opa_self, data_source : xr.DataArray):
         final_stat = getattr(opa_self.statistics,
                             opa_self.request.stat + "_cum")
 
-    if opa_self.request.stat in ("min", "max"):
-        final_stat = final_stat.data
+    if opa_self.request.stat == "thresh_exceed":
+        # the outputs keep the float64 counts of the integer counters
+        final_stat = final_stat.astype(np.float64)
+
+    elif (opa_self.request.stat_freq == "continuous"
+            and isinstance(final_stat, np.ndarray)):
+        # the rolling summaries carry on being updated in place after a
+        # continuous output, so the output gets its own copy
+        final_stat = final_stat.copy()
+
+    # cells without enough valid data are NaN for skipna requests
+    final_stat = mask_low_coverage(opa_self, final_stat)
 
     # only does something for percentiles and iams
     data_source, final_stat = change_data_source_shape(
@@ -203,7 +224,9 @@ def create_data_set(opa_self, data_source : xr.DataArray):
 
     if opa_self.request.stat == "histogram":
 
-        final_stat = getattr(opa_self.statistics, "histogram_bin_edges_cum")
+        final_stat = mask_low_coverage(
+            opa_self, getattr(opa_self.statistics, "histogram_bin_edges_cum")
+        )
         data_source_old = data_source_old.expand_dims(
             dim={"bin_edges": np.shape(
                 opa_self.statistics.histogram_bin_edges_cum)[1]}
@@ -0,0 +1,74 @@
+"""Masks the output cells without enough valid data, for the skipna
+requests. With skipna every grid cell keeps its number of valid (not
+NaN) time steps in opa_self.statistics.valid_count_cum. A cell is
+written as NaN if it has fewer valid time steps than min_coverage of the
+time steps of the statistic, or no valid time step at all if
+min_coverage is not set."""
+
+import math
+
+import numpy as np
+
+def get_low_coverage(opa_self : object):
+    """Finds the cells with too few valid time steps.
+
+    Arguments
+    ----------
+    opa_self : Opa class
+
+    Returns
+    ---------
+    low_coverage : np.ndarray of bool with the shape of valid_count_cum,
+            True for the cells to mask. None if the request does not
+            skip the NaN values.
+    """
+    valid_count = getattr(opa_self.statistics, "valid_count_cum", None)
+    if not opa_self.request.skipna or valid_count is None:
+        return None
+
+    # time steps of the statistic so far, all of them when it is finished
+    if opa_self.request.stat_freq == "continuous":
+        count = opa_self.time.count_continuous
+    else:
+        count = opa_self.time.count
+    min_count = 1
+    if opa_self.request.min_coverage is not None:
+        # without the rounding errors of the product
+        min_count = max(
+            1, math.ceil(opa_self.request.min_coverage * count - 1e-9)
+        )
+    return np.asarray(valid_count) < min_count
+
+def mask_low_coverage(opa_self : object, values : np.ndarray, fill=None):
+    """Returns a copy of values with the cells with too few valid time
+    steps set to fill, or values itself for requests that do not skip
+    the NaN values.
+
+    Arguments
+    ----------
+    opa_self : Opa class
+    values : np.ndarray. Output with the shape of the rolling summaries,
+            or with an extra dimension after time (e.g. the percentiles
+            or the bins of a histogram).
+    fill : value of the masked cells, NaN by default, NaT for time stamps
+            and 0 for integer counts.
+
+    Returns
+    ---------
+    values : np.ndarray.
+    """
+    low_coverage = get_low_coverage(opa_self)
+    if low_coverage is None:
+        return values
+
+    values = np.asarray(values)
+    if np.ndim(values) == low_coverage.ndim + 1:
+        low_coverage = np.expand_dims(low_coverage, axis=1)
+    if fill is None:
+        if values.dtype.kind == "M":
+            fill = np.datetime64("NaT")
+        elif values.dtype.kind in "iu":
+            fill = 0
+        else:
+            fill = np.nan
+    return np.where(low_coverage, np.array(fill, dtype=values.dtype), values)
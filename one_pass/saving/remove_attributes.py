@@ -17,7 +17,7 @@ def remove_attributes_continuous(opa_self):
     if opa_self.request.stat in ("percentile", "histogram"):
         matching_items = find_items_with_substr(opa_self.statistics, "cum")
         for key in matching_items:
-            if key != "digests_cum":
+            if key not in ("digests_cum", "valid_count_cum"):
                 setattr(opa_self.statistics, key, None)
 
     if opa_self.request.stat == "std":
@@ -2,6 +2,17 @@
 
 import os
 
+from one_pass.background_writer import write_data_set
+
+def save_data_set(opa_self, dm, file_name : str):
+    """Saves the xr.Dataset to netcdf, or queues it to be saved if the
+    Opa has a background writer"""
+    writer = getattr(opa_self, "writer", None)
+    if writer is not None:
+        writer.submit(file_name, write_data_set, dm, file_name)
+    else:
+        write_data_set(dm, file_name)
+
 def save_output_nc(opa_self, final_time_file_str : str):
     """Function that saves final_cum Dataset to netcdf.
     This is only called for the statistics, not for the raw data
@@ -52,8 +63,7 @@ def save_output_nc(opa_self, final_time_file_str : str):
         )
 
     dm = getattr(opa_self.statistics, "final_cum")
-    dm.to_netcdf(path=file_name, mode="w")
-    dm.close()
+    save_data_set(opa_self, dm, file_name)
 
     # if it's a histom there will be two final outputs
     if opa_self.request.stat == "histogram":
@@ -65,8 +75,7 @@ def save_output_nc(opa_self, final_time_file_str : str):
             "bin_edges.nc",
         )
         dm = getattr(opa_self.statistics, "final2_cum")
-        dm.to_netcdf(path=file_name, mode="w")
-        dm.close()
+        save_data_set(opa_self, dm, file_name)
 
 def save_raw_output_nc(
             opa_self, dm_raw, final_time_file_str
@@ -84,5 +93,4 @@ def save_raw_output_nc(
         f"{opa_self.request.variable}_raw_data.nc"
     )
 
-    dm_raw.to_netcdf(path=file_name, mode="w")
-    dm_raw.close()
+    save_data_set(opa_self, dm_raw, file_name)
@@ -0,0 +1,363 @@
+"""T-digests of all the grid cells kept in two 2-D numpy arrays, the
+centroid means and weights of shape (cells, centroids), instead of one
+crick TDigest object per grid cell. Incoming time steps are appended to
+a buffer shared by all the cells and merged into the centroids in one
+batched sort, and the percentiles and histograms of all the cells are
+interpolated at once.
+
+The centroids follow the same rules as crick
+(https://github.com/dask/crick/blob/main/crick/tdigest.pyx): the k1 scale
+function limits their size, NaN values are ignored and the percentiles
+and the cumulative distribution are interpolated linearly between the
+minimum, the centres of the centroids and the maximum of every cell.
+"""
+
+import numpy as np
+
+from one_pass.statistics.moments import BLOCK_BYTES
+from one_pass.statistics.sketch import GridSketch
+
+# crick does not use a compression below 20
+MIN_COMPRESSION = 20
+
+class ArrayTDigest(GridSketch):
+    """T-digests of n_cells grid cells.
+
+    Arguments
+    ----------
+    n_cells : int. Number of grid cells.
+    compression : float. Compression of the digests, as in crick. Values
+            below 20 are set to 20.
+    buffer_size : int. Number of time steps kept in the buffer before
+            they are merged into the centroids. Defaults to the largest
+            number of centroids of one cell.
+
+    Attributes
+    ----------
+    means : np.ndarray. Centroid means of shape (n_cells, centroids),
+            sorted in every cell and NaN after the last centroid.
+    weights : np.ndarray. Centroid weights, 0 after the last centroid.
+    buffer : np.ndarray. Time steps of shape (buffer_size, n_cells) not
+            merged yet, of which the first n_buffer are used.
+    min, max : np.ndarray. Smallest and largest value of every cell.
+    """
+
+    def __init__(self, n_cells : int, compression : float = MIN_COMPRESSION,
+                 buffer_size : int = None
+                ):
+        super().__init__(n_cells)
+        self.compression = max(float(compression), MIN_COMPRESSION)
+        # range of the scale function, every centroid spans at most one
+        self.k_max = self.compression * np.pi / 2
+        if buffer_size is None:
+            buffer_size = int(np.ceil(self.k_max)) + 1
+        self.means = np.empty((self.n_cells, 0))
+        self.weights = np.empty((self.n_cells, 0))
+        self.buffer = np.empty((buffer_size, self.n_cells))
+        self.n_buffer = 0
+        self.min = np.full(self.n_cells, np.nan)
+        self.max = np.full(self.n_cells, np.nan)
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the arrays of the digests"""
+        return (self.means.nbytes + self.weights.nbytes + self.buffer.nbytes
+                + self.min.nbytes + self.max.nbytes)
+
+    def update(self, values : np.ndarray):
+        """Adds values of shape (time, n_cells) to the digests"""
+        values = np.asarray(values, dtype=np.float64).reshape(-1, self.n_cells)
+        n_time = values.shape[0]
+        if n_time == 0:
+            return
+        # fmin and fmax ignore NaN
+        self.min = np.fmin(self.min, np.fmin.reduce(values, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(values, axis=0))
+
+        if self.n_buffer + n_time <= self.buffer.shape[0]:
+            self.buffer[self.n_buffer:self.n_buffer + n_time] = values
+            self.n_buffer += n_time
+        else:
+            self._compress([values.T], [get_weights(values.T)])
+
+    def merge(self, other : "ArrayTDigest"):
+        """Merges the digests of other, with the same cells, into these"""
+        values = other.buffer[:other.n_buffer].T
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        self._compress(
+            [other.means, values], [other.weights, get_weights(values)]
+        )
+
+    def flush(self):
+        """Merges the buffer into the centroids"""
+        if self.n_buffer:
+            self._compress()
+
+    def total(self):
+        """Number of values (ignoring NaN) in every cell"""
+        self.flush()
+        return np.sum(self.weights, axis=1)
+
+    def quantile(self, q) -> np.ndarray:
+        """Quantiles q (between 0 and 1) of every cell, of shape
+        (len(q), n_cells). NaN for cells without any value."""
+        self.flush()
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        result = np.empty((np.size(q), self.n_cells))
+        for start, stop in self._blocks(np.size(q)):
+            x, c, total = self._knots(start, stop)
+            total = total[:, np.newaxis]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                position = np.where(total > 0, c / total, 0)
+            value = interpolate(position, x, q, c, q * total)
+            value[total[:, 0] == 0] = np.nan
+            result[:, start:stop] = value.T
+        return result
+
+    def cdf(self, x : np.ndarray) -> np.ndarray:
+        """Cumulative distribution of every cell at the values x of shape
+        (n, n_cells)"""
+        self.flush()
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self.n_cells)
+        result = np.empty(x.shape)
+        for start, stop in self._blocks(x.shape[0]):
+            knots_x, c, total = self._knots(start, stop)
+            low = self.min[start:stop, np.newaxis]
+            high = self.max[start:stop, np.newaxis]
+            span = np.where(high > low, high - low, 1)
+            values = x[:, start:stop].T
+            with np.errstate(invalid="ignore", divide="ignore"):
+                position = np.nan_to_num((knots_x - low) / span)
+                target = np.clip(np.nan_to_num((values - low) / span), 0, 1)
+                value = interpolate(position, c, target, knots_x, values)
+                value = value / total[:, np.newaxis]
+            value[values <= low] = 0
+            value[values >= high] = 1
+            value[total == 0] = 0
+            result[:, start:stop] = value.T
+        return result
+
+    def histogram(self, bins : int = 10, range=None):
+        """Histogram of every cell, as crick's TDigest.histogram. The bin
+        edges are spread between the minimum and maximum of every cell,
+        or over range if it is given.
+
+        Returns
+        ---------
+        counts : np.ndarray of shape (bins, n_cells). Number of values in
+                every bin, interpolated from the digests so not integer.
+        edges : np.ndarray of shape (bins + 1, n_cells).
+        """
+        self.flush()
+        if range is None:
+            low = np.where(np.isnan(self.min), 0, self.min)
+            high = np.where(np.isnan(self.max), 0, self.max)
+            # as np.histogram, a single value is in the middle of a range of 1
+            equal = low == high
+            low = np.where(equal, low - 0.5, low)
+            high = np.where(equal, high + 0.5, high)
+        else:
+            low = np.full(self.n_cells, range[0], dtype=np.float64)
+            high = np.full(self.n_cells, range[1], dtype=np.float64)
+        fraction = np.linspace(0, 1, bins + 1)[:, np.newaxis]
+        edges = low + fraction * (high - low)
+        counts = np.diff(self.cdf(edges), axis=0) * self.total()
+        return counts, edges
+
+    def _blocks(self, n_values : int):
+        """Ranges of cells extracted at once, so that the temporary
+        arrays stay around BLOCK_BYTES"""
+        width = self.means.shape[1] + 2 + n_values
+        block_size = max(1, BLOCK_BYTES // (8 * width))
+        for start in np.arange(0, self.n_cells, block_size):
+            yield start, min(start + block_size, self.n_cells)
+
+    def _knots(self, start : int, stop : int):
+        """Points of the piecewise linear cumulative distribution of the
+        cells start:stop. The values x are the minimum, the centroid means
+        and the maximum and the weights c are 0, the cumulative weight at
+        the centre of every centroid and the total weight. Cells with
+        fewer centroids repeat the maximum and the total weight."""
+        means = self.means[start:stop]
+        weights = self.weights[start:stop]
+        n_rows, width = means.shape
+        low = self.min[start:stop]
+        high = self.max[start:stop]
+
+        cum = np.cumsum(weights, axis=1)
+        total = cum[:, -1] if width else np.zeros(n_rows)
+
+        x = np.empty((n_rows, width + 2))
+        x[:, 0] = low
+        x[:, 1:-1] = np.where(weights > 0, means, high[:, np.newaxis])
+        x[:, -1] = high
+        c = np.empty((n_rows, width + 2))
+        c[:, 0] = 0
+        c[:, 1:-1] = cum - weights / 2
+        c[:, -1] = total
+        return x, c, total
+
+    def _compress(self, means : list = (), weights : list = ()):
+        """Merges the buffer and the extra centroids given into the
+        centroids of every cell"""
+        values = self.buffer[:self.n_buffer].T
+        means = np.concatenate([self.means, values, *means], axis=1)
+        weights = np.concatenate(
+            [self.weights, get_weights(values), *weights], axis=1
+        )
+        self.n_buffer = 0
+
+        block_size = max(1, BLOCK_BYTES // (8 * max(1, means.shape[1])))
+        merged = [
+            self._merge_centroids(
+                means[start:start + block_size],
+                weights[start:start + block_size]
+            )
+            for start in range(0, self.n_cells, block_size)
+        ]
+        width = max((block[0].shape[1] for block in merged), default=0)
+        self.means = np.full((self.n_cells, width), np.nan)
+        self.weights = np.zeros((self.n_cells, width))
+        start = 0
+        for block_means, block_weights in merged:
+            stop = start + block_means.shape[0]
+            self.means[start:stop, :block_means.shape[1]] = block_means
+            self.weights[start:stop, :block_weights.shape[1]] = block_weights
+            start = stop
+
+    def _merge_centroids(self, means : np.ndarray, weights : np.ndarray):
+        """Sorts the centroids of every row and merges the neighbours that
+        lie within the same unit of the scale function
+
+            k(q) = compression / 2 * (arcsin(2q - 1) + pi / 2),
+
+        so that, as in crick, no centroid spans more than one unit of k
+        and the centroids are small near the tails."""
+        n_rows, width = means.shape
+        if width == 0:
+            return means, weights
+        # NaN are sorted last, with zero weight
+        order = np.argsort(means, axis=1)
+        means = np.take_along_axis(means, order, axis=1)
+        weights = np.take_along_axis(weights, order, axis=1)
+
+        cum = np.cumsum(weights, axis=1)
+        total = cum[:, -1:]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            k_low = self._scale((cum - weights) / total)
+            k_high = self._scale(cum / total)
+        unit = np.floor(k_low)
+        inside = np.ceil(k_high) - 1 <= unit
+
+        start = np.ones((n_rows, width), dtype=bool)
+        start[:, 1:] = ~(
+            inside[:, 1:] & inside[:, :-1] & (unit[:, 1:] == unit[:, :-1])
+        )
+        cluster = np.cumsum(start, axis=1) - 1
+        n_clusters = int(cluster[:, -1].max()) + 1
+        cluster += np.arange(n_rows)[:, np.newaxis] * n_clusters
+
+        size = n_rows * n_clusters
+        new_weights = np.bincount(
+            cluster.ravel(), weights.ravel(), minlength=size
+        ).reshape(n_rows, n_clusters)
+        new_sums = np.bincount(
+            cluster.ravel(), (np.where(weights > 0, means, 0) * weights).ravel(),
+            minlength=size
+        ).reshape(n_rows, n_clusters)
+
+        # the empty clusters are after the last centroid of every row
+        width = int(np.max(np.count_nonzero(new_weights, axis=1)))
+        new_weights = new_weights[:, :width]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            new_means = np.where(
+                new_weights > 0, new_sums[:, :width] / new_weights, np.nan
+            )
+        return new_means, new_weights
+
+    def _scale(self, q : np.ndarray) -> np.ndarray:
+        """k1 scale function from 0 to k_max"""
+        return self.compression / 2 * (
+            np.arcsin(np.clip(2 * q - 1, -1, 1)) + np.pi / 2
+        )
+
+def get_weights(values : np.ndarray) -> np.ndarray:
+    """Weight 1 for every value, 0 for NaN"""
+    return (~np.isnan(values)).astype(np.float64)
+
+def find_knots(position : np.ndarray, target : np.ndarray) -> np.ndarray:
+    """Index of the last knot at or below every target in every row.
+
+    Arguments
+    ----------
+    position : np.ndarray of shape (rows, knots). Knots between 0 and 1,
+            non-decreasing along the rows.
+    target : np.ndarray between 0 and 1, of shape (n,) for the same
+            targets in every row or (rows, n).
+
+    Returns
+    ---------
+    np.ndarray of int64 and shape (rows, n), -1 for targets below the
+            first knot.
+    """
+    n_rows = position.shape[0]
+    if target.ndim == 1:
+        # the knots are placed among the few sorted targets, and counted
+        # per row with np.bincount, as in exceedance.count_exceedances
+        n_target = target.size
+        order = np.argsort(target)
+        level = np.searchsorted(target[order], position, side="left")
+        level += np.arange(n_rows)[:, np.newaxis] * (n_target + 1)
+        counts = np.bincount(
+            level.ravel(), minlength=n_rows * (n_target + 1)
+        ).reshape(n_rows, n_target + 1)
+        index = np.empty((n_rows, n_target), dtype=np.int64)
+        index[:, order] = np.cumsum(counts[:, :-1], axis=1) - 1
+        return index
+
+    # rows are shifted by 2, so one searchsorted finds the knots of
+    # every row
+    offset = 2 * np.arange(n_rows)[:, np.newaxis]
+    index = np.searchsorted(
+        (position + offset).ravel(), (target + offset).ravel(), side="right"
+    ).reshape(target.shape)
+    return index - 1 - np.arange(n_rows)[:, np.newaxis] * position.shape[1]
+
+def interpolate(position : np.ndarray, y : np.ndarray, target : np.ndarray,
+                x : np.ndarray, x_target : np.ndarray
+            ) -> np.ndarray:
+    """Linear interpolation in every row between knots (x, y), where x
+    is non-decreasing along the rows.
+
+    Arguments
+    ----------
+    position : np.ndarray of shape (rows, knots). x scaled between 0 and
+            1 in every row, used to find the knots around the targets.
+    y : np.ndarray of shape (rows, knots). Values at the knots.
+    target : np.ndarray of shape (n,) or (rows, n). Targets scaled as
+            position.
+    x : np.ndarray of shape (rows, knots). x at the knots.
+    x_target : np.ndarray of shape (rows, n). Targets, not scaled.
+
+    Returns
+    ---------
+    np.ndarray of shape (rows, n). y interpolated at the targets.
+    """
+    n_rows, n_knots = position.shape
+    index = np.clip(find_knots(position, target), 0, n_knots - 2)
+    # index in the flattened knots
+    index += np.arange(n_rows)[:, np.newaxis] * n_knots
+
+    x = x.ravel()
+    y = y.ravel()
+    x_low = x[index]
+    x_high = x[index + 1]
+    y_low = y[index]
+    y_high = y[index + 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(
+            x_high > x_low, (x_target - x_low) / (x_high - x_low), 0
+        )
+    fraction = np.clip(fraction, 0, 1)
+    return y_low + fraction * (y_high - y_low)
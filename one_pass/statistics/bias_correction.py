@@ -10,7 +10,6 @@ a mean or sum depending on the variable."""
 import os
 from datetime import datetime
 import pickle
-import zarr
 import numpy as np
 import xarray as xr
 
@@ -136,6 +135,7 @@ class BiasCorrection:
 
         elif os.path.exists(zarr_name):
             # this means it has a zarr file
+            import zarr
             opa_self.statistics.digests_cum = zarr.load(
                 zarr_name
             )
@@ -0,0 +1,100 @@
+"""Exact histograms for statistics with fixed bins, when the request gives
+the range of the histogram. The counts of all the grid cells are kept in
+one (bins, cells) int32 array. Every incoming value is binned with one
+np.searchsorted on the bin edges, and for chunks with more than one time
+step the bins are counted per grid cell with np.bincount, as for the
+thresholds of exceedance.py."""
+
+import numpy as np
+
+from one_pass.statistics.moments import BLOCK_BYTES
+from one_pass.statistics.sketch import GridSketch
+
+class BinCounts(GridSketch):
+    """Exact histogram counts of n_cells grid cells in equal width bins.
+
+    As np.histogram, the bins are closed on the left and open on the
+    right, apart from the last bin which also includes the upper edge.
+    Values outside the range and NaN values are not counted.
+
+    Arguments
+    ----------
+    n_cells : int. Number of grid cells.
+    bins : int. Number of equal width bins.
+    range : [float, float]. Lower and upper edges of the bins.
+    block_bytes : int. Size in bytes of the blocks of grid cells counted
+            at once.
+
+    Attributes
+    ----------
+    counts : np.ndarray. int32 counts of shape (bins, n_cells).
+    edges : np.ndarray. The bins + 1 edges of the bins.
+    """
+
+    def __init__(self, n_cells : int, bins : int, range,
+                 block_bytes : int = BLOCK_BYTES
+                ):
+        super().__init__(n_cells)
+        self.bins = int(bins)
+        self.edges = np.linspace(range[0], range[1], self.bins + 1)
+        self.counts = np.zeros((self.bins, self.n_cells), dtype=np.int32)
+        self.block_bytes = block_bytes
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the counts"""
+        return self.counts.nbytes + self.edges.nbytes
+
+    def _levels(self, values : np.ndarray):
+        """Bin of every value plus one, 0 below the range and bins + 1
+        above the range or NaN (sorted last by np.searchsorted)"""
+        level = np.searchsorted(self.edges, values, side="right")
+        # the upper edge is in the last bin
+        level[values == self.edges[-1]] = self.bins
+        return level
+
+    def update(self, values : np.ndarray):
+        """Adds values of shape (time, n_cells) to the counts"""
+        values = np.reshape(values, (-1, self.n_cells))
+        n_time = values.shape[0]
+
+        if n_time == 1:
+            # every grid cell is in one bin at most
+            level = self._levels(values[0])
+            cells = np.flatnonzero((level > 0) & (level <= self.bins))
+            self.counts[level[cells] - 1, cells] += 1
+            return
+
+        n_levels = self.bins + 2
+        block_size = max(1, self.block_bytes // (8 * n_time))
+        for start in range(0, self.n_cells, block_size):
+            stop = min(start + block_size, self.n_cells)
+            n_block = stop - start
+            level = self._levels(values[:, start:stop])
+            # one bin per cell and level
+            level += np.arange(n_block) * n_levels
+            hist = np.bincount(
+                level.ravel(), minlength=n_block * n_levels
+            ).reshape(n_block, n_levels)
+            self.counts[:, start:stop] += hist[:, 1:-1].T.astype(np.int32)
+
+    def merge(self, other : "BinCounts"):
+        """Adds the counts of other, with the same bins"""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Can not merge histograms with different bins.")
+        self.counts += other.counts
+
+    def histogram(self, bins : int = None, range=None):
+        """Counts of shape (bins, n_cells) and edges of shape
+        (bins + 1, n_cells). The bins are fixed when the counts are
+        created, so bins and range are not used."""
+        counts, edges = self.final_histogram()
+        return counts.copy(), edges
+
+    def final_histogram(self, bins : int = None, range=None):
+        """histogram of the finished statistic, returning the counts
+        themselves instead of a copy. The edges are a read only view of
+        the edges shared by all the grid cells."""
+        return self.counts, np.broadcast_to(
+            self.edges[:, np.newaxis], (self.bins + 1, self.n_cells)
+        )
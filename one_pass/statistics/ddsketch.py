@@ -0,0 +1,278 @@
+"""DDSketch (Masson et al., 2019, https://arxiv.org/abs/1908.10693) of all
+the grid cells in fixed size numpy arrays, for percentiles with a known
+memory and a relative error guarantee.
+
+Every value x is counted in the logarithmic bucket k with
+gamma**(k - 1) < |x| <= gamma**k, where gamma = (1 + a) / (1 - a) for the
+relative accuracy a. Positive and negative values have one store each of
+n_buckets buckets per grid cell, zeros (and values smaller than
+MIN_VALUE) are counted separately. Every store keeps the n_buckets
+highest buckets of the cell: when a larger value arrives, the lowest
+buckets are collapsed into the lowest bucket kept, as the
+"collapsing lowest" stores of DDSketch. The stores are then moved
+n_buckets // 16 buckets above the largest value, so that they are
+rarely moved again.
+
+Relative error: a percentile of value x_q is returned as x with
+|x - x_q| <= a * |x_q|, where x_q is the exact percentile of rank
+q * (count - 1) rounded down (np.quantile with method="lower"), as long
+as |x_q| is larger than the largest absolute value of its sign in that
+cell divided by gamma**(n_buckets - n_buckets // 16 - 2). The
+percentiles 0 and 1 are the exact minimum and maximum.
+
+Memory: 4 * n_buckets + 32 bytes per grid cell for data without negative
+values, and 8 * n_buckets + 40 bytes with negative values, as the store
+of the negative values is only created when a negative value arrives.
+The memory does not grow with the number of values, up to 2**32 - 1
+values per cell.
+"""
+
+import numpy as np
+
+from one_pass.statistics.moments import BLOCK_BYTES
+from one_pass.statistics.sketch import GridSketch
+
+RELATIVE_ACCURACY = 0.01
+N_BUCKETS = 1024
+# absolute values below are counted as zero
+MIN_VALUE = np.finfo(np.float64).tiny
+# top of the stores without any value
+EMPTY = np.iinfo(np.int64).min
+
+class LogStore:
+    """Counts of the n_buckets highest logarithmic buckets of the
+    absolute values of n_cells grid cells.
+
+    Attributes
+    ----------
+    counts : np.ndarray. uint32 counts of shape (n_cells, n_buckets),
+            bucket j of a cell is the bucket top - n_buckets + 1 + j.
+    top : np.ndarray. Highest bucket of every cell, EMPTY for the cells
+            without any value.
+    """
+
+    def __init__(self, n_cells : int, n_buckets : int):
+        self.n_buckets = int(n_buckets)
+        self.margin = self.n_buckets // 16
+        self.counts = np.zeros((n_cells, self.n_buckets), dtype=np.uint32)
+        self.top = np.full(n_cells, EMPTY, dtype=np.int64)
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes + self.top.nbytes
+
+    def shift(self, top : np.ndarray):
+        """Moves the buckets of every cell up to the highest bucket top
+        (not lower than the current top), collapsing the buckets that are
+        no longer kept into the lowest bucket"""
+        cells = np.flatnonzero(top > self.top)
+        if cells.size == 0:
+            return
+        moved = cells[self.top[cells] != EMPTY]
+        if moved.size:
+            shift = np.minimum(
+                top[moved] - self.top[moved], self.n_buckets - 1
+            )[:, np.newaxis]
+            old = self.counts[moved]
+            column = np.arange(self.n_buckets) + shift
+            new = np.take_along_axis(
+                old, np.minimum(column, self.n_buckets - 1), axis=1
+            )
+            new[column >= self.n_buckets] = 0
+            # everything up to the new lowest bucket
+            new[:, 0] = np.take_along_axis(
+                np.cumsum(old, axis=1, dtype=np.uint64), shift, axis=1
+            )[:, 0]
+            self.counts[moved] = new
+        self.top[cells] = top[cells]
+
+    def add(self, keys : np.ndarray, valid : np.ndarray, block_bytes : int):
+        """Counts the buckets keys of shape (time, n_cells) where valid"""
+        n_time, n_cells = keys.shape
+        top = np.max(np.where(valid, keys, EMPTY), axis=0)
+        # room for larger values
+        top = np.where(top > self.top, top + self.margin, self.top)
+        self.shift(top)
+        column = np.clip(keys - (self.top - self.n_buckets + 1), 0, None)
+
+        if n_time == 1:
+            # every cell is in one bucket at most
+            cells = np.flatnonzero(valid[0])
+            self.counts[cells, column[0, cells]] += np.uint32(1)
+            return
+
+        block_size = max(1, block_bytes // (8 * max(n_time, self.n_buckets)))
+        for start in range(0, n_cells, block_size):
+            stop = min(start + block_size, n_cells)
+            n_block = stop - start
+            # one bin per cell and bucket
+            index = column[:, start:stop] + np.arange(n_block) * self.n_buckets
+            hist = np.bincount(
+                index[valid[:, start:stop]],
+                minlength=n_block * self.n_buckets
+            ).reshape(n_block, self.n_buckets)
+            self.counts[start:stop] += hist.astype(np.uint32)
+
+    def copy(self) -> "LogStore":
+        store = LogStore(0, self.n_buckets)
+        store.margin = self.margin
+        store.counts = self.counts.copy()
+        store.top = self.top.copy()
+        return store
+
+    def merge(self, other : "LogStore"):
+        """Adds the counts of other, which is not changed"""
+        top = np.maximum(self.top, other.top)
+        self.shift(top)
+        other = other.copy()
+        other.shift(top)
+        self.counts += other.counts
+
+class DDSketch(GridSketch):
+    """DDSketches of n_cells grid cells, for percentiles only.
+
+    Arguments
+    ----------
+    n_cells : int. Number of grid cells.
+    relative_accuracy : float. Relative accuracy a of the percentiles,
+            between 0 and 1.
+    n_buckets : int. Number of buckets of every store of every cell.
+    block_bytes : int. Size in bytes of the blocks of grid cells counted
+            at once.
+
+    Attributes
+    ----------
+    positive, negative : LogStore. Buckets of the positive and negative
+            values, negative is None until a negative value arrives.
+    zero : np.ndarray. Number of zeros of every cell.
+    count : np.ndarray. Number of values of every cell.
+    min, max : np.ndarray. Smallest and largest value of every cell.
+    """
+
+    def __init__(self, n_cells : int,
+                 relative_accuracy : float = RELATIVE_ACCURACY,
+                 n_buckets : int = N_BUCKETS,
+                 block_bytes : int = BLOCK_BYTES
+                ):
+        super().__init__(n_cells)
+        self.relative_accuracy = float(relative_accuracy)
+        self.gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.n_buckets = int(n_buckets)
+        self.block_bytes = block_bytes
+        self.positive = LogStore(self.n_cells, self.n_buckets)
+        self.negative = None
+        self.zero = np.zeros(self.n_cells, dtype=np.uint32)
+        self.count = np.zeros(self.n_cells, dtype=np.uint32)
+        self.min = np.full(self.n_cells, np.nan)
+        self.max = np.full(self.n_cells, np.nan)
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the sketches"""
+        nbytes = (self.positive.nbytes + self.zero.nbytes + self.count.nbytes
+                  + self.min.nbytes + self.max.nbytes)
+        if self.negative is not None:
+            nbytes += self.negative.nbytes
+        return nbytes
+
+    def update(self, values : np.ndarray):
+        """Adds values of shape (time, n_cells), ignoring NaN values"""
+        values = np.reshape(values, (-1, self.n_cells))
+        valid = ~np.isnan(values)
+        self.count += np.count_nonzero(valid, axis=0).astype(np.uint32)
+        self.min = np.fmin(self.min, np.fmin.reduce(values, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(values, axis=0))
+
+        magnitude = np.abs(values)
+        nonzero = magnitude >= MIN_VALUE
+        self.zero += np.count_nonzero(
+            valid & ~nonzero, axis=0
+        ).astype(np.uint32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            keys = np.ceil(np.log(magnitude) / self.log_gamma)
+        keys = np.where(nonzero, keys, 0).astype(np.int64)
+
+        negative = nonzero & (values < 0)
+        self.positive.add(keys, nonzero & (values > 0), self.block_bytes)
+        if negative.any():
+            if self.negative is None:
+                self.negative = LogStore(self.n_cells, self.n_buckets)
+            self.negative.add(keys, negative, self.block_bytes)
+
+    def merge(self, other : "DDSketch"):
+        """Adds the sketches of other, with the same relative accuracy and
+        number of buckets"""
+        if (other.gamma != self.gamma
+                or other.n_buckets != self.n_buckets):
+            raise ValueError(
+                "Can not merge sketches with a different relative accuracy "
+                "or number of buckets."
+            )
+        self.positive.merge(other.positive)
+        if other.negative is not None:
+            if self.negative is None:
+                self.negative = LogStore(self.n_cells, self.n_buckets)
+            self.negative.merge(other.negative)
+        self.zero += other.zero
+        self.count += other.count
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+
+    def quantile(self, q) -> np.ndarray:
+        """Quantiles q (between 0 and 1) of every cell, of shape
+        (len(q), n_cells), NaN for cells without any value"""
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        result = np.empty((self.n_cells, q.size))
+        # buckets in increasing order of value: negative (reversed),
+        # zero and positive
+        n_negative = 0 if self.negative is None else self.n_buckets
+        width = n_negative + 1 + self.n_buckets
+        block_size = max(1, self.block_bytes // (8 * width))
+        for start in range(0, self.n_cells, block_size):
+            stop = min(start + block_size, self.n_cells)
+            n_block = stop - start
+            counts = [self.zero[start:stop, np.newaxis],
+                      self.positive.counts[start:stop]]
+            if self.negative is not None:
+                counts.insert(0, self.negative.counts[start:stop, ::-1])
+            cum = np.cumsum(np.concatenate(counts, axis=1, dtype=np.int64),
+                            axis=1)
+            count = cum[:, -1]
+
+            # first bucket with more values than the rank, found in the
+            # flattened cumulative counts, shifted to increase over rows
+            rank = np.floor(
+                q * np.maximum(count - 1, 0)[:, np.newaxis]
+            ).astype(np.int64)
+            offset = (np.arange(n_block, dtype=np.int64)
+                      * (np.max(count, initial=0) + 1))[:, np.newaxis]
+            bucket = np.searchsorted(
+                (cum + offset).ravel(), (rank + offset).ravel(), side="right"
+            ).reshape(n_block, q.size)
+            bucket -= (np.arange(n_block) * width)[:, np.newaxis]
+            bucket = np.minimum(bucket, width - 1)
+
+            value = np.zeros((n_block, q.size))
+            is_positive = bucket > n_negative
+            key = (bucket - n_negative - 1 - self.n_buckets + 1
+                   + self.positive.top[start:stop, np.newaxis])
+            value[is_positive] = self._value(key[is_positive])
+            if self.negative is not None:
+                is_negative = bucket < n_negative
+                key = (n_negative - 1 - bucket - self.n_buckets + 1
+                       + self.negative.top[start:stop, np.newaxis])
+                value[is_negative] = -self._value(key[is_negative])
+            result[start:stop] = value
+
+        result = np.clip(
+            result, self.min[:, np.newaxis], self.max[:, np.newaxis]
+        )
+        result[:, q == 0] = self.min[:, np.newaxis]
+        result[:, q == 1] = self.max[:, np.newaxis]
+        return result.T
+
+    def _value(self, key : np.ndarray) -> np.ndarray:
+        """Value of the buckets, within the relative accuracy of all the
+        values of the bucket"""
+        return 2 * np.exp(key * self.log_gamma) / (1 + self.gamma)
@@ -0,0 +1,84 @@
+"""Kernel counting how often the incoming data exceeds every threshold of
+the thresh_exceed statistic. The thresholds are sorted once, so that one
+np.searchsorted gives the number of thresholds reached by every value,
+whatever the number of thresholds. For chunks with more than one time
+step these levels are counted per grid cell with np.bincount, and the
+counts of all thresholds are cumulative sums of that histogram."""
+
+import numpy as np
+
+from one_pass.statistics.moments import BLOCK_BYTES
+
+def count_exceedances(values : np.ndarray, thresholds, starts=None,
+                      block_bytes : int = BLOCK_BYTES
+                    ):
+    """Counts the time steps where values are greater than or equal to
+    the absolute value of every threshold (NaN values are counted, as
+    np.where(values < threshold, 0, 1) did).
+
+    Arguments
+    ----------
+    values : np.ndarray. Incoming data chunk, with time as the first
+            dimension and any number of other dimensions.
+    thresholds : list of float. Thresholds, in any order.
+    starts : np.ndarray. Optional index of the first time step of every
+            period to count separately (as in np.add.reduceat). By default
+            the whole chunk is one period.
+    block_bytes : int. Size in bytes of the blocks of grid cells counted
+            at once.
+
+    Returns
+    ---------
+    counts : np.ndarray of int64 with the shape (periods, thresholds,
+            *values.shape[1:]).
+    """
+    values = np.asarray(values)
+    if starts is None:
+        starts = np.array([0])
+    elif starts[0] > 0:
+        # as np.add.reduceat, time steps before the first period are
+        # not counted
+        values = values[starts[0]:]
+        starts = np.asarray(starts) - starts[0]
+    thresholds = np.abs(np.asarray(thresholds, dtype=np.float64))
+    order = np.argsort(thresholds, kind="stable")
+    sorted_thresholds = thresholds[order]
+    # position of every threshold in sorted_thresholds
+    rank = np.empty_like(order)
+    rank[order] = np.arange(np.size(order))
+    n_thresh = np.size(thresholds)
+
+    n_time = values.shape[0]
+    flat = values.reshape(n_time, -1)
+    n_cells = flat.shape[1]
+    n_periods = np.size(starts)
+    counts = np.empty((n_periods, n_thresh, n_cells), dtype=np.int64)
+
+    if n_time == 1:
+        # number of thresholds reached by every value
+        level = np.searchsorted(sorted_thresholds, flat[0], side="right")
+        np.greater(level, rank[:, np.newaxis], out=counts[0], casting="unsafe")
+        return counts.reshape((n_periods, n_thresh, *values.shape[1:]))
+
+    # period of every time step
+    period = np.zeros(n_time, dtype=np.int64)
+    period[starts[1:]] = 1
+    period = np.cumsum(period)[:, np.newaxis]
+
+    block_size = max(1, block_bytes // (8 * n_time))
+    for start in range(0, n_cells, block_size):
+        stop = min(start + block_size, n_cells)
+        n_block = stop - start
+        level = np.searchsorted(
+            sorted_thresholds, flat[:, start:stop], side="right"
+        )
+        # one bin per period, cell and level
+        level += (period * n_block + np.arange(n_block)) * (n_thresh + 1)
+        hist = np.bincount(
+            level.ravel(), minlength=n_periods * n_block * (n_thresh + 1)
+        ).reshape(n_periods, n_block, n_thresh + 1)
+        # values reaching more than j thresholds exceed sorted threshold j
+        exceed = np.cumsum(hist[:, :, :0:-1], axis=2)[:, :, ::-1]
+        counts[:, :, start:stop] = np.moveaxis(exceed[:, :, rank], 2, 1)
+
+    return counts.reshape((n_periods, n_thresh, *values.shape[1:]))
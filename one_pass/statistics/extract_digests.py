@@ -0,0 +1,129 @@
+"""Extraction of the percentiles and histograms of the crick digests of
+every grid cell, when a statistic is finished. crick has no batched
+functions, so the grid cells are split into batches of
+EXTRACT_BATCH_SIZE cells, which are extracted by a pool of threads
+straight into the preallocated output arrays. crick releases the GIL
+while it computes, so the batches run at the same time on several
+cores."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+# number of grid cells extracted by one task of the thread pool
+EXTRACT_BATCH_SIZE = 4096
+
+def get_extract_workers(n_cells : int, extract_workers : int = None) -> int:
+    """Number of threads extracting n_cells grid cells, one per core by
+    default and never more than the number of batches"""
+    if extract_workers is None:
+        extract_workers = os.cpu_count() or 1
+    n_batches = -(-n_cells // EXTRACT_BATCH_SIZE)
+    return max(1, min(extract_workers, n_batches))
+
+def extract_batches(extract_batch, n_cells : int,
+                    extract_workers : int = None, desc : str = None
+                ):
+    """Calls extract_batch(start, stop) for all the batches of grid
+    cells, in a pool of extract_workers threads.
+
+    Arguments
+    ----------
+    extract_batch : function filling the output of the grid cells start
+            to stop.
+    n_cells : int. Number of grid cells.
+    extract_workers : int. Number of threads, see get_extract_workers.
+    desc : str. If given, a tqdm progress bar with this description is
+            shown.
+    """
+    batches = [(start, min(start + EXTRACT_BATCH_SIZE, n_cells))
+               for start in range(0, n_cells, EXTRACT_BATCH_SIZE)]
+    progress = None
+    if desc is not None:
+        import tqdm
+        progress = tqdm.tqdm(total=n_cells, desc=desc)
+
+    n_threads = get_extract_workers(n_cells, extract_workers)
+    if n_threads == 1:
+        for start, stop in batches:
+            extract_batch(start, stop)
+            if progress is not None:
+                progress.update(stop - start)
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            futures = {pool.submit(extract_batch, start, stop): stop - start
+                       for start, stop in batches}
+            for future in as_completed(futures):
+                # raises the errors of the batch
+                future.result()
+                if progress is not None:
+                    progress.update(futures[future])
+
+    if progress is not None:
+        progress.close()
+
+def extract_percentiles(digests, percentile_list, out : np.ndarray = None,
+                        extract_workers : int = None, desc : str = None
+                    ) -> np.ndarray:
+    """Percentiles of every crick digest.
+
+    Arguments
+    ----------
+    digests : np.ndarray of TDigest, one per grid cell.
+    percentile_list : list of the percentiles, between 0 and 1.
+    out : np.ndarray of shape (len(percentile_list), number of grid cells)
+            to fill, created if not given.
+    extract_workers, desc : see extract_batches.
+
+    Returns
+    ---------
+    out : np.ndarray of the percentiles of every grid cell.
+    """
+    digests = np.ravel(digests)
+    if out is None:
+        out = np.empty((np.size(percentile_list), digests.size))
+
+    def extract_batch(start, stop):
+        for j in range(start, stop):
+            out[:, j] = digests[j].quantile(percentile_list)
+
+    extract_batches(extract_batch, digests.size, extract_workers, desc)
+    return out
+
+def extract_histograms(digests, bins : int, hist_range = None,
+                       counts : np.ndarray = None, edges : np.ndarray = None,
+                       extract_workers : int = None, desc : str = None
+                    ):
+    """Histograms of every crick digest.
+
+    Arguments
+    ----------
+    digests : np.ndarray of TDigest, one per grid cell.
+    bins : int. Number of bins.
+    hist_range : tuple of the lower and upper edge, or None for the range
+            of every digest.
+    counts, edges : np.ndarray of shape (bins, number of grid cells) and
+            (bins + 1, number of grid cells) to fill, created as float64 if
+            not given.
+    extract_workers, desc : see extract_batches.
+
+    Returns
+    ---------
+    counts, edges : np.ndarray of the counts and edges of the bins of
+            every grid cell.
+    """
+    digests = np.ravel(digests)
+    if counts is None:
+        counts = np.empty((bins, digests.size))
+    if edges is None:
+        edges = np.empty((bins + 1, digests.size))
+
+    def extract_batch(start, stop):
+        for j in range(start, stop):
+            counts[:, j], edges[:, j] = digests[j].histogram(
+                bins=bins, range=hist_range
+            )
+
+    extract_batches(extract_batch, digests.size, extract_workers, desc)
+    return counts, edges
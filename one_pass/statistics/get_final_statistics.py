@@ -3,7 +3,44 @@ is full at ndata = count"""
 
 import logging
 import numpy as np
-import tqdm
+
+from one_pass.statistics.extract_digests import extract_histograms
+from one_pass.statistics.extract_digests import extract_percentiles
+from one_pass.statistics.sketch import GridSketch
+
+def get_progress_desc(opa_self, desc : str):
+    """Description of the progress bar of the extraction from the
+    digests, which is only shown in debug mode"""
+    if opa_self.logger.isEnabledFor(logging.DEBUG):
+        return desc
+    return None
+
+def is_last_extraction(opa_self):
+    """Checks if the rolling summaries are reset after the final statistic
+    is created, so it can reuse their memory. Continuous statistics keep
+    updating them after every output."""
+    return opa_self.request.stat_freq != "continuous"
+
+def reshape_to_grid(opa_self, values : np.ndarray) -> np.ndarray:
+    """Reshapes values of shape (n, number of grid cells), with n the
+    percentiles or the bins of a histogram, back onto the grid with an
+    extra axis for time. For 1-D grids of cells (e.g. HEALPix or other
+    unstructured grids) the grid is already flat, so only the time axis
+    is added. Both are views of values, without a copy.
+
+    Arguments
+    ----------
+    opa_self : Opa class
+    values : np.ndarray of shape (n, size_data_source_tail).
+
+    Returns
+    ---------
+    values : np.ndarray of shape (1, n, *grid).
+    """
+    value = opa_self.data_set_info.shape_data_source_tail
+    if len(value) == 2:
+        return values[np.newaxis]
+    return np.reshape(values, [np.shape(values)[0], *value[1:]])[np.newaxis]
 
 def get_histogram(opa_self):
     """Converts tdigests into histograms. It first creates the
@@ -36,63 +73,36 @@ def get_histogram(opa_self):
         # if bins not set, setting to default
         opa_self.request.bins = 10
 
-    opa_self.statistics.histogram_cum = np.empty(
-        np.shape(
-            [opa_self.statistics.digests_cum]*opa_self.request.bins
-        ), dtype=np.int32
-    )
-    opa_self.statistics.histogram_bin_edges_cum = np.empty(
-        np.shape(
-            [opa_self.statistics.digests_cum]*(opa_self.request.bins+1)
-        ), dtype=np.float64
-    )
-
-    if hasattr(opa_self.request,"range") is False:
-        if opa_self.logger.isEnabledFor(logging.DEBUG):
-            for j in tqdm.tqdm(
-                    range(opa_self.data_set_info.size_data_source_tail),
-                    desc="extracting histogram from digests"
-                ):
-                opa_self.statistics.histogram_cum[:,j], \
-                opa_self.statistics.histogram_bin_edges_cum[:,j] = \
-                opa_self.statistics.digests_cum[j].histogram(
-                bins = opa_self.request.bins
+    hist_range = getattr(opa_self.request, "range", None)
+    if isinstance(opa_self.statistics.digests_cum, GridSketch):
+        # all the grid cells at once, counts are truncated to int32 as
+        # for crick
+        if is_last_extraction(opa_self):
+            counts, edges = opa_self.statistics.digests_cum.final_histogram(
+                bins = opa_self.request.bins, range = hist_range
             )
-
         else:
-        # this is looping through every grid cell
-            for j in range(opa_self.data_set_info.size_data_source_tail):
-                opa_self.statistics.histogram_cum[:,j], \
-                opa_self.statistics.histogram_bin_edges_cum[:,j] = \
-                    opa_self.statistics.digests_cum[j].histogram(
-                    bins = opa_self.request.bins
-                )
-
-    else: #tqdm.tqdm(
-        for j in range(opa_self.data_set_info.size_data_source_tail):
-            opa_self.statistics.histogram_cum[:,j], \
-            opa_self.statistics.histogram_bin_edges_cum[:,j] = \
-                opa_self.statistics.digests_cum[j].histogram(
-                bins = opa_self.request.bins, range = opa_self.request.range
+            counts, edges = opa_self.statistics.digests_cum.histogram(
+                bins = opa_self.request.bins, range = hist_range
             )
+        counts = np.asarray(counts).astype(np.int32, copy=False)
+
+    else:
+        # batches of grid cells extracted by a pool of threads
+        size = opa_self.data_set_info.size_data_source_tail
+        counts, edges = extract_histograms(
+            opa_self.statistics.digests_cum, opa_self.request.bins,
+            hist_range, np.empty((opa_self.request.bins, size), dtype=np.int32),
+            np.empty((opa_self.request.bins+1, size), dtype=np.float64),
+            opa_self.request.extract_workers, get_progress_desc(
+                opa_self, "extracting histogram from digests"
+            )
+        )
 
-    # # adding axis for time
-    value = opa_self.data_set_info.shape_data_source_tail
-    final_size_edges = [opa_self.request.bins+1, *value[1:]]
-    final_size_counts = [opa_self.request.bins, *value[1:]]
-
-    opa_self.statistics.histogram_cum = np.reshape(
-        opa_self.statistics.histogram_cum, final_size_counts
-    )
-    opa_self.statistics.histogram_bin_edges_cum = np.reshape(
-        opa_self.statistics.histogram_bin_edges_cum, final_size_edges
-    )
-
-    opa_self.statistics.histogram_cum = np.expand_dims(
-        opa_self.statistics.histogram_cum, axis=0
-    )
-    opa_self.statistics.histogram_bin_edges_cum = np.expand_dims(
-        opa_self.statistics.histogram_bin_edges_cum, axis=0
+    # back onto the grid with an axis for time
+    opa_self.statistics.histogram_cum = reshape_to_grid(opa_self, counts)
+    opa_self.statistics.histogram_bin_edges_cum = reshape_to_grid(
+        opa_self, edges
     )
 
 def get_percentile(opa_self):
@@ -115,27 +125,36 @@ def get_percentile(opa_self):
     if len(opa_self.request.percentile_list) == 0:
         opa_self.request.percentile_list = (np.linspace(0, 99, 100)) / 100
 
-    opa_self.statistics.percentile_cum = np.zeros(
-        np.shape([opa_self.statistics.digests_cum]*
-                 np.shape(opa_self.request.percentile_list)[0])
-        )
+    if isinstance(opa_self.statistics.digests_cum, GridSketch):
+        # all the grid cells at once
+        if is_last_extraction(opa_self):
+            opa_self.statistics.percentile_cum = \
+                opa_self.statistics.digests_cum.final_quantile(
+                opa_self.request.percentile_list
+            )
+        else:
+            opa_self.statistics.percentile_cum = \
+                opa_self.statistics.digests_cum.quantile(
+                opa_self.request.percentile_list
+            )
 
-    for j in range(opa_self.data_set_info.size_data_source_tail):
-        # for crick
-        opa_self.statistics.percentile_cum[:,j] = \
-            opa_self.statistics.digests_cum[j].quantile(
-            opa_self.request.percentile_list
+    else:
+        # for crick, batches of grid cells extracted by a pool of threads
+        # into an array allocated from the size of the grid
+        opa_self.statistics.percentile_cum = extract_percentiles(
+            opa_self.statistics.digests_cum,
+            opa_self.request.percentile_list,
+            np.empty((np.size(opa_self.request.percentile_list),
+                      opa_self.data_set_info.size_data_source_tail)),
+            opa_self.request.extract_workers, get_progress_desc(
+                opa_self, "extracting percentiles from digests"
+            )
         )
 
-    value = opa_self.data_set_info.shape_data_source_tail
-    final_size = [np.size(opa_self.request.percentile_list), *value[1:]]
-    # with the percentiles we add another dimension for the percentiles
-    opa_self.statistics.percentile_cum = np.reshape(
-        opa_self.statistics.percentile_cum, final_size
-    )
-    # adding axis for time
-    opa_self.statistics.percentile_cum = np.expand_dims(
-        opa_self.statistics.percentile_cum, axis=0
+    # with the percentiles we add another dimension for the percentiles,
+    # and an axis for time
+    opa_self.statistics.percentile_cum = reshape_to_grid(
+        opa_self, opa_self.statistics.percentile_cum
     )
 
 def get_std(opa_self):
@@ -153,7 +172,15 @@ def get_std(opa_self):
     opa_self.std_cum : np.ndarray updated cumulative standard deviation by
             square rooting the value of the cumulative variance. 
     """
-    opa_self.statistics.std_cum = np.sqrt(opa_self.statistics.var_cum)
+    if (is_last_extraction(opa_self)
+            and isinstance(opa_self.statistics.var_cum, np.ndarray)
+            and opa_self.statistics.var_cum.dtype.kind == "f"):
+        # the variance is not needed any more, so its array is reused
+        opa_self.statistics.std_cum = np.sqrt(
+            opa_self.statistics.var_cum, out=opa_self.statistics.var_cum
+        )
+    else:
+        opa_self.statistics.std_cum = np.sqrt(opa_self.statistics.var_cum)
 
 def get_final_statistics(opa_self):
     """Called when n_data == count and we need to create the final
@@ -0,0 +1,282 @@
+"""Fused kernel reducing an incoming data chunk over its time dimension.
+The sum, mean, sum of squared differences from the mean (M2), minimum,
+maximum and the time indexes of the minimum and maximum are computed in
+one sweep over the chunk. The "nan" moments are the same reductions
+ignoring the NaN values, with the number of values of every cell in
+"count", for the skipna requests. The grid is processed in blocks of cells small
+enough to stay in the cache, so every reduction of a block reads it from
+the cache instead of reading the whole chunk from memory again.
+
+When several statistics of an OpaGroup need moments of the same chunk,
+they are computed once in a MomentsCache shared by all of them."""
+
+import numpy as np
+
+# all of the outputs of compute_moments
+MOMENTS = ("sum", "mean", "m2", "min", "argmin", "max", "argmax",
+           "count", "nansum", "nanmean", "nanm2", "nanmin", "nanargmin",
+           "nanmax", "nanargmax")
+
+# moments used by each statistic to reduce a chunk with more than one
+# time step
+STAT_MOMENTS = {
+    "mean" : ("mean",),
+    "sum" : ("sum",),
+    "var" : ("mean", "m2"),
+    "std" : ("mean", "m2"),
+    "min" : ("min", "argmin"),
+    "max" : ("max", "argmax"),
+}
+
+# moments of the statistics of skipna requests
+NAN_STAT_MOMENTS = {
+    "mean" : ("count", "nanmean"),
+    "sum" : ("count", "nansum"),
+    "var" : ("count", "nanmean", "nanm2"),
+    "std" : ("count", "nanmean", "nanm2"),
+    "min" : ("count", "nanmin", "nanargmin"),
+    "max" : ("count", "nanmax", "nanargmax"),
+}
+
+def get_stat_moments(request : object):
+    """Moments used by the statistic of request, or None if it does not
+    use the moments kernel"""
+    if getattr(request, "skipna", False):
+        return NAN_STAT_MOMENTS.get(request.stat)
+    return STAT_MOMENTS.get(request.stat)
+
+# size in bytes of the block of the chunk reduced at once, about the size
+# of a level 2 cache
+BLOCK_BYTES = 2**18
+
+def compute_moments(values : np.ndarray, needed, axis : int = 0,
+                    block_bytes : int = BLOCK_BYTES
+                ):
+    """Reduces values over the time axis in one sweep over blocks of
+    grid cells.
+
+    Arguments
+    ----------
+    values : np.ndarray. Incoming data chunk.
+    needed : iterable of str. Moments to compute, from MOMENTS.
+    axis : int. The time axis of values.
+    block_bytes : int. Size in bytes of the blocks of values.
+
+    Returns
+    ---------
+    moments : dict. For every needed moment an np.ndarray with the shape
+            of values but with a time dimension of 1 (float64, or int64
+            for count and the time indexes). m2 is the sum of squared differences
+            from the mean of the chunk, so the sample variance of the
+            chunk is m2 / (n - 1). The "nan" moments of the cells
+            without any value are NaN, or 0 for nansum and nanm2 as
+            np.nansum.
+    """
+    needed = set(needed)
+    unknown = needed - set(MOMENTS)
+    if unknown:
+        raise ValueError(f"Unknown moments {sorted(unknown)}.")
+    if "m2" in needed:
+        needed.add("mean")
+    if "mean" in needed:
+        needed.add("sum")
+    if "nanm2" in needed:
+        needed.add("nanmean")
+    if "nanmean" in needed:
+        needed.add("nansum")
+    if any(name.startswith("nan") for name in needed):
+        needed.add("count")
+
+    values = np.moveaxis(np.asarray(values), axis, 0)
+    out_shape = (1, *values.shape[1:])
+    n_time = values.shape[0]
+    # (time, cells), a view if values is contiguous
+    flat = values.reshape(n_time, -1)
+    n_cells = flat.shape[1]
+
+    if n_time == 1:
+        # the moments of a single time step are the time step itself
+        return {
+            name : np.moveaxis(value.reshape(out_shape), 0, axis)
+            for name, value in single_step_moments(flat[0], needed).items()
+        }
+
+    flat_moments = {}
+    for name in needed:
+        dtype = (np.int64 if name.startswith(("arg", "nanarg", "count"))
+                 else np.float64)
+        flat_moments[name] = np.empty(n_cells, dtype=dtype)
+
+    block_size = max(1, block_bytes // (8 * n_time))
+    diff = None
+    if "m2" in needed or "nanm2" in needed:
+        # differences from the mean of one block, reused for all blocks
+        diff = np.empty((n_time, min(block_size, n_cells)), dtype=np.float64)
+    if "count" in needed:
+        valid = np.empty((n_time, min(block_size, n_cells)), dtype=bool)
+
+    for start in range(0, n_cells, block_size):
+        stop = min(start + block_size, n_cells)
+        block = flat[:, start:stop]
+
+        if "sum" in needed:
+            block_sum = flat_moments["sum"][start:stop]
+            np.add.reduce(block, axis=0, dtype=np.float64, out=block_sum)
+        if "mean" in needed:
+            block_mean = flat_moments["mean"][start:stop]
+            np.divide(block_sum, n_time, out=block_mean)
+        if "m2" in needed:
+            block_diff = diff[:, :stop - start]
+            np.subtract(block, block_mean, out=block_diff)
+            np.multiply(block_diff, block_diff, out=block_diff)
+            np.add.reduce(
+                block_diff, axis=0, out=flat_moments["m2"][start:stop]
+            )
+
+        for name in ("min", "max"):
+            if name in needed or "arg" + name in needed:
+                index = getattr(np, "arg" + name)(block, axis=0)
+                if "arg" + name in needed:
+                    flat_moments["arg" + name][start:stop] = index
+                if name in needed:
+                    flat_moments[name][start:stop] = np.take_along_axis(
+                        block, index[np.newaxis], axis=0
+                    )[0]
+
+        if "count" in needed:
+            block_valid = valid[:, :stop - start]
+            np.isnan(block, out=block_valid)
+            np.logical_not(block_valid, out=block_valid)
+            np.add.reduce(block_valid, axis=0, dtype=np.int64,
+                          out=flat_moments["count"][start:stop])
+            reduce_nan_moments(
+                block, block_valid, flat_moments, needed, start, stop, diff
+            )
+
+    return {
+        name : np.moveaxis(value.reshape(out_shape), 0, axis)
+        for name, value in flat_moments.items()
+    }
+
+def single_step_moments(values : np.ndarray, needed) -> dict:
+    """Moments of a chunk of one time step, values of shape (cells,)"""
+    values = values.astype(np.float64)
+    valid = None
+    moments = {}
+    for name in needed:
+        if name.startswith(("arg", "nanarg")):
+            moments[name] = np.zeros(values.shape, dtype=np.int64)
+        elif name in ("m2", "nanm2"):
+            moments[name] = np.zeros(values.shape)
+        elif name in ("count", "nansum"):
+            if valid is None:
+                valid = ~np.isnan(values)
+            if name == "count":
+                moments[name] = valid.astype(np.int64)
+            else:
+                moments[name] = np.where(valid, values, 0)
+        else:
+            moments[name] = values
+    return moments
+
+def reduce_nan_moments(block : np.ndarray, valid : np.ndarray,
+                       flat_moments : dict, needed, start : int, stop : int,
+                       diff : np.ndarray = None
+                    ):
+    """Reduces one block of the chunk ignoring its NaN values, into the
+    "nan" moments of flat_moments. The sums only add the valid values
+    (masked ufuncs), the extremes are reduced with np.fmin and np.fmax
+    and their time indexes are found as in np.nanargmin and
+    np.nanargmax, replacing NaN by +inf or -inf."""
+    count = flat_moments["count"][start:stop]
+    if "nansum" in needed:
+        block_sum = flat_moments["nansum"][start:stop]
+        np.add.reduce(block, axis=0, dtype=np.float64, out=block_sum,
+                      where=valid)
+    if "nanmean" in needed:
+        block_mean = flat_moments["nanmean"][start:stop]
+        block_mean.fill(np.nan)
+        np.divide(block_sum, count, out=block_mean, where=count > 0)
+    if "nanm2" in needed:
+        block_diff = diff[:, :stop - start]
+        np.subtract(block, block_mean, out=block_diff)
+        np.multiply(block_diff, block_diff, out=block_diff)
+        np.add.reduce(
+            block_diff, axis=0, out=flat_moments["nanm2"][start:stop],
+            where=valid
+        )
+
+    for name, reduce, fill in (("min", np.fmin, np.inf),
+                               ("max", np.fmax, -np.inf)):
+        if "nan" + name in needed:
+            flat_moments["nan" + name][start:stop] = reduce.reduce(
+                block, axis=0
+            )
+        if "nanarg" + name in needed:
+            flat_moments["nanarg" + name][start:stop] = getattr(
+                np, "arg" + name
+            )(np.where(valid, block, fill), axis=0)
+
+class MomentsCache:
+    """Moments of the incoming data chunk shared by the statistics of an
+    OpaGroup. The first statistic asking for moments of a chunk computes
+    all of the moments needed by the group in one sweep, and the other
+    statistics get the same arrays. The chunk is kept referenced so that
+    its memory can not be re-used by another array while cached. The
+    cache is cleared after every OpaGroup.compute.
+
+    Attributes
+    ----------
+    needed : set. Moments needed by all the statistics of the group.
+    """
+
+    def __init__(self, needed):
+        self.needed = set(needed)
+        self.values = None
+        self.axis = None
+        self.moments = None
+
+    def _matches(self, values : np.ndarray, axis : int):
+        """Checks if values is the cached chunk (or a view of exactly
+        the same data)"""
+        if self.values is None or axis != self.axis:
+            return False
+        if values is self.values:
+            return True
+        return (
+            values.shape == self.values.shape
+            and values.strides == self.values.strides
+            and values.dtype == self.values.dtype
+            and values.__array_interface__["data"][0]
+            == self.values.__array_interface__["data"][0]
+        )
+
+    def get(self, values : np.ndarray, needed, axis : int = 0):
+        """Returns the moments of values, computed if they are not
+        cached yet
+
+        Arguments
+        ----------
+        values : np.ndarray. Incoming data chunk.
+        needed : iterable of str. Moments needed by the caller.
+        axis : int. The time axis of values.
+
+        Returns
+        ---------
+        moments : dict. See compute_moments
+        """
+        needed = set(needed)
+        if (not self._matches(values, axis)
+                or not needed.issubset(self.moments)):
+            self.moments = compute_moments(
+                values, self.needed | needed, axis
+            )
+            self.values = values
+            self.axis = axis
+        return self.moments
+
+    def clear(self):
+        """Removes the cached chunk and its moments"""
+        self.values = None
+        self.axis = None
+        self.moments = None
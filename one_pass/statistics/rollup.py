@@ -0,0 +1,372 @@
+"""Module for rolling up the finished statistics into coarser frequencies
+(e.g. daily into monthly and yearly). When a stat_freq statistic is
+complete, its rolling summary is merged into one accumulator per
+requested rollup_freq, so several frequencies are created while the
+raw data is only passed through the Opa once."""
+
+from dataclasses import dataclass
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from one_pass.convert_time import convert_time
+from one_pass.initialise.initialise_statistics import get_compression
+from one_pass.initialise.grid_mask import get_output_template
+from one_pass.initialise.grid_mask import unmask_cells
+from one_pass.saving.create_data_sets import change_data_source_shape
+from one_pass.saving.modify_attributes import assign_new_attributes
+from one_pass.saving.modify_attributes import get_datetime_str
+from one_pass.saving.save_final import save_data_set
+from one_pass.statistics.extract_digests import extract_percentiles
+from one_pass.statistics.get_final_statistics import reshape_to_grid
+from one_pass.statistics.sketch import GridSketch
+from one_pass.statistics.update_statistics import copy_state_value
+
+# time format used in the file names of the rolled up statistics
+rollup_file_time_format = {
+    "hourly" : "%Y_%m_%d_T%H",
+    "2hourly" : "%Y_%m_%d_T%H",
+    "3hourly" : "%Y_%m_%d_T%H",
+    "6hourly" : "%Y_%m_%d_T%H",
+    "12hourly" : "%Y_%m_%d_T%H",
+    "daily" : "%Y_%m_%d",
+    "weekly" : "%Y_%m_%d",
+    "monthly" : "%Y_%m",
+    "3monthly" : "%Y_%m",
+    "yearly" : "%Y",
+}
+
+@dataclass
+class RollUpLevel:
+    """Data class holding the accumulator of one rollup_freq.
+
+    rollup_freq : str. The coarser frequency of this accumulator.
+    n_data : int. Number of time steps required for the rolled up
+            statistic to complete.
+    count : int. Number of time steps merged so far.
+    init_time_stamp : pd.Timestamp. Time stamp of the first time step
+            of the rolled up statistic.
+    next_time_stamp : pd.Timestamp. Expected first time stamp of the
+            next finished stat_freq statistic.
+    mean_cum : np.ndarray. Rolling mean (mean, var and std).
+    var_cum : np.ndarray. Rolling sum of squared differences from the
+            mean (M2, var and std).
+    sum_cum : np.ndarray. Rolling sum.
+    min_cum : np.ndarray. Rolling minimum.
+    max_cum : np.ndarray. Rolling maximum.
+    timings_cum : np.ndarray. Time stamps of the minimum or maximum.
+    digests_cum : np.ndarray. Flat array of TDigest objects, or one
+            GridSketch.
+    """
+    rollup_freq : str = None
+    n_data : int = None
+    count : int = 0
+    init_time_stamp : pd.Timestamp = None
+    next_time_stamp : pd.Timestamp = None
+    mean_cum : np.ndarray = None
+    var_cum : np.ndarray = None
+    sum_cum : np.ndarray = None
+    min_cum : np.ndarray = None
+    max_cum : np.ndarray = None
+    timings_cum : np.ndarray = None
+    digests_cum : np.ndarray = None
+
+class RollUp:
+    """Class holding one RollUpLevel per requested rollup_freq and the
+    last completed xr.Dataset of each of them.
+    """
+    def __init__(self, opa_self : object):
+        """Initialisation of the roll up class
+
+        levels : List[RollUpLevel]. One accumulator per rollup_freq.
+        final_cum : dict. The last completed xr.Dataset for every
+                rollup_freq, with the rollup_freq as key.
+        """
+        self.levels = [
+            RollUpLevel(rollup_freq = rollup_freq)
+            for rollup_freq in opa_self.request.rollup_freq
+        ]
+        self.final_cum = {}
+
+    def in_progress(self):
+        """Checks if any of the rolled up statistics has started but
+        is not complete, and so needs to be checkpointed.
+        """
+        return any(level.count > 0 for level in self.levels)
+
+    def update(self, opa_self : object, data_source : xr.DataArray):
+        """Called when the stat_freq statistic is complete (count ==
+        n_data) before the final statistic is created. Merges it into
+        every rollup_freq accumulator and creates the final xr.Dataset
+        of the ones that are complete.
+
+        Arguments
+        ----------
+        opa_self : Opa class
+        data_source : xr.DataArray. Incoming data, only used for the
+                dimensions and co-ordinates of the final xr.Dataset.
+        """
+        fine = get_finished_state(opa_self)
+        for level in self.levels:
+            self._update_level(opa_self, level, fine, data_source)
+
+    def _update_level(self, opa_self : object, level : RollUpLevel,
+                      fine : dict, data_source : xr.DataArray
+                    ):
+        """Merges the finished stat_freq statistic into one accumulator.
+        A rolled up statistic only starts from a stat_freq statistic
+        that starts at the beginning of the rollup_freq, and is reset
+        if a stat_freq statistic is missing.
+        """
+        init_time_stamp = opa_self.time.init_time_stamp
+
+        if level.count > 0 and init_time_stamp != level.next_time_stamp:
+            opa_self.logger.warning(
+                "The %s statistic starting at %s does not follow the "
+                "previous one, expected %s. The %s roll up has been reset.",
+                opa_self.request.stat_freq, init_time_stamp,
+                level.next_time_stamp, level.rollup_freq
+            )
+            reset_level(level)
+
+        if level.count == 0:
+            stat_freq_min, time_stamp_min = convert_time(
+                level.rollup_freq, init_time_stamp, opa_self
+            )
+            if time_stamp_min >= opa_self.request.time_step:
+                # not the start of the rolled up statistic
+                return
+            level.n_data = int(stat_freq_min / opa_self.request.time_step)
+            level.init_time_stamp = init_time_stamp
+            for key, value in fine.items():
+                if key == "digests_cum":
+                    # several levels can start from the same finished
+                    # statistic, each one merges into its own digests
+                    value = copy_digests(opa_self, value)
+                setattr(level, key, value)
+        else:
+            merge_state(opa_self, level, fine)
+
+        level.count += opa_self.time.n_data
+        level.next_time_stamp = init_time_stamp + pd.Timedelta(
+            minutes = opa_self.time.n_data * opa_self.request.time_step
+        )
+
+        if level.count >= level.n_data:
+            self.final_cum[level.rollup_freq] = create_rollup_data_set(
+                opa_self, level, data_source
+            )
+            if opa_self.request.save:
+                save_rollup_nc(opa_self, level)
+            opa_self.logger.debug(
+                "Rolled up %s %s statistic starting at %s is complete.",
+                level.rollup_freq, opa_self.request.stat,
+                level.init_time_stamp
+            )
+            reset_level(level)
+
+def reset_level(level : RollUpLevel):
+    """Resets all the attributes of a roll up accumulator, apart
+    from its frequency"""
+    for key in vars(level):
+        if key != "rollup_freq":
+            setattr(level, key, RollUpLevel.__dataclass_fields__[key].default)
+
+def get_finished_state(opa_self : object):
+    """Extracts the rolling summaries of the finished stat_freq statistic
+    that are needed for the roll up. The variance is converted back from
+    the sample variance into the sum of squared differences (M2).
+
+    Returns
+    ---------
+    fine : dict. Rolling summaries with the RollUpLevel names as keys.
+    """
+    stat = opa_self.request.stat
+    statistics = opa_self.statistics
+    fine = {}
+
+    if stat in ("mean", "var", "std"):
+        fine["mean_cum"] = copy_state_value(opa_self, "mean_cum")
+
+    if stat in ("var", "std"):
+        var_cum = copy_state_value(opa_self, "var_cum")
+        if opa_self.time.n_data > 1:
+            var_cum = var_cum * (opa_self.time.n_data - 1)
+        fine["var_cum"] = var_cum
+
+    elif stat == "sum":
+        fine["sum_cum"] = copy_state_value(opa_self, "sum_cum")
+
+    elif stat in ("min", "max"):
+        fine[stat + "_cum"] = np.array(getattr(statistics, stat + "_cum"))
+        fine["timings_cum"] = np.asarray(statistics.timings_cum).astype(
+            "datetime64[ns]"
+        )
+
+    elif stat == "percentile":
+        fine["digests_cum"] = statistics.digests_cum
+
+    return fine
+
+def copy_digests(opa_self : object, digests):
+    """Copy of the digests of a finished statistic that a roll up
+    accumulator can merge into: a copy of a GridSketch, or new crick
+    TDigests with the finished ones merged into them.
+
+    Returns
+    ---------
+    digests : GridSketch or np.ndarray of TDigest.
+    """
+    if isinstance(digests, GridSketch):
+        return digests.copy()
+
+    from crick import TDigest
+
+    compression = get_compression(opa_self)
+    digests = np.ravel(digests)
+    copies = np.empty(digests.size, dtype=object)
+    for j, digest in enumerate(digests):
+        copies[j] = TDigest(compression=compression)
+        copies[j].merge(digest)
+    return copies
+
+def merge_state(opa_self : object, level : RollUpLevel, fine : dict):
+    """Merges the finished stat_freq rolling summaries into the roll up
+    accumulator. Uses the Chan et al. pairwise update for the mean and
+    M2, elementwise operations for sum, min and max and merges the
+    digests for percentiles.
+    """
+    stat = opa_self.request.stat
+    count_a = level.count
+    count_b = opa_self.time.n_data
+    count = count_a + count_b
+
+    if stat in ("mean", "var", "std"):
+        delta = fine["mean_cum"] - level.mean_cum
+        if stat != "mean":
+            level.var_cum = (
+                level.var_cum + fine["var_cum"]
+                + np.square(delta) * (count_a * count_b / count)
+            )
+        level.mean_cum = level.mean_cum + delta * (count_b / count)
+
+    elif stat == "sum":
+        level.sum_cum = level.sum_cum + fine["sum_cum"]
+
+    elif stat in ("min", "max"):
+        if stat == "min":
+            replace = fine["min_cum"] < level.min_cum
+        else:
+            replace = fine["max_cum"] > level.max_cum
+        setattr(level, stat + "_cum", np.where(
+            replace, fine[stat + "_cum"], getattr(level, stat + "_cum")
+        ))
+        level.timings_cum = np.where(
+            replace, fine["timings_cum"], level.timings_cum
+        )
+
+    elif stat == "percentile":
+        if isinstance(level.digests_cum, GridSketch):
+            level.digests_cum.merge(fine["digests_cum"])
+        else:
+            for j in range(opa_self.data_set_info.size_data_source_tail):
+                level.digests_cum[j].merge(fine["digests_cum"][j])
+
+def get_rollup_final_stat(opa_self : object, level : RollUpLevel):
+    """Creates the final statistic of a complete roll up accumulator"""
+    stat = opa_self.request.stat
+
+    if stat == "mean":
+        final_stat = level.mean_cum
+
+    elif stat in ("var", "std"):
+        final_stat = level.var_cum
+        if level.count > 1:
+            final_stat = final_stat / (level.count - 1)
+        if stat == "std":
+            final_stat = np.sqrt(final_stat)
+
+    elif stat == "percentile":
+        if len(opa_self.request.percentile_list) == 0:
+            opa_self.request.percentile_list = (np.linspace(0, 99, 100)) / 100
+
+        if isinstance(level.digests_cum, GridSketch):
+            final_stat = level.digests_cum.quantile(
+                opa_self.request.percentile_list
+            )
+        else:
+            final_stat = extract_percentiles(
+                level.digests_cum, opa_self.request.percentile_list,
+                extract_workers=opa_self.request.extract_workers
+            )
+        final_stat = reshape_to_grid(opa_self, final_stat)
+
+    else:
+        final_stat = getattr(level, stat + "_cum")
+
+    return final_stat
+
+def create_rollup_data_set(opa_self : object, level : RollUpLevel,
+                           data_source : xr.DataArray
+                        ):
+    """Creates the xr.Dataset of a complete roll up accumulator with the
+    time stamp of the start of the rolled up statistic.
+
+    Returns
+    ---------
+    dm : xr.Dataset
+    """
+    data_source = get_output_template(opa_self, data_source).tail(time=1)
+    data_source = data_source.assign_coords(
+        time=(["time"], [level.init_time_stamp], data_source.time.attrs)
+    )
+    final_stat = get_rollup_final_stat(opa_self, level)
+    data_source, final_stat = change_data_source_shape(
+        opa_self, data_source, final_stat
+    )
+
+    data_set_attr = dict(opa_self.data_set_info.data_set_attr or {})
+    data_var_attr = dict(opa_self.data_set_info.data_var_attr or {})
+    new_attr_str = str(
+        get_datetime_str() + " " + level.rollup_freq + " "
+        + opa_self.request.stat + " calculated using one_pass algorithm"
+        " from " + opa_self.request.stat_freq + " statistics\n"
+    )
+    assign_new_attributes(data_set_attr, data_var_attr, new_attr_str)
+
+    dm = xr.Dataset(
+        data_vars=dict(
+            [(str(data_source.name), (
+                data_source.dims, unmask_cells(opa_self, final_stat),
+                data_var_attr
+            ))],
+        ),
+        coords=dict(data_source.coords),
+        attrs=data_set_attr,
+    )
+
+    if opa_self.request.stat in ("min", "max"):
+        dm = dm.assign(timings = (
+            data_source.dims, unmask_cells(opa_self, level.timings_cum)
+        ))
+
+    return dm
+
+def save_rollup_nc(opa_self : object, level : RollUpLevel):
+    """Saves the final xr.Dataset of a complete roll up accumulator.
+    The file name follows the one of the stat_freq statistics with the
+    rollup_freq in place of the stat_freq.
+    """
+    final_time_file_str = level.init_time_stamp.strftime(
+        rollup_file_time_format[level.rollup_freq]
+    )
+    file_name = os.path.join(
+        opa_self.request.save_filepath,
+        f"{final_time_file_str}_{opa_self.request.variable}_"
+        f"timestep_{opa_self.request.time_step}_"
+        f"{level.rollup_freq}_{opa_self.request.stat}.nc",
+    )
+    dm = opa_self.rollup.final_cum[level.rollup_freq]
+    save_data_set(opa_self, dm, file_name)
@@ -0,0 +1,85 @@
+"""Exact percentiles for statistics with few time steps, e.g. daily
+percentiles of hourly data. All the time steps of the statistic are
+kept in one preallocated (n_data, cells) array, and the percentiles of
+all the grid cells are computed from it at the end with one sort, as
+np.quantile does (linear interpolation), ignoring NaN values."""
+
+import numpy as np
+
+from one_pass.statistics.sketch import GridSketch
+
+class SampleBuffer(GridSketch):
+    """All the values of n_cells grid cells for up to n_data time steps.
+
+    Arguments
+    ----------
+    n_data : int. Number of time steps in the statistic.
+    n_cells : int. Number of grid cells.
+
+    Attributes
+    ----------
+    values : np.ndarray. Values of shape (n_data, n_cells), of which
+            the first count time steps are used.
+    count : int. Number of time steps added.
+    """
+
+    def __init__(self, n_data : int, n_cells : int):
+        super().__init__(n_cells)
+        self.values = np.empty((int(n_data), self.n_cells))
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the buffer"""
+        return self.values.nbytes
+
+    def update(self, values : np.ndarray):
+        """Adds values of shape (time, n_cells) to the buffer"""
+        values = np.reshape(values, (-1, self.n_cells))
+        n_time = values.shape[0]
+        if self.count + n_time > self.values.shape[0]:
+            raise ValueError(
+                f"Can not add {n_time} time steps to a buffer of "
+                f"{self.values.shape[0]} time steps holding {self.count}."
+            )
+        self.values[self.count:self.count + n_time] = values
+        self.count += n_time
+
+    def quantile(self, q, overwrite : bool = False) -> np.ndarray:
+        """Quantiles q (between 0 and 1) of every cell, of shape
+        (len(q), n_cells), as np.nanquantile. NaN for cells without any
+        value. If overwrite is True the buffer is sorted in place instead
+        of in a copy of the buffer, so the values lose their time order."""
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.count == 0:
+            return np.full((q.size, self.n_cells), np.nan)
+        # NaN are sorted last
+        if overwrite:
+            values = self.values[:self.count]
+            values.sort(axis=0)
+        else:
+            values = np.sort(self.values[:self.count], axis=0)
+        if not np.isnan(values[-1]).any():
+            # the same time steps are interpolated in every cell
+            position = q * (self.count - 1)
+            low = np.floor(position).astype(np.int64)
+            high = np.minimum(low + 1, self.count - 1)
+            fraction = (position - low)[:, np.newaxis]
+            return values[low] + fraction * (values[high] - values[low])
+
+        n_valid = self.count - np.count_nonzero(np.isnan(values), axis=0)
+        position = q[:, np.newaxis] * np.maximum(n_valid - 1, 0)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, np.maximum(n_valid - 1, 0))
+        fraction = position - low
+
+        value_low = np.take_along_axis(values, low, axis=0)
+        value_high = np.take_along_axis(values, high, axis=0)
+        result = value_low + fraction * (value_high - value_low)
+        result[:, n_valid == 0] = np.nan
+        return result
+
+    def final_quantile(self, q) -> np.ndarray:
+        """Quantiles of the finished statistic, sorting the buffer in
+        place"""
+        return self.quantile(q, overwrite=True)
@@ -0,0 +1,199 @@
+"""Functions to reduce all the complete statistic periods contained in
+one incoming data chunk in a single vectorised step, instead of passing
+the data through the Opa one period at a time"""
+
+from typing import List
+from pandas import Timestamp
+import numpy as np
+import xarray as xr
+
+from one_pass.convert_time import convert_time
+from one_pass.initialise.initialise_statistics import (
+    get_state_dtype, get_count_dtype
+)
+from one_pass.statistics.exceedance import count_exceedances
+
+# statistics that can be reduced over several periods at once
+SEGMENTED_STATS = (
+    "mean", "sum", "var", "std", "min", "max", "thresh_exceed"
+)
+
+def can_reduce_segments(opa_self : object, data_source : xr.DataArray):
+    """Checks if the segmented reduction can be used for the request and
+    the incoming data. Continuous statistics, digests, iams and the bias
+    correction keep a rolling state between periods so are not reduced
+    here, and neither is lazy (dask) data or the skipna requests.
+
+    Arguments
+    ----------
+    opa_self : Opa class
+    data_source : xr.DataArray. Incoming data chunk
+
+    Returns
+    ---------
+    bool : True if the complete periods can be reduced at once
+    """
+    return bool(
+        opa_self.request.stat in SEGMENTED_STATS
+        and opa_self.request.stat_freq != "continuous"
+        and not opa_self.request.skipna
+        and isinstance(data_source.data, np.ndarray)
+        and data_source.get_axis_num("time") == 0
+    )
+
+def find_complete_periods(opa_self : object,
+                          time_stamp_list : List[Timestamp]
+                        ):
+    """Finds the start and end indexes of all the complete stat_freq
+    periods in the incoming time stamps. The first time stamp has to be
+    the start of a statistic and the time stamps have to be evenly spaced
+    by the time_step, otherwise no periods are returned and the data is
+    passed through the usual per period path.
+
+    Arguments
+    ----------
+    opa_self : Opa class
+    time_stamp_list : List[pd.Timestamp]. Sorted time stamps of the
+            incoming data
+
+    Returns
+    ---------
+    starts : np.ndarray. Index of the first time stamp of every complete
+            period
+    ends : np.ndarray. Index after the last time stamp of every complete
+            period
+    """
+    starts, ends = [], []
+    weight = len(time_stamp_list)
+
+    if weight > 1:
+        time_diff = np.diff(
+            np.array(time_stamp_list, dtype="datetime64[ns]")
+        ) / np.timedelta64(1, "m")
+        if not np.all(time_diff == opa_self.request.time_step):
+            return np.array(starts, dtype=int), np.array(ends, dtype=int)
+
+    index = 0
+    while index < weight:
+        stat_freq_min, time_stamp_min = convert_time(
+            opa_self.request.stat_freq, time_stamp_list[index], opa_self
+        )
+        if time_stamp_min >= opa_self.request.time_step:
+            break
+        n_data = int(stat_freq_min / opa_self.request.time_step)
+        if index + n_data > weight:
+            break
+        starts.append(index)
+        ends.append(index + n_data)
+        index = index + n_data
+
+    return np.array(starts, dtype=int), np.array(ends, dtype=int)
+
+def reduce_segments(opa_self : object, data_source : xr.DataArray,
+                    starts : np.ndarray, ends : np.ndarray
+                ):
+    """Reduces every complete period of the incoming data along the time
+    dimension with segmented numpy reductions (ufunc.reduceat).
+
+    Arguments
+    ----------
+    opa_self : Opa class
+    data_source : xr.DataArray. Incoming data chunk, with time as the first
+            dimension
+    starts : np.ndarray. Index of the first time stamp of every period
+    ends : np.ndarray. Index after the last time stamp of every period
+
+    Returns
+    ---------
+    reduced : dict. For every rolling summary required by the statistic
+            (e.g. mean_cum, var_cum) an array with the first dimension
+            equal to the number of periods.
+    """
+    values = data_source.data[:ends[-1]]
+    lengths = ends - starts
+    # shape to broadcast the lengths against the reduced arrays
+    counts = np.reshape(lengths, (-1,) + (1,) * (values.ndim - 1))
+    stat = opa_self.request.stat
+    reduced = {}
+
+    if stat in ("mean", "sum", "var", "std"):
+        sums = np.add.reduceat(values, starts, axis=0, dtype=np.float64)
+        if stat == "sum":
+            reduced["sum_cum"] = sums
+        else:
+            means = sums / counts
+            reduced["mean_cum"] = means
+
+        if stat in ("var", "std"):
+            deviation = values - np.repeat(means, lengths, axis=0)
+            m2 = np.add.reduceat(
+                np.square(deviation), starts, axis=0, dtype=np.float64
+            )
+            # using sample variance NOT population variance
+            reduced["var_cum"] = np.where(
+                counts > 1, m2 / np.maximum(counts - 1, 1), m2
+            )
+
+    elif stat in ("min", "max"):
+        if stat == "min":
+            reduced["min_cum"] = np.minimum.reduceat(values, starts, axis=0)
+        else:
+            reduced["max_cum"] = np.maximum.reduceat(values, starts, axis=0)
+
+        time_values = data_source.time.values[:ends[-1]]
+        if np.all(lengths == lengths[0]):
+            # all periods have the same length, so find every arg
+            # extreme in one call
+            by_period = np.reshape(
+                values, (np.size(starts), lengths[0], *values.shape[1:])
+            )
+            if stat == "min":
+                index = np.argmin(by_period, axis=1)
+            else:
+                index = np.argmax(by_period, axis=1)
+            index = index + counts * np.arange(np.size(starts)).reshape(
+                counts.shape
+            )
+        else:
+            index = np.empty((np.size(starts), *values.shape[1:]), dtype=int)
+            for k, (start, end) in enumerate(zip(starts, ends)):
+                if stat == "min":
+                    index[k] = np.argmin(values[start:end], axis=0) + start
+                else:
+                    index[k] = np.argmax(values[start:end], axis=0) + start
+        reduced["timings_cum"] = time_values[index].astype(
+            "datetime64[ns]"
+        ).view(np.int64)
+
+    elif stat == "thresh_exceed":
+        reduced["thresh_exceed_cum"] = count_exceedances(
+            values, opa_self.request.thresh_exceed, starts
+        )
+
+    return reduced
+
+def set_segment_state(opa_self : object, reduced : dict, k : int):
+    """Sets the rolling summaries of the Opa to the reduced values of one
+    complete period, as if the period had been passed through update.
+
+    Arguments
+    ----------
+    opa_self : Opa class
+    reduced : dict. Output of reduce_segments
+    k : int. Index of the period
+    """
+    for key, value in reduced.items():
+        value = value[k:k + 1]
+        if key in ("mean_cum", "var_cum", "sum_cum"):
+            state = value.astype(get_state_dtype(opa_self))
+            if state.dtype == np.float32:
+                # the rounding error of a float32 state, see
+                # update_statistics.set_state_value
+                setattr(opa_self.statistics, key.replace("_cum", "_comp_cum"),
+                        (value - state).astype(np.float32))
+            value = state
+        elif key == "thresh_exceed_cum":
+            value = value.astype(get_count_dtype(opa_self))
+        setattr(opa_self.statistics, key, value)
+
+    opa_self.time.count = opa_self.time.n_data
@@ -0,0 +1,162 @@
+"""Crick digests of all the grid cells split into contiguous shards, one
+per worker process of digest_workers, for the request key
+digest_workers. The digests themselves only live in the workers: the
+ShardedDigests object in the Opa holds the range of cells of every
+shard. Before a checkpoint is pickled, save_shards has every worker
+write its own shard file in parallel, and the checkpoint then only holds
+the names of the shard files, which the workers load again (in parallel)
+when the Opa is restarted from the checkpoint. Any other pickle (e.g.
+copy.deepcopy) gathers the digests instead, without touching the files."""
+
+import glob
+import os
+import uuid
+import weakref
+
+import numpy as np
+
+from one_pass import digest_workers
+from one_pass.background_writer import wait_for_pending_writes
+from one_pass.statistics.sketch import GridSketch
+
+def get_shard_files(checkpoint_file : str, n_workers : int,
+                    generation : int
+                ):
+    """Names of the shard files of one checkpoint generation"""
+    return [f"{checkpoint_file}.shard{i}-{generation}"
+            for i in range(n_workers)]
+
+def find_shard_files(checkpoint_file : str):
+    """All the shard files of a checkpoint file"""
+    return glob.glob(glob.escape(checkpoint_file) + ".shard*-*")
+
+class ShardedDigests(GridSketch):
+    """Crick TDigests of n_cells grid cells kept by n_workers worker
+    processes.
+
+    Arguments
+    ----------
+    n_cells : int. Number of grid cells.
+    n_workers : int. Number of worker processes, each owning one
+            contiguous range of cells.
+    compression : float. Compression of the digests.
+    checkpoint_file : str. Checkpoint file of the Opa, the shard files
+            are written next to it. If None, the digests are gathered
+            into the pickle instead.
+
+    Attributes
+    ----------
+    bounds : np.ndarray. The shard of worker i are the cells bounds[i]
+            to bounds[i + 1].
+    generation : int. Number of the last shard files written, the shard
+            files of the previous generation are kept until the
+            checkpoint pointing to them has been replaced.
+    shard_files : list. Names of the last shard files written, None if
+            the digests have been updated since.
+    """
+
+    def __init__(self, n_cells : int, n_workers : int,
+                 compression : float = 1, checkpoint_file : str = None
+                ):
+        super().__init__(n_cells)
+        self.n_workers = int(n_workers)
+        self.compression = compression
+        self.checkpoint_file = checkpoint_file
+        self.bounds = np.linspace(
+            0, self.n_cells, self.n_workers + 1
+        ).astype(np.int64)
+        self.generation = 0
+        self.shard_files = None
+        self._start()
+
+    def _start(self, shard_files : list = None, digests : list = None):
+        """Creates the shards in the workers, empty, from the shard files
+        or from the gathered digests"""
+        self.key = uuid.uuid4().hex
+        self.workers = digest_workers.get_workers(self.n_workers)
+        messages = []
+        for i in range(self.n_workers):
+            start, stop = int(self.bounds[i]), int(self.bounds[i + 1])
+            messages.append((
+                "create", self.key, start, stop, self.compression,
+                None if shard_files is None else shard_files[i],
+                None if digests is None else digests[start:stop]
+            ))
+        self.workers.request(messages)
+        # the shards are dropped from the workers with this object
+        weakref.finalize(self, self.workers.drop, self.key)
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the pickled object. The digests are in the
+        workers and in their own shard files."""
+        return self.bounds.nbytes
+
+    def update(self, values : np.ndarray):
+        """Adds values of shape (time, n_cells), ignoring NaN values"""
+        values = np.reshape(
+            np.asarray(values, dtype=np.float64), (-1, self.n_cells)
+        )
+        self.workers.request_update(self.key, values)
+        self.shard_files = None
+
+    def quantile(self, q) -> np.ndarray:
+        """Quantiles q (between 0 and 1) of every cell, of shape
+        (len(q), n_cells)"""
+        answers = self.workers.request(
+            [("quantile", self.key, q)] * self.n_workers
+        )
+        return np.concatenate(answers, axis=1)
+
+    def histogram(self, bins : int = 10, range=None):
+        """Counts of shape (bins, n_cells) and edges of shape
+        (bins + 1, n_cells), from the histogram of every crick digest"""
+        answers = self.workers.request(
+            [("histogram", self.key, bins, range)] * self.n_workers
+        )
+        return (np.concatenate([answer[0] for answer in answers], axis=1),
+                np.concatenate([answer[1] for answer in answers], axis=1))
+
+    def save_shards(self):
+        """Has every worker write its shard to a new generation of shard
+        files, next to the checkpoint file. Called just before the
+        checkpoint is pickled, which then points to these files. The
+        checkpoint on disk points to the previous generation until it
+        has been replaced, so the generations before are removed."""
+        if self.checkpoint_file is None:
+            return
+        self.generation += 1
+        shard_files = get_shard_files(
+            self.checkpoint_file, self.n_workers, self.generation
+        )
+        self.workers.request([
+            ("save", self.key, file_name) for file_name in shard_files
+        ])
+        self.shard_files = shard_files
+        # the checkpoint on disk points to the previous generation once
+        # the pending writes are done, the ones before can be removed
+        wait_for_pending_writes(self.checkpoint_file)
+        for file_name in get_shard_files(
+                self.checkpoint_file, self.n_workers, self.generation - 2
+            ):
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+    def __getstate__(self):
+        """Only the names of the shard files are pickled if the digests
+        have not been updated since save_shards, otherwise the digests
+        are gathered from the workers"""
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in ("workers", "key")}
+        if self.shard_files is None:
+            answers = self.workers.request(
+                [("get", self.key)] * self.n_workers
+            )
+            state["digests"] = [digest for answer in answers
+                                for digest in answer]
+        return state
+
+    def __setstate__(self, state : dict):
+        digests = state.pop("digests", None)
+        self.__dict__.update(state)
+        self._start(self.shard_files, digests)
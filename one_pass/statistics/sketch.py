@@ -0,0 +1,74 @@
+"""Interface of the sketch backends of the percentile and histogram
+statistics. A sketch holds the state of all the grid cells in numpy
+arrays and is updated, merged and extracted for the whole grid at once,
+instead of one crick TDigest object per grid cell.
+
+The backends are selected by the request key sketch_backend, see
+initialise_statistics.SKETCH_BACKENDS. A new backend subclasses
+GridSketch, adds the function creating it to SKETCH_BACKENDS and its
+statistics to check_request.sketch_backend_options.
+
+When the statistic is finished the percentiles or histograms are taken
+with final_quantile and final_histogram. The sketch is dropped
+afterwards, so backends can override them to reuse their own arrays
+instead of copying them."""
+
+import copy
+
+import numpy as np
+
+class GridSketch:
+    """State of the distribution of n_cells grid cells.
+
+    Arguments
+    ----------
+    n_cells : int. Number of grid cells.
+    """
+
+    def __init__(self, n_cells : int):
+        self.n_cells = int(n_cells)
+
+    @property
+    def nbytes(self) -> int:
+        """Size in bytes of the state, used for the checkpoint size"""
+        raise NotImplementedError
+
+    def update(self, values : np.ndarray):
+        """Adds values of shape (time, n_cells), ignoring NaN values"""
+        raise NotImplementedError
+
+    def merge(self, other : "GridSketch"):
+        """Adds the state of other, of the same class and grid, used by
+        the rolled up statistics"""
+        raise NotImplementedError(
+            f"{type(self).__name__} can not be merged."
+        )
+
+    def copy(self) -> "GridSketch":
+        """Independent copy of the sketch, used by the rolled up
+        statistics so that every rollup_freq merges into its own state"""
+        return copy.deepcopy(self)
+
+    def quantile(self, q) -> np.ndarray:
+        """Quantiles q (between 0 and 1) of every cell, of shape
+        (len(q), n_cells), NaN for cells without any value"""
+        raise NotImplementedError(
+            f"{type(self).__name__} does not give percentiles."
+        )
+
+    def histogram(self, bins : int = 10, range=None):
+        """Counts of shape (bins, n_cells) and bin edges of shape
+        (bins + 1, n_cells) of every cell"""
+        raise NotImplementedError(
+            f"{type(self).__name__} does not give histograms."
+        )
+
+    def final_quantile(self, q) -> np.ndarray:
+        """quantile of a finished statistic, after which the sketch is
+        not used any more"""
+        return self.quantile(q)
+
+    def final_histogram(self, bins : int = 10, range=None):
+        """histogram of a finished statistic, after which the sketch is
+        not used any more"""
+        return self.histogram(bins=bins, range=range)
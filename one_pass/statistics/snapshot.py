@@ -0,0 +1,164 @@
+"""Partial statistics of a period that is not finished yet. The snapshot
+is computed from the rolling summaries without modifying them, so the
+Opa carries on exactly as if the snapshot had not been taken, and
+nothing is written to the checkpoint."""
+
+import numpy as np
+
+from one_pass.initialise.grid_mask import unmask_cells
+from one_pass.saving.create_arrays import get_array_meta
+from one_pass.saving.mask_coverage import mask_low_coverage
+from one_pass.statistics.extract_digests import extract_histograms
+from one_pass.statistics.extract_digests import extract_percentiles
+from one_pass.statistics.get_final_statistics import reshape_to_grid
+from one_pass.statistics.sketch import GridSketch
+from one_pass.statistics.update_statistics import copy_state_value
+
+def get_count(opa_self : object):
+    """Number of time steps in the rolling summaries. For continuous
+    statistics this is the count since the start of the data."""
+    if opa_self.request.stat_freq == "continuous":
+        return opa_self.time.count_continuous
+    return opa_self.time.count
+
+def get_partial_var(opa_self : object):
+    """Sample variance of the data seen so far. While the statistic is
+    not finished var_cum holds the sum of squared differences (M2),
+    which is divided by (n-1) here, as in update_var. For continuous
+    statistics var_cum is already divided straight after an output,
+    until the next data arrives (see remultiply_varience). With skipna
+    every cell is divided by its own valid count."""
+    var_cum = copy_state_value(opa_self, "var_cum")
+    if opa_self.time.count in (0, opa_self.time.n_data):
+        return var_cum
+
+    if opa_self.request.skipna:
+        valid_count = opa_self.statistics.valid_count_cum
+        np.divide(var_cum, valid_count - 1, out=var_cum,
+                  where=valid_count > 1)
+        return var_cum
+
+    count = get_count(opa_self)
+    if (count - 1) != 0:
+        var_cum = var_cum / (count - 1)
+    return var_cum
+
+def get_partial_percentile(opa_self : object):
+    """Percentiles from the current digests, with the same shape as
+    percentile_cum in get_final_statistics.get_percentile"""
+    percentile_list = opa_self.request.percentile_list
+    if len(percentile_list) == 0:
+        percentile_list = (np.linspace(0, 99, 100)) / 100
+
+    digests = opa_self.statistics.digests_cum
+    if isinstance(digests, GridSketch):
+        percentile = digests.quantile(percentile_list)
+    else:
+        percentile = extract_percentiles(
+            digests, percentile_list,
+            extract_workers=opa_self.request.extract_workers
+        )
+
+    return reshape_to_grid(opa_self, percentile), percentile_list
+
+def get_partial_histogram(opa_self : object):
+    """Histogram from the current digests, with the same shape as
+    histogram_cum and histogram_bin_edges_cum in
+    get_final_statistics.get_histogram"""
+    bins = getattr(opa_self.request, "bins", 10)
+    hist_range = getattr(opa_self.request, "range", None)
+
+    digests = opa_self.statistics.digests_cum
+    if isinstance(digests, GridSketch):
+        counts, edges = digests.histogram(bins=bins, range=hist_range)
+    else:
+        counts, edges = extract_histograms(
+            digests, bins, hist_range,
+            extract_workers=opa_self.request.extract_workers
+        )
+
+    return reshape_to_grid(opa_self, counts), reshape_to_grid(opa_self, edges)
+
+def get_snapshot(opa_self : object):
+    """Creates the partial statistic of the current period from the
+    rolling summaries of opa_self.statistics.
+
+    Arguments
+    ---------
+    opa_self : Opa class
+
+    Returns
+    ---------
+    None if no data has been added to the current statistic. Otherwise
+    a tuple of the partial statistic as an np.ndarray, with the same
+    shape as the finished statistic, and a dictionary of metadata with
+    the keys of saving.create_arrays.get_array_meta (including the
+    timings of min and max) and
+        count : number of time steps in the partial statistic.
+        n_data : number of time steps in the finished statistic.
+        time_stamp : time stamp of the last time step added.
+    """
+    stat = opa_self.request.stat
+    if stat in ("raw", "bias_correction"):
+        raise ValueError(
+            f"The {stat} statistic does not have a partial statistic."
+        )
+
+    if stat in ("var", "std"):
+        key = "var_cum"
+    elif stat in ("percentile", "histogram"):
+        key = "digests_cum"
+    else:
+        key = stat + "_cum"
+
+    if (opa_self.time.count is None
+            or getattr(opa_self.statistics, key, None) is None
+            or not get_count(opa_self)):
+        return None
+
+    bin_edges = None
+    if stat == "var":
+        partial_stat = get_partial_var(opa_self)
+    elif stat == "std":
+        partial_stat = np.sqrt(get_partial_var(opa_self))
+    elif stat == "percentile":
+        partial_stat, percentile_list = get_partial_percentile(opa_self)
+    elif stat == "histogram":
+        partial_stat, bin_edges = get_partial_histogram(opa_self)
+    elif stat == "thresh_exceed":
+        # float64 counts, as in the finished statistic
+        partial_stat = np.array(
+            opa_self.statistics.thresh_exceed_cum, dtype=np.float64
+        )
+    elif stat == "iams":
+        partial_stat = np.expand_dims(
+            np.array(opa_self.statistics.iams_cum), axis=0
+        )
+    else:
+        # np.array copies the rolling summary (and loads dask arrays)
+        partial_stat = np.array(getattr(opa_self.statistics, key))
+
+    # cells without enough valid data so far are NaN for skipna requests
+    partial_stat = mask_low_coverage(opa_self, partial_stat)
+    # and the full grid of masked requests
+    partial_stat = unmask_cells(opa_self, partial_stat)
+
+    dims = opa_self.data_set_info.dims
+    if dims is None:
+        dims = ("time",) + tuple(
+            f"dim_{i}" for i in range(1, len(
+                opa_self.data_set_info.shape_data_source_tail
+            ))
+        )
+
+    meta = get_array_meta(
+        opa_self, opa_self.request.variable, dims, bin_edges
+    )
+    if stat == "percentile":
+        meta["percentile"] = np.array(percentile_list)
+
+    meta["count"] = opa_self.time.count
+    meta["n_data"] = opa_self.time.n_data
+    meta["time_stamp"] = np.datetime64(opa_self.time.time_stamp, "ns")
+
+    return partial_stat, meta
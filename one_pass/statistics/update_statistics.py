@@ -5,8 +5,14 @@ import logging
 from pandas import Timestamp
 import numpy as np
 import xarray as xr
-import tqdm
 from one_pass.checkpointing.write_checkpoint import write_checkpoint
+from one_pass.statistics.moments import compute_moments
+from one_pass.statistics.moments import NAN_STAT_MOMENTS
+from one_pass.statistics.exceedance import count_exceedances
+from one_pass.statistics.sketch import GridSketch
+from one_pass.initialise.initialise_statistics import (
+    get_state_dtype, get_count_dtype
+)
 
 def update_continuous_count(opa_self, weight):
     """If the statistic frequency is continuous
@@ -34,6 +40,147 @@ def update_continuous_count(opa_self, weight):
 
     return temp_count
 
+def get_state_array(opa_self : object, key : str, dtype=None):
+    """Returns the rolling summary key of opa_self.statistics as a
+    writable np.ndarray of dtype, by default the state dtype (float64
+    unless the request sets state_dtype), so that it can be updated in
+    place. If it is anything else (e.g. an xr.DataArray or a dask array)
+    it is converted once and set back on opa_self.statistics."""
+    value = getattr(opa_self.statistics, key)
+    if dtype is None:
+        dtype = get_state_dtype(opa_self)
+    if np.dtype(dtype) == np.int64 and np.asarray(value).dtype.kind == "M":
+        # time stamps of a checkpoint from an older version
+        value = np.asarray(value, dtype="datetime64[ns]").view(np.int64)
+    if not (isinstance(value, np.ndarray) and value.dtype == dtype
+            and value.flags.writeable):
+        value = np.array(value, dtype=dtype)
+        setattr(opa_self.statistics, key, value)
+    return value
+
+def get_scratch(opa_self : object, name : str, like : np.ndarray):
+    """Returns a float64 work array with the shape of like. It is kept in
+    opa_self.scratch and reused by the following calls, instead of
+    allocating new temporaries for every time step. The scratch arrays
+    are never pickled in the checkpoint. They stay float64 for a float32
+    state, so that every update is computed in float64 and only rounded
+    once, when it is added to the rolling summary."""
+    if getattr(opa_self, "scratch", None) is None:
+        opa_self.scratch = {}
+    scratch = opa_self.scratch.get(name)
+    if scratch is None or scratch.shape != like.shape:
+        scratch = np.empty(like.shape, dtype=np.float64)
+        opa_self.scratch[name] = scratch
+    return scratch
+
+def get_compensation(opa_self : object, key : str):
+    """Returns the float32 compensation of the float32 rolling summary
+    key, or None for a float64 rolling summary. The compensation holds
+    the rounding error of the summary, so that the summary plus its
+    compensation is the float64 value of the statistic (as in Kahan
+    summation). It is created with zeros when it is first needed, and is
+    checkpointed and reset with the rolling summaries."""
+    if get_state_dtype(opa_self) != np.float32:
+        return None
+    comp_key = key.replace("_cum", "_comp_cum")
+    if getattr(opa_self.statistics, comp_key, None) is None:
+        setattr(opa_self.statistics, comp_key, np.zeros(
+            np.shape(getattr(opa_self.statistics, key)), dtype=np.float32
+        ))
+    return get_state_array(opa_self, comp_key, np.float32)
+
+def copy_state_value(opa_self : object, key : str) -> np.ndarray:
+    """New float64 array of the rolling summary key plus its compensation,
+    without changing the rolling summaries (for the snapshots and roll
+    ups)"""
+    value = np.array(getattr(opa_self.statistics, key), dtype=np.float64)
+    comp = getattr(opa_self.statistics, key.replace("_cum", "_comp_cum"), None)
+    if comp is not None:
+        value += comp
+    return value
+
+def get_state_value(opa_self : object, key : str):
+    """Returns the value of the rolling summary key in float64: the
+    summary itself if it is float64, or the float32 summary plus its
+    compensation in a scratch array"""
+    state = get_state_array(opa_self, key)
+    comp = get_compensation(opa_self, key)
+    if comp is None:
+        return state
+    value = get_scratch(opa_self, key + "_value", state)
+    # in float64, a float32 sum would round the compensation off again
+    np.add(state, comp, out=value, dtype=np.float64)
+    return value
+
+def set_state_value(opa_self : object, key : str, value : np.ndarray,
+                    where=True
+                ):
+    """Sets the rolling summary key to the float64 value in place. A
+    float32 summary is rounded once and the rounding error is kept in
+    its compensation, so the errors do not add up with the number of
+    updates."""
+    state = get_state_array(opa_self, key)
+    comp = get_compensation(opa_self, key)
+    if comp is None:
+        if value is not state:
+            np.copyto(state, value, where=where)
+        return
+    np.copyto(state, value, casting="same_kind", where=where)
+    np.subtract(value, state, out=comp, where=where, casting="same_kind")
+
+def add_to_state(opa_self : object, key : str, update : np.ndarray,
+                 where=True
+                ):
+    """Adds the float64 update to the rolling summary key in place, see
+    set_state_value"""
+    value = get_state_value(opa_self, key)
+    np.add(value, update, out=value, where=where)
+    set_state_value(opa_self, key, value, where)
+
+def get_moments(opa_self : object, data_source : xr.DataArray, needed):
+    """Moments of data_source over its time dimension from the fused
+    moments kernel. Inside an OpaGroup they are taken from the cache
+    shared by the group, so the chunk is only reduced once for all of
+    its statistics.
+
+    Arguments
+    ----------
+    opa_self : Opa class
+    data_source : incoming data chunk
+    needed : iterable of str. Moments needed, see moments.MOMENTS
+
+    Returns
+    ---------
+    moments : dict. See moments.compute_moments
+    """
+    values = data_source.values
+    axis = data_source.get_axis_num("time")
+    moments_cache = getattr(opa_self, "moments_cache", None)
+    if moments_cache is None:
+        return compute_moments(values, needed, axis)
+    return moments_cache.get(values, needed, axis)
+
+def count_valid(values : np.ndarray) -> np.ndarray:
+    """Number of valid (not NaN) time steps of every cell of a chunk
+    with time as the first dimension, with a time dimension of 1"""
+    return np.count_nonzero(~np.isnan(values), axis=0, keepdims=True)
+
+def add_valid_count(opa_self : object, counts : np.ndarray):
+    """Adds the valid time steps counts of a chunk to the valid counts of
+    the skipna requests, in place.
+
+    Returns
+    ---------
+    valid_count : np.ndarray. The updated valid_count_cum.
+    """
+    valid_count = get_state_array(
+        opa_self, "valid_count_cum", get_count_dtype(opa_self)
+    )
+    # the counts never exceed the time steps of the statistic, which fit
+    # in the counter type
+    np.add(valid_count, counts, out=valid_count, casting="unsafe")
+    return valid_count
+
 def remultiply_varience(opa_self : object):
     """Problem occurs when stat_freq is continuous and stat
     is variance, as when you output the variance you divide
@@ -49,67 +196,99 @@ def remultiply_varience(opa_self : object):
     if opa_self.request.stat_freq == "continuous":
         if opa_self.time.count_continuous > 0:
             if opa_self.time.count == 0:
-                opa_self.statistics.var_cum = opa_self.statistics.var_cum * (
-                    opa_self.time.count_continuous - 1
+                var_value = get_state_value(opa_self, "var_cum")
+                if opa_self.request.skipna:
+                    # as divided in divide_var
+                    valid_count = opa_self.statistics.valid_count_cum
+                    where = valid_count > 1
+                    np.multiply(var_value, valid_count - 1, out=var_value,
+                                where=where, casting="unsafe")
+                    set_state_value(opa_self, "var_cum", var_value, where)
+                    return
+                np.multiply(
+                    var_value, opa_self.time.count_continuous - 1,
+                    out=var_value
                 )
+                set_state_value(opa_self, "var_cum", var_value)
 
-def two_pass_sum(data_source):
-    """Computes normal sum using numpy two pass
+def update_mean(opa_self, data_source, weight, chunk_mean=None):
+    """Computes one pass mean with weight corresponding to the number
+    of timesteps being added. Also updates count.
 
     Arguments
-    ----------
-    data_source : incoming data chunk with a time
-            dimension greater than 1
+    ---------
+    opa_self : Opa class
+    data_source : incoming data chunk
+    weight : length of time dimension of incoming data chunk
+    chunk_mean : np.ndarray. Optional mean of data_source over time, if
+            it has already been computed (by update_var)
 
     Returns
     ---------
-    temp: two-pass sum over the data chunk
+    opa_self.time.count : updated with weight
+    opa_self.statistics.mean_cum : updated cumulative mean, in place
     """
-    ax_num = data_source.get_axis_num("time")
-    temp = np.sum(data_source, axis=ax_num, dtype=np.float64, keepdims=True)
-
-    return temp
-
-def two_pass_mean(data_source : xr.DataArray):
-    """Computes normal mean using numpy two pass
+    opa_self.time.count += weight
+    temp_count = update_continuous_count(opa_self, weight)
 
-    Arguments
-    ----------
-    data_source : incoming data chunk with a time
-            dimension greater than 1
+    if opa_self.request.skipna:
+        update_mean_skipna(
+            opa_self, get_moments(opa_self, data_source, ("nanmean",))
+        )
+        return
 
-    Returns
-    ---------
-    temp: two-pass mean over the data chunk
-    """
-    ax_num = data_source.get_axis_num("time")
-    temp = np.mean(data_source, axis=ax_num, dtype=np.float64, keepdims=True)
+    if chunk_mean is not None:
+        values = chunk_mean
+    elif weight > 1:
+        # compute two pass mean first
+        values = get_moments(opa_self, data_source, ("mean",))["mean"]
+    else:
+        values = data_source.values
 
-    return temp
+    mean_cum = get_state_value(opa_self, "mean_cum")
+    delta = get_scratch(opa_self, "delta", mean_cum)
+    # mean_cum + weight * (data - mean_cum) / count
+    np.subtract(values, mean_cum, out=delta)
+    np.multiply(delta, weight, out=delta)
+    np.divide(delta, temp_count, out=delta)
+    add_to_state(opa_self, "mean_cum", delta)
 
-def two_pass_var(data_source : xr.DataArray):
-    """Computes normal variance using numpy two pass,
-    setting ddof = 1 for sample variance
+def update_mean_skipna(opa_self : object, moments : dict):
+    """Updates mean_cum ignoring the NaN values, with the valid count of
+    every cell as its own weight and divisor. Does not update the time
+    count.
 
     Arguments
-    ----------
-    data_source : xr.DataArray. incoming data chunk with a time
-            dimension greater than 1
+    ---------
+    opa_self : Opa class
+    moments : dict. count and nanmean of the incoming data chunk, see
+            moments.compute_moments
 
     Returns
     ---------
-    temp: xr.DataArray two-pass variance over the data chunk
+    opa_self.statistics.mean_cum : updated cumulative mean, in place
+    opa_self.statistics.valid_count_cum : updated valid counts, in place
     """
-    ax_num = data_source.get_axis_num("time")
-    temp = np.var(
-        data_source, axis=ax_num, dtype=np.float64, keepdims=True, ddof=1
-    )
-
-    return temp
-
-def update_mean(opa_self, data_source, weight):
-    """Computes one pass mean with weight corresponding to the number
-    of timesteps being added. Also updates count.
+    counts = moments["count"]
+    has_values = counts > 0
+    valid_count = add_valid_count(opa_self, counts)
+
+    mean_cum = get_state_value(opa_self, "mean_cum")
+    delta = get_scratch(opa_self, "delta", mean_cum)
+    # mean_cum + count * (chunk_mean - mean_cum) / valid_count, only
+    # for the cells with values in the chunk
+    np.subtract(moments["nanmean"], mean_cum, out=delta)
+    np.multiply(delta, counts, out=delta)
+    np.divide(delta, valid_count, out=delta, where=has_values)
+    add_to_state(opa_self, "mean_cum", delta, has_values)
+
+def update_var_skipna(opa_self : object, data_source : xr.DataArray,
+                      weight : int
+                    ):
+    """Updates var_cum (M2) and mean_cum ignoring the NaN values. The
+    M2 of the chunk is merged with the valid counts of every cell, as
+    the chunks of update_var, which for a single time step is the
+    Welford update.
 
     Arguments
     ---------
@@ -119,20 +298,54 @@ def update_mean(opa_self, data_source, weight):
 
     Returns
     ---------
-    opa_self.time.count : updated with weight
-    opa_self.statistics.mean_cum : updated cumulative mean
+    opa_self.statistics.var_cum : updated M2, in place
     """
-    opa_self.time.count += weight
-    temp_count = update_continuous_count(opa_self, weight)
+    moments = get_moments(opa_self, data_source, NAN_STAT_MOMENTS["var"])
+    counts = moments["count"]
+    mean_cum = get_state_value(opa_self, "mean_cum")
+    var_cum = get_state_array(opa_self, "var_cum")
+    valid_count = get_state_array(
+        opa_self, "valid_count_cum", get_count_dtype(opa_self)
+    )
 
-    if weight > 1:
-        # compute two pass mean first
-        data_source = two_pass_mean(data_source)
+    # var_cum + m2 + (old_mean - chunk_mean)^2 * n*w / (n + w), with the
+    # valid counts n and w of every cell
+    total = get_scratch(opa_self, "total", var_cum)
+    np.add(valid_count, counts, out=total)
+    delta = get_scratch(opa_self, "delta", var_cum)
+    np.subtract(mean_cum, moments["nanmean"], out=delta)
+    np.square(delta, out=delta)
+    np.multiply(delta, valid_count, out=delta)
+    np.multiply(delta, counts, out=delta)
+    has_values = counts > 0
+    np.divide(delta, total, out=delta, where=has_values)
+    np.add(delta, moments["nanm2"], out=delta)
+    add_to_state(opa_self, "var_cum", delta, has_values)
+
+    opa_self.time.count += weight
+    update_continuous_count(opa_self, weight)
+    update_mean_skipna(opa_self, moments)
+
+def divide_var(opa_self : object):
+    """Divides M2 into the sample variance, by (n - 1) where n is the
+    count of the statistic, or the valid count of every cell with
+    skipna"""
+    var_value = get_state_value(opa_self, "var_cum")
+    if opa_self.request.skipna:
+        valid_count = opa_self.statistics.valid_count_cum
+        where = valid_count > 1
+        np.divide(var_value, valid_count - 1, out=var_value,
+                  where=where, casting="unsafe")
+        set_state_value(opa_self, "var_cum", var_value, where)
+        return
 
-    opa_self.statistics.mean_cum  = (opa_self.statistics.mean_cum + weight * \
-        (data_source.data - opa_self.statistics.mean_cum) / (
-        temp_count
-    ))
+    if opa_self.request.stat_freq != "continuous":
+        count = opa_self.time.count
+    else:
+        count = opa_self.time.count_continuous
+    if (count - 1) != 0:
+        np.divide(var_value, count - 1, out=var_value)
+        set_state_value(opa_self, "var_cum", var_value)
 
 def update_var(
         opa_self : object , data_source : xr.DataArray, weight : int
@@ -150,59 +363,58 @@ def update_var(
 
     Returns
     ---------
-    opa_self.statistics.var_cum : updated cumulative variance. If n < n_data
+    opa_self.statistics.var_cum : updated cumulative variance, in place. If n < n_data
             and the statistic is not complete, this is equal to M2
             (see docs). If n == n_data and enough samples have been
             addded var_cum is divded by (n-1) to get actual variance.
     """
     remultiply_varience(opa_self)
 
-    # storing 'old' mean temporarily
-    old_mean = opa_self.statistics.mean_cum
+    var_cum = get_state_array(opa_self, "var_cum")
+
+    if opa_self.request.skipna:
+        update_var_skipna(opa_self, data_source, weight)
 
-    if weight == 1 :
+    elif weight == 1 :
+        values = data_source.values
+        # difference to the 'old' mean, before update_mean
+        delta_old = get_scratch(opa_self, "delta_old", var_cum)
+        np.subtract(values, get_state_value(opa_self, "mean_cum"),
+                    out=delta_old)
         update_mean(opa_self, data_source, weight)
-        opa_self.statistics.var_cum = opa_self.statistics.var_cum + weight * (
-            data_source.data - old_mean) * (data_source.data - opa_self.statistics.mean_cum)
+        # var_cum + (data - old_mean) * (data - new_mean)
+        delta = get_scratch(opa_self, "delta", var_cum)
+        np.subtract(values, get_state_value(opa_self, "mean_cum"), out=delta)
+        np.multiply(delta_old, delta, out=delta)
+        add_to_state(opa_self, "var_cum", delta)
 
     else:
-        # two-pass mean
-        temp_mean = two_pass_mean(data_source)
-        # two pass variance
-        temp_var = (two_pass_var(data_source)) * (weight - 1)
-        # see paper Mastelini. S
+        # two-pass mean and sum of squared differences from it, in
+        # one sweep over the chunk
+        moments = get_moments(opa_self, data_source, ("mean", "m2"))
+        temp_mean = moments["mean"]
+        temp_var = moments["m2"]
         if opa_self.request.stat_freq != "continuous":
-            opa_self.statistics.var_cum = (
-                opa_self.statistics.var_cum
-                + temp_var.data
-                + np.square(old_mean - temp_mean.data)
-                * ((opa_self.time.count * weight) / (opa_self.time.count + weight))
-            )
+            count = opa_self.time.count
         else:
-            opa_self.statistics.var_cum = (
-                opa_self.statistics.var_cum
-                + temp_var.data
-                + np.square(old_mean - temp_mean.data)
-                * (
-                    (opa_self.time.count_continuous * weight)
-                    / (opa_self.time.count_continuous + weight)
-                )
-            )
-
-        update_mean(opa_self, data_source, weight)
+            count = opa_self.time.count_continuous
+        # see paper Mastelini. S
+        # var_cum + temp_var + (old_mean - temp_mean)^2 * n*w / (n + w)
+        # the update is summed in the float64 scratch and added to
+        # var_cum once
+        delta = get_scratch(opa_self, "delta", var_cum)
+        np.subtract(get_state_value(opa_self, "mean_cum"), temp_mean,
+                    out=delta)
+        np.square(delta, out=delta)
+        np.multiply(delta, (count * weight) / (count + weight), out=delta)
+        np.add(delta, temp_var, out=delta)
+        add_to_state(opa_self, "var_cum", delta)
+
+        update_mean(opa_self, data_source, weight, temp_mean)
 
     if opa_self.time.count == opa_self.time.n_data:
         # using sample variance NOT population variance
-        if opa_self.request.stat_freq != "continuous":
-            if (opa_self.time.count - 1) != 0:
-                opa_self.statistics.var_cum = (
-                    opa_self.statistics.var_cum / (opa_self.time.count - 1)
-                )
-        else:
-            if (opa_self.time.count_continuous - 1) != 0:
-                opa_self.statistics.var_cum = (
-                    opa_self.statistics.var_cum/ (opa_self.time.count_continuous - 1)
-                )
+        divide_var(opa_self)
 
 def update_sum(
         opa_self : object , data_source : xr.DataArray, weight : int
@@ -219,225 +431,125 @@ def update_sum(
     Returns
     ---------
     opa_self.time.count : updated with weight
-    opa_self.statistics.sum_cum : updated cumulative sum
+    opa_self.statistics.sum_cum : updated cumulative sum, in place
     """
-    if weight > 1:
-        data_source = two_pass_sum(data_source)
+    if opa_self.request.skipna:
+        moments = get_moments(opa_self, data_source, NAN_STAT_MOMENTS["sum"])
+        add_valid_count(opa_self, moments["count"])
+        values = moments["nansum"]
+    elif weight > 1:
+        values = get_moments(opa_self, data_source, ("sum",))["sum"]
+    else:
+        values = data_source.values
 
-    opa_self.statistics.sum_cum = np.add(
-        opa_self.statistics.sum_cum, data_source.data, dtype=np.float64
-    )
+    add_to_state(opa_self, "sum_cum", values)
 
     opa_self.time.count += weight
     update_continuous_count(opa_self, weight)
 
-def update_min_internal(opa_self, data_source, data_source_time):
-    """Updates the axis of attributes min_cum and timings and 
-    updates the array data_source with any values in min_cum that 
-    are smaller
-
-     Arguments
-    ---------
-    opa_self : Opa class
-    data_source : incoming data chunk. If weight > 1, this has already
-            been reduced using the two-pass minimum along the time
-            dimension.
-    data_source_time : xarray of same shape as data_source but with
-            the time dimension always equal to 1. This holds the time
-            stamps of all the minimum values for that incoming chunk.
-            If weight == 1, this is just an array of the current 
-            time stamp.
-
-    Returns
-    ---------
-    data_source : updated to contain minimum values between incoming
-            data_source and opa_self.statistics.min_cum. NOTE: xr.where
-            is counter-intuative. The below line will do, where data_source
-            is greater than opa_self.statistics.min_cum, replace with
-            opa_self.statistics.min_cum
-    data_source_time : uupdated to contain the time stamp of the minimum
-            values between incoming data_source and opa_self.statistics.min_cum.
-    opa_self.statistics.min_cum["time"] : time dimension of min_cum updated
-    opa_self.statistics.timings_cum["time"] : time dimension of timings_cum updated
-    """
-    opa_self.statistics.min_cum["time"] = data_source.time
-    opa_self.statistics.timings_cum["time"] = data_source.time
-    data_source_time = data_source_time.where(
-            data_source < opa_self.statistics.min_cum, opa_self.statistics.timings_cum
-        )
-    # this gives the new opa_self.statistics.min_cum number when the  condition
-    # is FALSE (location at which to preserve the objects values)
-    data_source = data_source.where(data_source < opa_self.statistics.min_cum,
-                                    opa_self.statistics.min_cum)
-
-    return data_source, data_source_time
+def get_time_index(data_source : xr.DataArray):
+    """Time stamps of data_source as int64 nanoseconds since 1970, the
+    type of timings_cum"""
+    return np.asarray(
+        data_source.time.values, dtype="datetime64[ns]"
+    ).view(np.int64)
 
-def update_min(
-        opa_self : object , data_source : xr.DataArray, weight : int
+def update_extreme(
+        opa_self : object , data_source : xr.DataArray, weight : int,
+        stat : str
     ):
-    """ Main function for OPA min. Finds the cumulative minimum values
-    of the data along with an array of timesteps corresponding to the
-    minimum values. Updates count with weight.
+    """Updates the rolling minimum or maximum and the time stamps at
+    which they happened, in place. For more than one time step the
+    chunk is first reduced with the moments kernel, and the time stamp
+    of every grid cell is taken from the argmin (or argmax) of the
+    chunk.
 
-     Arguments
+    Arguments
     ---------
     opa_self : Opa class
     data_source : incoming data chunk.
     weight : length of time dimension of incoming data chunk
+    stat : str. "min" or "max"
 
     Returns
     ---------
-    opa_self.statistics.min_cum : updated rolling summary of minimum values
-    opa_self.statistics.timings_cum : updated rolling summary of time stamps corresponding
-            to the minimum values
+    opa_self.statistics.min_cum or max_cum : updated rolling summary,
+            in place
+    opa_self.statistics.timings_cum : int64 time stamps (nanoseconds
+            since 1970) of the minimum or maximum values, in place.
+            They are converted to datetime64 in the final output.
     opa_self.time.count : updated with weight
     """
-    if weight == 1:
-        timestamp = np.datetime_as_string((data_source.time.values[0]))
-        data_source_time = xr.zeros_like(data_source)
-        data_source_time = data_source_time.where(data_source_time != 0, timestamp)
-
+    time_index = get_time_index(data_source)
+    has_values = None
+    if opa_self.request.skipna:
+        moments = get_moments(opa_self, data_source, NAN_STAT_MOMENTS[stat])
+        values = moments["nan" + stat]
+        timings = time_index[moments["nanarg" + stat]]
+        has_values = moments["count"] > 0
+        add_valid_count(opa_self, moments["count"])
+    elif weight == 1:
+        values = data_source.values
+        timings = time_index[0]
     else:
-        ax_num = data_source.get_axis_num("time")
-        timings_cum = data_source.time
-        min_index = data_source.argmin(axis=ax_num, keep_attrs=False)
-        data_source = np.amin(data_source, axis=ax_num, keepdims=True)
-        # now this will have dimensions 1,lat,lon
-        data_source_time = xr.zeros_like(data_source)
+        moments = get_moments(opa_self, data_source, (stat, "arg" + stat))
+        values = moments[stat]
+        timings = time_index[moments["arg" + stat]]
 
-        for i in range(0, weight):
-            timestamp = np.datetime_as_string((timings_cum.values[i]))
-            data_source_time = data_source_time.where(min_index != i, timestamp)
+    # the extremes keep the data type of the incoming data, the float64
+    # extremes of the moments kernel are cast back by np.copyto
+    extreme_cum = get_state_array(opa_self, stat + "_cum", data_source.dtype)
+    timings_cum = get_state_array(opa_self, "timings_cum", np.int64)
 
     if opa_self.request.stat_freq != "continuous":
-        if opa_self.time.count > 0:
-            data_source, data_source_time = update_min_internal(
-                opa_self, data_source, data_source_time
-            )
+        count = opa_self.time.count
     else:
-        if opa_self.time.count_continuous > 0:
-            data_source, data_source_time = update_min_internal(
-                opa_self, data_source, data_source_time
-            )
+        count = opa_self.time.count_continuous
 
-    # convert to datetime64 for saving
-    data_source_time = data_source_time.astype("datetime64[ns]")
+    if count > 0:
+        # only replaced where the new value is strictly smaller (or
+        # larger), so the first time stamp of equal values is kept
+        if stat == "min":
+            replace = np.less(values, extreme_cum)
+        else:
+            replace = np.greater(values, extreme_cum)
+        if has_values is not None:
+            # cells without a value yet are NaN, as np.fmin and np.fmax
+            replace |= has_values & np.isnan(extreme_cum)
+        np.copyto(timings_cum, timings, where=replace)
+        np.copyto(extreme_cum, values, where=replace)
+    else:
+        np.copyto(timings_cum, timings)
+        np.copyto(extreme_cum, values)
 
     opa_self.time.count += weight
     update_continuous_count(opa_self, weight)
 
-    # running this way around as Array type does not have the function .where,
-    # this only works for data_array
-    opa_self.statistics.min_cum = data_source
-    opa_self.statistics.timings_cum = data_source_time
-
-def update_max_internal(
-        opa_self : object ,
-        data_source : xr.DataArray,
-        data_source_time : xr.DataArray
+def update_min(
+        opa_self : object , data_source : xr.DataArray, weight : int
     ):
-    """Updates the axis of attributes min_cum and timings and 
-    updates the array data_source with any values in min_cum that 
-    are smaller
-
-     Arguments
-    ---------
-    opa_self : Opa class
-    data_source : xr.DataArray. incoming data chunk. If weight > 1,
-            this has already been reduced using the two-pass maximum along
-            the time dimension.
-    data_source_time : xr.DataArray of same shape as data_source but with
-            the time dimension always equal to 1. This holds the time
-            stamps of all the maximum values for that incoming chunk.
-            If weight == 1, this is just an array of the current 
-            time stamp.
-
-    Returns
-    ---------
-    data_source : updated to contain maximum values between incoming
-            data_source and opa_self.statistics.max_cum. NOTE: xr.where
-            is counter-intuative. The below line will do, where data_source
-            isgreater than opa_self.statistics.max_cum, replace with
-            opa_self.statistics.max_cum
-    data_source_time : uupdated to contain the time stamp of the maximum
-            values between incoming data_source and opa_self.statistics.max_cum.
-    opa_self.statistics.max_cum["time"] : time dimension of max_cum updated
-    opa_self.statistics.timings_cum["time"] : time dimension of timings_cum updated
+    """ Main function for OPA min. Finds the cumulative minimum values
+    of the data along with an array of timesteps corresponding to the
+    minimum values. Updates count with weight. See update_extreme.
     """
-    opa_self.statistics.max_cum["time"] = data_source.time
-    opa_self.statistics.timings_cum["time"] = data_source.time
-    data_source_time = data_source_time.where(
-            data_source > opa_self.statistics.max_cum, opa_self.statistics.timings_cum
-        )
-    # this gives the new opa_self.statistics.max_cum number when the  condition is
-    # FALSE (location at which to preserve the objects values)
-    data_source = data_source.where(
-            data_source > opa_self.statistics.max_cum, opa_self.statistics.max_cum
-        )
-
-    return data_source, data_source_time
+    update_extreme(opa_self, data_source, weight, "min")
 
 def update_max(
         opa_self : object , data_source : xr.DataArray, weight : int
     ):
     """ Main function for OPA max. Finds the cumulative maximum values
     of the data along with an array of timesteps corresponding to the
-    maximum values. Updates count with weight.
-
-     Arguments
-    ---------
-    opa_self : Opa class
-    data_source : incoming data chunk.
-    weight : length of time dimension of incoming data chunk
-
-    Returns
-    ---------
-    opa_self.statistics.max_cum : updated rolling summary of maximum values
-    opa_self.statistics.timings_cum : updated rolling summary of time stamps corresponding
-            to the maximum values
-    opa_self.time.count : updated with weight
+    maximum values. Updates count with weight. See update_extreme.
     """
-    if weight == 1:
-        timestamp = np.datetime_as_string((data_source.time.values[0]))
-        data_source_time = xr.zeros_like(data_source)
-        data_source_time = data_source_time.where(data_source_time != 0, timestamp)
-    else:
-        ax_num = data_source.get_axis_num("time")
-        timings_cum = data_source.time
-        max_index = data_source.argmax(axis=ax_num, keep_attrs=False)
-        #opa_self.max_index = max_index
-        data_source = np.amax(data_source, axis=ax_num, keepdims=True)
-        # now this will have dimensions 1,incoming grid
-        data_source_time = xr.zeros_like(data_source)
-
-        for i in range(0, weight):
-            timestamp = np.datetime_as_string((timings_cum.values[i]))
-            data_source_time = data_source_time.where(max_index != i, timestamp)
-
-    if opa_self.request.stat_freq != "continuous":
-        if opa_self.time.count > 0:
-            data_source, data_source_time = update_max_internal(
-                opa_self, data_source, data_source_time
-            )
-    else:
-        if opa_self.time.count_continuous > 0:
-            data_source, data_source_time = update_max_internal(
-                opa_self, data_source, data_source_time
-            )
-
-    # convert to datetime64 for saving
-    data_source_time = data_source_time.astype("datetime64[ns]")
-
-    opa_self.time.count += weight
-    update_continuous_count(opa_self, weight)
-    opa_self.statistics.max_cum = data_source
-    opa_self.statistics.timings_cum = data_source_time
+    update_extreme(opa_self, data_source, weight, "max")
 
 def update_threshold(
         opa_self : object , data_source : xr.DataArray, weight : int
     ):
     """ Creates an array with the frequency that a threshold has
-    been exceeded. Updates count with weight.
+    been exceeded. Updates count with weight. All the thresholds are
+    counted at once for data with any number of dimensions (see
+    exceedance.count_exceedances).
 
      Arguments
     ---------
@@ -448,160 +560,37 @@ def update_threshold(
     Returns
     ---------
     opa_self.statistics.thresh_exceed_cum : updated rolling summary of number
-            of times a threshold has been exceeded
+            of times a threshold has been exceeded, in place
     opa_self.time.count : updated with weight
     """
-    # loop is for all the of thresholds
-    for index, _ in enumerate(opa_self.request.thresh_exceed):
-        # the sum is for the weight
-        opa_self.statistics.thresh_exceed_cum[:,index,:,:] += np.sum(
-                np.where(
-                        data_source.data < abs(opa_self.request.thresh_exceed[index]),
-                        0, 1
-                    ),
-                axis = 0, keepdims=True
-                )
-
-    opa_self.time.count += weight
-    update_continuous_count(opa_self, weight)
-
-def update_max_iams(opa_self : object, window_sum : np.array, i : int):
-    """
-    Function specfically for the iams statistic as it doesn't include
-    the timings. Updating the incoming window_sum with any values in the
-    rolling maximum
-
-    Arguments
-    ---------
-    opa_self : Opa class
-    window_sum : np.array. the sum of the rolling window corresponding to
-            theduration length.
-    i : int. the index of the durations loop
-
-    Returns
-    ---------
-    opa_self.statistics.iams_cum : attribute updated with the maximum
-            value between the opa_self and the rolling max.
-    """
-    # extract the rolling max for each duration
-    rolling_max = opa_self.statistics.iams_cum[i,:]
-
-    opa_self.statistics.iams_cum[i,:] = np.where(
-        window_sum < rolling_max, rolling_max, window_sum
-        )
-
-def extract_durations(opa_self : object, i : int):
-    """Extracts key information relating to each duration length.
-
-    Arguments
-    ---------
-    opa_self : Opa class
-    i : the index of the durations loop
-
-    Returns
-    ---------
-    n_data_duration : the number of data pieces requred for each
-            duration
-    count_duration : the current count for each duration
-    count_duration_full : the current full count for each duration
-            the comparision between opa_self.time.count and count_duation
-    """
-    n_data_duration = int(
-        getattr(opa_self.iams, "n_data_durations")[i]
-    )
-    count_duration = int(
-        getattr(opa_self.iams, "count_durations")[i]
+    counts = count_exceedances(
+        data_source.values, opa_self.request.thresh_exceed
     )
-    count_duration_full = int(
-        getattr(opa_self.iams, "count_durations_full")[i]
+    thresh_exceed_cum = get_state_array(
+        opa_self, "thresh_exceed_cum", get_count_dtype(opa_self)
     )
+    # the counts never exceed n_data, which fits in the counter type
+    np.add(thresh_exceed_cum, counts, out=thresh_exceed_cum, casting="unsafe")
+    if opa_self.request.skipna:
+        add_valid_count(opa_self, count_valid(data_source.values))
 
-    return n_data_duration, count_duration, count_duration_full
-
-def one_pass_iams(opa_self : object, full_length : int):
-    """One-pass iams statistic implementation. Loops through all
-    the requested durations (lengths in minutes) and finds the
-    window, which is a section of the time-series opa_self.iams.
-    rolling_data with the length of that duration. This could sit
-    in the middle of the stored time-series chunk or it could span
-    the end and the beginning.
-
-    Arguments
-    ---------
-    opa_self : Opa class
-    full_length : int. the length of the time-series required to be
-            stored to cover all of the durations. It is the length
-            of the longest duration.
-
-    Returns
-    ---------
-    count_duration : the current count is updated by 1.
-    count_duration_full : the current full count for each duration
-            (the comparision between opa_self.time.count and count_duation)
-            is updated by 1.
-    """
-    for i in range(np.size(opa_self.iams.durations)):
-        #extract key information about that duration
-        n_data_duration, count_duration, count_duration_full = (
-            extract_durations(opa_self, i)
-        )
-
-        # re-setting count_duration back to 0 first time it hits this
-        if count_duration >= full_length :
-            count_duration = 0
-
-        # only sum over data that has been filled (opa_self.time.count not
-        # yet updated)
-        if (count_duration_full + n_data_duration) <= opa_self.time.count:
-
-            #not yet looping back to the start of the rolling data array
-            if (count_duration + n_data_duration) <= full_length:
-
-                window_sum = opa_self.iams.rolling_data[
-                    count_duration : count_duration +
-                    n_data_duration, :
-                    ].sum(axis=0, keepdims = True)
-
-            else:
-                data_left = full_length - count_duration
-
-                window_sum = opa_self.iams.rolling_data[
-                    count_duration:, :
-                    ].sum(axis=0, keepdims = True)
-
-                # starting from the beginning
-                window_sum = window_sum + opa_self.iams.rolling_data[
-                    0 :n_data_duration - data_left, :
-                    ].sum(axis=0, keepdims = True)
-
-            count_duration += 1
-            count_duration_full += 1
-
-            # weight will be 1 here because looping through each time step
-            update_max_iams(opa_self, window_sum, i)
-
-        # end of duration loop (i)
-        getattr(
-            opa_self.iams, "count_durations"
-        )[i] = count_duration
-        getattr(
-            opa_self.iams, "count_durations_full"
-        )[i] = count_duration_full
+    opa_self.time.count += weight
+    update_continuous_count(opa_self, weight)
 
 def update_iams(
         opa_self : object , data_source : xr.DataArray, weight : int
     ):
-    """This function updates the statistic iams. It starts by updating
-    the variable opa_self.iams.rolling_data, which is a tempory data store
-    of time steps with a time dimension equal to the data required
-    for the longest duration.
-    Once this is updated, it loops through all the durations required
-    and takes the summations over each duration from this iams.rolling_data.
-    The moving window for each duration is continuously updated with
-    counts specific to each duration monitoring how far through you are.
-    The window sum is then passed to a find maximum function where the max
-    value for each duration will be updated. This will store the max
-    value of all the rolling windows of duration x over the year.
+    """This function updates the statistic iams, the maximum of the
+    sums of the data over rolling windows of every duration.
+    opa_self.iams.rolling_sums is a ring buffer of the running sums of
+    the data (the sum of all the data since the start of the statistic
+    up to every time step), holding one more time step than the longest
+    duration. The sum of a window of n time steps ending at time step t
+    is then the running sum at t minus the running sum at t - n, so
+    every duration costs one subtraction per time step, whatever its
+    length. The windows of a duration are computed for all the time
+    steps of the chunk at once, and only windows with a complete
+    duration of data are used.
     NOTE: this requires stat_freq and output_freq to be 'annually'.
 
     Arguments
@@ -612,23 +601,46 @@ def update_iams(
 
     Returns
     ---------
-    opa_self.iams.rolling_data : temporary storage incoming data updated.
+    opa_self.statistics.iams_cum : maximum of the window sums of every
+            duration, updated in place.
+    opa_self.iams.rolling_sums : ring buffer updated with the running
+            sums of the chunk.
     opa_self.time.count : updated with weight.
     """
-    # length of the iams.rolling_data array
-    full_length = int(opa_self.iams.n_data_durations[-1])
-    # remainder of full count divided by length of array
-    # = to how far through the iams.rolling_data you are
-    # how much left of this iams.rolling_data needs to be filled
-    # before starting from the beginning again
-    loop_count = np.mod(opa_self.time.count, full_length)
-
-    for j in range(weight):
-        opa_self.iams.rolling_data[loop_count : loop_count + 1, :] = \
-            data_source[j:j+1,:]
-        one_pass_iams(opa_self, full_length)
-        opa_self.time.count += 1
-        loop_count = np.mod(opa_self.time.count, full_length)
+    rolling_sums = opa_self.iams.rolling_sums
+    ring_length = np.shape(rolling_sums)[0]
+    iams_cum = get_state_array(opa_self, "iams_cum")
+    # index of the first time step of the chunk in the statistic
+    start = opa_self.time.count
+
+    # running sums of the chunk, carrying on from the last time step.
+    # Before the first time step the ring buffer holds zeros.
+    sums = np.cumsum(data_source.values, axis=0, dtype=np.float64)
+    sums += rolling_sums[(start - 1) % ring_length]
+
+    for i, n_data_duration in enumerate(opa_self.iams.n_data_durations):
+        # first time step of the chunk ending a complete window
+        first = max(n_data_duration - 1 - start, 0)
+        if first >= weight:
+            continue
+        # windows starting before the chunk take the running sum at
+        # their start from the ring buffer
+        split = min(n_data_duration, weight)
+        if first < split:
+            index = (start + np.arange(first, split) - n_data_duration
+                     ) % ring_length
+            window_sum = sums[first:split] - rolling_sums[index]
+            np.maximum(iams_cum[i], window_sum.max(axis=0), out=iams_cum[i])
+        if split < weight:
+            window_sum = sums[split:] - sums[:weight - n_data_duration]
+            np.maximum(iams_cum[i], window_sum.max(axis=0), out=iams_cum[i])
+
+    # only the last ring_length running sums are needed later
+    first = max(weight - ring_length, 0)
+    index = (start + np.arange(first, weight)) % ring_length
+    rolling_sums[index] = sums[first:]
+
+    opa_self.time.count += weight
 
 def update_tdigest_large_weight(
         opa_self : object, data_source : xr.DataArray, weight : int
@@ -651,6 +663,7 @@ def update_tdigest_large_weight(
     data_source_values = data_source.values.reshape((weight, -1))
     iterable = range(opa_self.data_set_info.size_data_source_tail)
     if opa_self.logger.isEnabledFor(logging.DEBUG):
+        import tqdm
         for j in tqdm.tqdm(
                 iterable,
                 desc="Updating digests"
@@ -687,7 +700,13 @@ def update_tdigest(
     opa_self.time.count : updated with weight unless the statistic is bias-corr
             in which case that is updated in daily means
     """
-    if weight == 1:
+    if isinstance(opa_self.statistics.digests_cum, GridSketch):
+        # all the grid cells at once
+        opa_self.statistics.digests_cum.update(
+            np.reshape(data_source.values, (weight, -1))
+        )
+
+    elif weight == 1:
 
         if opa_self.request.stat == "bias_correction":
             data_source_values = np.reshape(
@@ -700,6 +719,7 @@ def update_tdigest(
 
         iterable = range(opa_self.data_set_info.size_data_source_tail)
         if opa_self.logger.isEnabledFor(logging.DEBUG):
+            import tqdm
             for j in tqdm.tqdm(
                     iterable,
                     desc="Updating digests"
@@ -718,6 +738,10 @@ def update_tdigest(
     else:
         update_tdigest_large_weight(opa_self, data_source, weight)
 
+    if opa_self.request.skipna:
+        # the digests already skip the NaN values
+        add_valid_count(opa_self, count_valid(data_source.values))
+
     if opa_self.request.stat != "bias_correction":
         opa_self.time.count += weight
         update_continuous_count(opa_self, weight)
@@ -0,0 +1,133 @@
+"""Module for driving an Opa from a stream of data chunks. The next
+chunks are read and loaded into memory by a background thread while
+the current chunk is passed to the statistic, so that reading the data
+from disk overlaps with the computation."""
+
+from typing import Iterable, Iterator
+
+import queue
+import threading
+
+# markers put in the queue by the reading thread
+_END = object()
+
+class _ReadError:
+    """Holds an exception raised while reading the chunks, so that it
+    can be raised again in the thread consuming them"""
+    def __init__(self, exc : BaseException):
+        self.exc = exc
+
+def iter_chunks(data, chunk_size : int = 1):
+    """Splits the incoming data into chunks along time.
+
+    Arguments
+    ----------
+    data : xr.Dataset or xr.DataArray with a time dimension, which will
+            be split into chunks of chunk_size time steps, or any
+            iterable of chunks which will be passed on as they are.
+    chunk_size : int. Number of time steps per chunk.
+
+    Returns
+    ---------
+    Iterator over the chunks, which are not loaded into memory.
+    """
+    if hasattr(data, "isel") and "time" in data.dims:
+        if chunk_size is None or int(chunk_size) < 1:
+            raise ValueError("chunk_size must be a positive integer.")
+        chunk_size = int(chunk_size)
+        n_time = data.sizes["time"]
+        return (
+            data.isel(time=slice(i, i + chunk_size))
+            for i in range(0, n_time, chunk_size)
+        )
+    return iter(data)
+
+def load_chunk(chunk):
+    """Loads a chunk into memory if it is a lazy xarray object"""
+    if hasattr(chunk, "load"):
+        return chunk.load()
+    return chunk
+
+class Prefetcher:
+    """Reads and loads up to prefetch chunks ahead of the ones being
+    used, in a background thread.
+    """
+    def __init__(self, chunks : Iterable, prefetch : int = 2):
+        """Initialisation. Starts the reading thread.
+
+        Arguments
+        ----------
+        chunks : Iterable. Incoming data chunks.
+        prefetch : int. Maximum number of chunks loaded in memory ahead
+                of the one being used.
+        """
+        if prefetch is None or int(prefetch) < 1:
+            raise ValueError("prefetch must be a positive integer.")
+
+        self.chunks = chunks
+        self.queue = queue.Queue(maxsize = int(prefetch))
+        self.stop = threading.Event()
+        self.thread = threading.Thread(
+            target = self._read, name = "one_pass-prefetch", daemon = True
+        )
+        self.thread.start()
+
+    def _put(self, item):
+        """Puts an item in the queue, waiting while the queue is full
+        unless the prefetcher has been closed.
+
+        Returns
+        ---------
+        bool. False if the prefetcher was closed before the item was put.
+        """
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read(self):
+        """Body of the reading thread"""
+        try:
+            for chunk in self.chunks:
+                if self.stop.is_set():
+                    return
+                if not self._put(load_chunk(chunk)):
+                    return
+        except BaseException as exc: # pylint: disable=broad-except
+            self._put(_ReadError(exc))
+        finally:
+            self._put(_END)
+
+    def __iter__(self) -> Iterator:
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, _ReadError):
+                    raise item.exc
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the reading thread and drops the chunks already read"""
+        self.stop.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.thread.join()
+
+def prefetch_chunks(chunks : Iterable, prefetch : int = 2):
+    """Iterates over the chunks, loading them into memory. If prefetch
+    is 0 the chunks are loaded when they are needed, otherwise they are
+    loaded ahead by a Prefetcher.
+    """
+    if not prefetch:
+        return (load_chunk(chunk) for chunk in chunks)
+    return iter(Prefetcher(chunks, prefetch))
@@ -0,0 +1,238 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from crick import TDigest
+
+from one_pass.opa import Opa
+from one_pass.statistics.array_tdigest import ArrayTDigest
+
+# same tolerance as the percentiles of test_accuracy.py
+dec_place_per = 5e-4
+PERCENTILES = list(np.linspace(0, 0.99, 100))
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, sketch_backend="array", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": "daily",
+        "output_freq": "daily",
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+        "sketch_backend": sketch_backend,
+    }
+    if stat == "percentile":
+        pass_dic["percentile_list"] = PERCENTILES
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def crick_digests(values, step):
+    """One crick TDigest per cell of values (time, cells), updated with
+    step time steps at a time"""
+    digests = [TDigest(compression=1) for _ in range(values.shape[1])]
+    for i in range(0, values.shape[0], step):
+        for j, digest in enumerate(digests):
+            digest.update(values[i:i + step, j])
+    return digests
+
+
+def array_digest(values, step):
+    digests = ArrayTDigest(values.shape[1], compression=1)
+    for i in range(0, values.shape[0], step):
+        digests.update(values[i:i + step])
+    return digests
+
+
+@pytest.mark.parametrize("step", [1, 24])
+def test_array_tdigest_equal_crick(step):
+    # up to a day of hourly data, both keep every value
+    values = np.random.default_rng(0).gamma(0.5, 1e-4, (24, 50))
+    values[:, :10] = 0
+    digests = crick_digests(values, step)
+    array = array_digest(values, step)
+
+    assert np.allclose(
+        array.quantile(PERCENTILES),
+        np.array([digest.quantile(PERCENTILES) for digest in digests]).T,
+        rtol=1e-12, atol=0
+    )
+    counts, edges = array.histogram(bins=10)
+    for j, digest in enumerate(digests):
+        crick_counts, crick_edges = digest.histogram(bins=10)
+        assert np.allclose(counts[:, j], crick_counts, rtol=1e-12, atol=1e-12)
+        assert np.allclose(edges[:, j], crick_edges, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize("step", [1, 24])
+def test_array_tdigest_month(step):
+    values = np.random.default_rng(1).gamma(0.5, 1e-4, (31 * 24, 50))
+    digests = crick_digests(values, step)
+    array = array_digest(values, step)
+
+    assert np.all(array.total() == 31 * 24)
+    # the centroids are compressed
+    assert array.means.shape[1] < 31 * 24 // 4
+    assert np.allclose(
+        array.quantile(PERCENTILES),
+        np.array([digest.quantile(PERCENTILES) for digest in digests]).T,
+        rtol=dec_place_per, atol=dec_place_per
+    )
+    assert np.allclose(
+        array.quantile(PERCENTILES),
+        np.quantile(values, PERCENTILES, axis=0),
+        rtol=dec_place_per, atol=dec_place_per
+    )
+
+
+def test_array_tdigest_nan():
+
+    values = np.array([[1.0, np.nan], [np.nan, np.nan], [2.0, np.nan]])
+    array = array_digest(values, 1)
+    digest = crick_digests(values[:, :1], 1)[0]
+
+    assert np.array_equal(array.total(), [2, 0])
+    quantiles = array.quantile([0, 0.5, 1])
+    assert np.array_equal(quantiles[:, 0], digest.quantile([0, 0.5, 1]))
+    assert np.all(np.isnan(quantiles[:, 1]))
+    counts, edges = array.histogram(bins=3)
+    assert np.array_equal(counts[:, 1], [0, 0, 0])
+    assert np.allclose(edges[:, 1], np.linspace(-0.5, 0.5, 4))
+
+
+def test_array_tdigest_merge():
+
+    values = np.random.default_rng(2).normal(size=(2000, 20))
+    array = array_digest(values[:1000], 7)
+    array.merge(array_digest(values[1000:], 24))
+
+    assert np.all(array.total() == 2000)
+    assert np.array_equal(array.min, values.min(axis=0))
+    # about the error of crick for 2000 values of a standard normal
+    assert np.allclose(
+        array.quantile([0.01, 0.5, 0.99]),
+        np.quantile(values, [0.01, 0.5, 0.99], axis=0),
+        atol=0.1
+    )
+
+
+@pytest.mark.parametrize("stat", ["percentile", "histogram"])
+@pytest.mark.parametrize("stat_freq, step", [
+    ("daily", 1), ("daily", 6), ("monthly", 24)
+])
+def test_sketch_backend_compute(data, stat, stat_freq, step):
+
+    n_data = 24 if stat_freq == "daily" else 31 * 24
+    outputs = {}
+    for sketch_backend in ("crick", "array"):
+        opa_stat = Opa(make_request(
+            stat, sketch_backend, stat_freq=stat_freq, output_freq=stat_freq
+        ))
+        for i in range(0, n_data, step):
+            dm = opa_stat.compute(data.isel(time=slice(i, i + step)))
+        outputs[sketch_backend] = dm
+
+    if stat == "percentile":
+        assert outputs["array"].pr.shape == outputs["crick"].pr.shape
+        assert np.allclose(
+            outputs["array"].pr, outputs["crick"].pr,
+            rtol=dec_place_per, atol=dec_place_per
+        )
+    else:
+        counts, edges = outputs["array"]
+        crick_counts, crick_edges = outputs["crick"]
+        assert counts.pr.dtype == crick_counts.pr.dtype
+        assert np.allclose(edges.pr, crick_edges.pr)
+        if stat_freq == "daily":
+            assert np.array_equal(counts.pr, crick_counts.pr)
+        else:
+            # counts interpolated from the digests
+            assert np.max(np.abs(counts.pr - crick_counts.pr)) <= 0.05 * n_data
+
+
+def test_sketch_backend_checkpoint(data, tmp_path):
+
+    pass_dic = make_request(
+        "percentile", checkpoint=True, checkpoint_filepath=str(tmp_path),
+        stat_freq="monthly", output_freq="monthly"
+    )
+    opa_stat = Opa(make_request(
+        "percentile", stat_freq="monthly", output_freq="monthly"
+    ))
+    for i in range(0, 31 * 24, 24):
+        dm = Opa(pass_dic).compute(data.isel(time=slice(i, i + 24)))
+        expected = opa_stat.compute(data.isel(time=slice(i, i + 24)))
+
+    assert np.array_equal(dm.pr, expected.pr)
+
+
+def test_sketch_backend_rollup(data):
+
+    outputs = {}
+    for sketch_backend in ("crick", "array"):
+        opa_stat = Opa(make_request(
+            "percentile", sketch_backend, output_freq="monthly",
+            rollup_freq="monthly"
+        ))
+        for i in range(0, 31 * 24, 24):
+            opa_stat.compute(data.isel(time=slice(i, i + 24)))
+        outputs[sketch_backend] = opa_stat.rollup.final_cum["monthly"]
+
+    assert np.allclose(
+        outputs["array"].pr, outputs["crick"].pr,
+        rtol=dec_place_per, atol=dec_place_per
+    )
+
+
+def test_sketch_backend_snapshot(data):
+
+    partial_stats = {}
+    for sketch_backend in ("crick", "array"):
+        opa_stat = Opa(make_request("percentile", sketch_backend))
+        opa_stat.compute(data.isel(time=slice(0, 12)))
+        partial_stats[sketch_backend], _ = opa_stat.snapshot()
+
+    assert partial_stats["array"].shape == (1, 100, 16, 20)
+    assert np.allclose(
+        partial_stats["array"], partial_stats["crick"], rtol=1e-12, atol=0
+    )
+
+
+@pytest.mark.parametrize("stat, sketch_backend", [
+    ("percentile", "tdigest"), ("mean", "array"), ("bias_correction", "array")
+])
+def test_sketch_backend_not_valid(stat, sketch_backend):
+
+    with pytest.raises(ValueError):
+        Opa(make_request(stat, sketch_backend))
@@ -0,0 +1,160 @@
+import asyncio
+import glob
+import os
+import sys
+import threading
+import time
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.background_writer import BackgroundWriter
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(file_path, **kwargs):
+
+    pass_dic = {
+        "stat": "mean",
+        "stat_freq": "daily",
+        "output_freq": "daily",
+        "time_step": 60,
+        "variable": "pr",
+        "save": True,
+        "checkpoint": True,
+        "checkpoint_filepath": str(file_path),
+        "save_filepath": str(file_path),
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def test_writer_recreating_opa(data, tmp_path):
+    # the Opa is re-created for every chunk, so every checkpoint is read
+    # back while the previous Opa may still be writing it
+    pass_dic = make_request(tmp_path, writer_workers=2)
+    n_data = 2 * 24
+    for i in range(0, n_data, 4):
+        opa_stat = Opa(pass_dic)
+        opa_stat.compute(data.isel(time=slice(i, i + 4)))
+    opa_stat.close()
+
+    for day in range(2):
+        file_name = os.path.join(
+            tmp_path, f"2071_01_0{day + 1}_pr_timestep_60_daily_mean.nc"
+        )
+        dm = xr.open_dataset(file_name)
+        two_pass = data.pr.isel(time=slice(day * 24, (day + 1) * 24)).mean("time")
+        assert np.allclose(dm.pr.values[0], two_pass.values, rtol=1e-10)
+        dm.close()
+
+    assert not os.path.exists(opa_stat.request.checkpoint_file)
+
+
+def test_writer_keeps_checkpoint(data, tmp_path):
+
+    pass_dic = make_request(tmp_path, writer_workers=1, save=False)
+    with Opa(pass_dic) as opa_stat:
+        opa_stat.compute(data.isel(time=slice(0, 10)))
+
+    assert opa_stat.writer is None
+
+    # the writer is not in the checkpoint, a new one is started
+    with Opa(pass_dic) as opa_checkpoint:
+        assert opa_checkpoint.time.count == 10
+        assert opa_checkpoint.writer is not None
+
+
+def test_acompute(data, tmp_path):
+
+    pass_dic = make_request(tmp_path, stat="max", stat_freq="daily",
+                            output_freq="weekly")
+    opa_async = Opa(pass_dic)
+    opa_sync = Opa(make_request(tmp_path, stat="max", stat_freq="daily",
+                                output_freq="weekly", save=False,
+                                checkpoint=False))
+
+    async def run():
+        outputs = []
+        for i in range(0, 11 * 24, 12):
+            outputs.append(
+                await opa_async.acompute(data.isel(time=slice(i, i + 12)))
+            )
+        return outputs
+
+    outputs = asyncio.run(run())
+    opa_async.close()
+
+    for i, dm in zip(range(0, 11 * 24, 12), outputs):
+        expected = opa_sync.compute(data.isel(time=slice(i, i + 12)))
+        if isinstance(expected, xr.Dataset):
+            assert np.allclose(dm.pr.values, expected.pr.values)
+
+    assert os.path.isfile(os.path.join(
+        tmp_path, "2071_01_05_to_2071_01_11_pr_timestep_60_daily_max.nc"
+    ))
+    assert not os.path.exists(opa_async.request.checkpoint_file)
+
+
+def test_writer_order_and_backpressure(tmp_path):
+
+    written = []
+    release = threading.Event()
+
+    def slow_write(value):
+        release.wait()
+        written.append(value)
+
+    writer = BackgroundWriter(n_workers=1, queue_size=1)
+    writer.submit("file", slow_write, 0)
+    writer.submit("file", slow_write, 1)
+
+    # the queue is full, so the next write waits for space
+    start = time.perf_counter()
+    threading.Timer(0.2, release.set).start()
+    writer.submit("file", slow_write, 2)
+    assert time.perf_counter() - start >= 0.15
+
+    writer.close()
+    assert written == [0, 1, 2]
+
+
+def test_writer_error():
+
+    def failing_write():
+        raise OSError("disk full")
+
+    writer = BackgroundWriter()
+    writer.submit("file", failing_write)
+    with pytest.raises(OSError):
+        writer.flush()
+    writer.close()
+
+
+def test_writer_bad_request(tmp_path):
+
+    with pytest.raises(ValueError):
+        Opa(make_request(tmp_path, writer_workers=0))
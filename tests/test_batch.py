@@ -0,0 +1,157 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    if stat == "thresh_exceed":
+        pass_dic["thresh_exceed"] = [1e-4]
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def run_steps(data, pass_dic, n_start, n_data):
+    """Passes the data one time step at a time and keeps every
+    finished output"""
+    opa_stat = Opa(pass_dic)
+    outputs = []
+    for i in range(n_start, n_data):
+        dm = opa_stat.compute(data.isel(time=slice(i, i + 1)))
+        # skipped time steps are returned as they were given
+        if isinstance(dm, xr.Dataset):
+            outputs.append(dm)
+    return opa_stat, outputs
+
+
+@pytest.mark.parametrize(
+    "stat", ["mean", "var", "std", "min", "max", "sum", "thresh_exceed"]
+)
+def test_batch_matches_single_steps(data, stat):
+
+    n_data = 2 * 24 + 5
+    _, unbatched = run_steps(data, make_request(stat), 3, n_data)
+    _, batched = run_steps(data, make_request(stat, batch_size=10), 3, n_data)
+
+    # a daily statistic is output as soon as the day is complete
+    assert len(batched) == len(unbatched) == 1
+    assert np.allclose(batched[0].pr.values, unbatched[0].pr.values, rtol=1e-10)
+    if stat in ("min", "max"):
+        assert np.array_equal(
+            batched[0].timings.values, unbatched[0].timings.values
+        )
+
+
+def test_batch_max_bytes(data):
+
+    n_bytes = data.pr.isel(time=slice(0, 4)).nbytes
+    opa_stat, _ = run_steps(
+        data, make_request("mean", batch_max_bytes=n_bytes), 0, 6
+    )
+    # first time step initialises the statistic, the next 4 are
+    # flushed together and the last one is buffered
+    assert opa_stat.time.count == 5
+    assert opa_stat.batch.weight == 1
+
+
+def test_batch_flush(data):
+
+    pass_dic = make_request("mean", "monthly", "monthly", batch_size=100)
+    opa_stat, _ = run_steps(data, pass_dic, 0, 30)
+    assert opa_stat.batch.weight == 29
+
+    opa_stat.flush()
+    assert opa_stat.batch.weight == 0
+    assert opa_stat.time.count == 30
+
+    two_pass = data.pr.isel(time=slice(0, 30)).mean("time")
+    assert np.allclose(opa_stat.statistics.mean_cum[0], two_pass.values)
+
+
+def test_batch_with_checkpoint(data):
+
+    for file in glob.glob("tests/checkpoint_pr_daily_timestep_60_daily_mean.pkl"):
+        os.remove(file)
+
+    pass_dic = make_request("mean", checkpoint=True, batch_size=6)
+    opa_stat = Opa(pass_dic)
+    for i in range(0, 10):
+        opa_stat.compute(data.isel(time=slice(i, i + 1)))
+
+    # the buffered time steps are in the checkpoint with the state
+    opa_checkpoint = Opa(pass_dic)
+    assert opa_checkpoint.time.count == 7
+    assert opa_checkpoint.batch.weight == 3
+    opa_checkpoint.flush()
+    assert opa_checkpoint.time.count == 10
+    os.remove(opa_checkpoint.request.checkpoint_file)
+
+
+def test_batch_new_opa_every_step(data):
+
+    for file in glob.glob("tests/checkpoint_pr_daily_timestep_60_daily_mean.pkl"):
+        os.remove(file)
+
+    n_data = 5 * 24
+    _, unbatched = run_steps(data, make_request("mean"), 0, n_data)
+
+    pass_dic = make_request("mean", checkpoint=True, batch_size=5)
+    batched = []
+    for i in range(0, n_data):
+        # a new Opa for every chunk, as in the examples
+        opa_stat = Opa(pass_dic)
+        dm = opa_stat.compute(data.isel(time=slice(i, i + 1)))
+        if isinstance(dm, xr.Dataset):
+            batched.append(dm)
+
+    assert len(batched) == len(unbatched) == 5
+    for batched_dm, unbatched_dm in zip(batched, unbatched):
+        assert np.allclose(
+            batched_dm.pr.values, unbatched_dm.pr.values, rtol=1e-10
+        )
+    assert not os.path.exists(opa_stat.request.checkpoint_file)
+
+
+def test_batch_bad_size():
+
+    with pytest.raises(ValueError):
+        Opa(make_request("mean", batch_size=0))
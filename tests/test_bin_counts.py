@@ -0,0 +1,173 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.statistics.bin_counts import BinCounts
+
+RANGE = [0, 0.002]
+BINS = 8
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": "histogram",
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+        "bins": BINS,
+        "range": RANGE,
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def two_pass(values):
+    """np.histogram of every grid cell of values (time, ...)"""
+    flat = values.reshape(values.shape[0], -1)
+    counts = np.array([
+        np.histogram(flat[:, j], bins=BINS, range=RANGE)[0]
+        for j in range(flat.shape[1])
+    ]).T
+    return counts.reshape(BINS, *values.shape[1:])
+
+
+@pytest.mark.parametrize("step, block_bytes", [(1, 2**18), (7, 2**18), (50, 512)])
+def test_bin_counts(step, block_bytes):
+
+    values = np.random.default_rng(0).uniform(-0.0005, 0.0025, (200, 30))
+    values[5, :4] = np.nan
+    # edges of the bins
+    values[6, :5] = [0, 0.00025, 0.002, -1e-12, 0.002 + 1e-12]
+    counts = BinCounts(30, BINS, RANGE, block_bytes)
+    for i in range(0, 200, step):
+        counts.update(values[i:i + step])
+
+    hist, edges = counts.histogram()
+    assert hist.dtype == np.int32
+    assert np.array_equal(hist, two_pass(values))
+    assert np.array_equal(edges[:, 0], np.histogram_bin_edges([], BINS, RANGE))
+
+
+def test_bin_counts_merge():
+
+    values = np.random.default_rng(1).uniform(0, 0.002, (20, 10))
+    counts = BinCounts(10, BINS, RANGE)
+    counts.update(values[:12])
+    other = BinCounts(10, BINS, RANGE)
+    other.update(values[12:])
+    counts.merge(other)
+
+    assert np.array_equal(counts.counts, two_pass(values))
+    with pytest.raises(ValueError):
+        counts.merge(BinCounts(10, BINS, [0, 1]))
+
+
+@pytest.mark.parametrize("step", [1, 6, 24])
+def test_exact_histogram_daily(data, step):
+
+    day = data.isel(time=slice(0, 24))
+    opa_stat = Opa(make_request())
+    for i in range(0, 24, step):
+        output = opa_stat.compute(day.isel(time=slice(i, i + step)))
+    counts, edges = output
+
+    assert counts.pr.shape == (1, BINS, 16, 20)
+    assert counts.pr.dtype == np.int32
+    assert np.array_equal(counts.pr.values[0], two_pass(day.pr.values))
+    assert np.allclose(
+        edges.pr.values[0, :, 0, 0], np.linspace(*RANGE, BINS + 1)
+    )
+
+
+def test_exact_histogram_checkpoint(data, tmp_path):
+
+    pass_dic = make_request(
+        "monthly", "monthly", checkpoint=True,
+        checkpoint_filepath=str(tmp_path)
+    )
+    month = data.isel(time=slice(0, 31 * 24))
+    for i in range(0, 31 * 24, 24):
+        output = Opa(pass_dic).compute(month.isel(time=slice(i, i + 24)))
+    counts, _ = output
+
+    assert np.array_equal(counts.pr.values[0], two_pass(month.pr.values))
+
+
+def test_exact_histogram_snapshot(data):
+
+    opa_stat = Opa(make_request())
+    opa_stat.compute(data.isel(time=slice(0, 12)))
+    counts, metadata = opa_stat.snapshot()
+
+    assert np.array_equal(counts[0], two_pass(data.pr.values[:12]))
+    assert np.allclose(
+        metadata["bin_edges"][0, :, 0, 0], np.linspace(*RANGE, BINS + 1)
+    )
+
+
+@pytest.mark.parametrize("kwargs, exact", [
+    (dict(), True),
+    (dict(sketch_backend="crick"), False),
+    (dict(range=None), False),
+])
+def test_exact_histogram_default(data, kwargs, exact):
+
+    pass_dic = make_request()
+    pass_dic.update(kwargs)
+    if pass_dic["range"] is None:
+        del pass_dic["range"]
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 2)))
+
+    assert isinstance(opa_stat.statistics.digests_cum, BinCounts) == exact
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(sketch_backend="exact", range=None),
+    dict(range=[0.002, 0]),
+    dict(range=[0, np.inf]),
+    dict(range=0.002),
+    dict(bins=0),
+    dict(bins=2.5),
+])
+def test_exact_histogram_not_valid(kwargs):
+
+    pass_dic = make_request()
+    pass_dic.update(kwargs)
+    if pass_dic["range"] is None:
+        del pass_dic["range"]
+    with pytest.raises(ValueError):
+        Opa(pass_dic)
@@ -0,0 +1,194 @@
+import os
+import sys
+import tracemalloc
+import pytest
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.statistics.sample_buffer import SampleBuffer
+
+# number of cells of a HEALPix grid with nside 512
+N_CELLS = 12 * 512**2
+
+
+@pytest.fixture(scope="module")
+def data():
+    """Synthetic precipitation on a 1-D HEALPix-like grid of cells, four
+    6 hourly time steps, so one day"""
+    rng = np.random.default_rng(42)
+    values = rng.gamma(1.0, 1e-4, (4, N_CELLS))
+    return xr.DataArray(
+        values, dims=("time", "cell"),
+        coords={
+            "time": pd.date_range("2071-01-01", periods=4, freq="6h"),
+            "cell": np.arange(N_CELLS),
+        },
+        name="pr",
+    ).to_dataset()
+
+
+def make_request(stat, **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": "daily",
+        "output_freq": "daily",
+        "time_step": 360,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def run_last_step(pass_dic, data):
+    """Passes the first three time steps, keeps the rolling summaries and
+    then passes the last time step, which finishes the statistic"""
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 3)))
+    state = dict(vars(opa_stat.statistics))
+
+    tracemalloc.start()
+    output = opa_stat.compute(data.isel(time=slice(3, 4)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return output, state, peak
+
+
+@pytest.mark.parametrize("stat", ["mean", "std", "max"])
+def test_cell_grid_no_copy(data, stat):
+
+    dm, state, peak = run_last_step(make_request(stat), data)
+
+    values = data.pr.values
+    expected = {"mean": np.mean, "std": lambda x, axis: np.std(x, axis, ddof=1),
+                "max": np.max}[stat](values, axis=0)
+    assert dm.pr.dims == ("time", "cell")
+    assert dm.pr.shape == (1, N_CELLS)
+    assert np.allclose(dm.pr.values[0], expected, rtol=1e-12)
+
+    # the output is the memory of the rolling summary itself
+    key = "var_cum" if stat == "std" else stat + "_cum"
+    assert np.shares_memory(dm.pr.values, state[key])
+    if stat == "max":
+        assert np.shares_memory(dm.timings.values, state["timings_cum"])
+        assert np.array_equal(
+            dm.timings.values[0],
+            data.time.values[np.argmax(values, axis=0)]
+        )
+    # not more than the size of one grid of float64 for the last step
+    assert peak < 1.5 * N_CELLS * 8
+
+
+def test_cell_grid_numpy(data):
+
+    values = data.pr.values
+    time_stamps = data.time.values
+    opa_stat = Opa(make_request("max"))
+    opa_stat.compute_numpy(values[:3], time_stamps[:3])
+    state = dict(vars(opa_stat.statistics))
+
+    final, meta = opa_stat.compute_numpy(
+        values[3:], time_stamps[3:], dims=("time", "cell")
+    )
+    assert final.shape == (1, N_CELLS)
+    assert meta["dims"] == ("time", "cell")
+    assert np.array_equal(final[0], np.max(values, axis=0))
+    assert np.shares_memory(final, state["max_cum"])
+    assert np.shares_memory(meta["timings"], state["timings_cum"])
+
+
+def test_cell_grid_histogram(data):
+
+    dm, state, _ = run_last_step(
+        make_request("histogram", bins=8, range=[0, 1e-3]), data
+    )
+    counts, edges = dm
+    assert counts.pr.dims == ("time", "bin_count", "cell")
+    assert counts.pr.shape == (1, 8, N_CELLS)
+    assert np.shares_memory(counts.pr.values, state["digests_cum"].counts)
+
+    expected = np.apply_along_axis(
+        lambda x: np.histogram(x, bins=8, range=(0, 1e-3))[0],
+        0, data.pr.values[:, :1000]
+    )
+    assert np.array_equal(counts.pr.values[0, :, :1000], expected)
+    assert np.allclose(edges.pr.values[0, :, 0], np.linspace(0, 1e-3, 9))
+
+
+@pytest.mark.parametrize("stat", ["max", "std", "histogram"])
+def test_cell_grid_continuous(data, stat):
+    # the rolling summaries of continuous statistics carry on after every
+    # output, so neither the outputs nor the summaries are reused
+    kwargs = {"bins": 8, "range": [0, 1e-3]} if stat == "histogram" else {}
+    opa_stat = Opa(make_request(stat, stat_freq="continuous", **kwargs))
+    first = opa_stat.compute(data)
+    next_day = data.assign_coords(time=data.time + np.timedelta64(1, "D"))
+    second = opa_stat.compute(next_day * 2)
+    if stat == "histogram":
+        first, second = first[0], second[0]
+
+    values = np.concatenate([data.pr.values, 2 * data.pr.values])[:, :1000]
+    if stat == "max":
+        expected = [np.max(values[:4], axis=0), np.max(values, axis=0)]
+    elif stat == "std":
+        expected = [np.std(values[:4], axis=0, ddof=1),
+                    np.std(values, axis=0, ddof=1)]
+    else:
+        expected = [np.apply_along_axis(
+            lambda x: np.histogram(x, bins=8, range=(0, 1e-3))[0], 0, x
+        ) for x in (values[:4], values)]
+    assert np.allclose(first.pr.values[0, ..., :1000], expected[0], rtol=1e-12)
+    assert np.allclose(second.pr.values[0, ..., :1000], expected[1], rtol=1e-12)
+
+
+def test_cell_grid_percentile(data):
+
+    dm, _, _ = run_last_step(
+        make_request("percentile", percentile_list=[0.1, 0.5, 0.9]), data
+    )
+    assert dm.pr.dims == ("time", "percentile", "cell")
+    assert np.allclose(
+        dm.pr.values[0],
+        np.quantile(data.pr.values, [0.1, 0.5, 0.9], axis=0), rtol=1e-12
+    )
+
+
+def test_cell_grid_thresh_exceed(data):
+
+    dm, _, _ = run_last_step(
+        make_request("thresh_exceed", thresh_exceed=[1e-4]), data
+    )
+    assert dm.pr.dims == ("time", "thresholds", "cell")
+    assert np.array_equal(
+        dm.pr.values[0, 0], np.sum(data.pr.values > 1e-4, axis=0)
+    )
+
+
+def test_sample_buffer_final_quantile():
+
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(5, 7))
+    values[1, 2] = np.nan
+    buffer = SampleBuffer(6, 7)
+    buffer.update(values)
+
+    expected = buffer.quantile([0.25, 0.5])
+    # quantile leaves the buffer as it is, final_quantile sorts it
+    assert np.array_equal(buffer.values[:5], values, equal_nan=True)
+    assert np.array_equal(
+        buffer.final_quantile([0.25, 0.5]), expected, equal_nan=True
+    )
+    assert np.array_equal(
+        buffer.values[:5], np.sort(values, axis=0), equal_nan=True
+    )
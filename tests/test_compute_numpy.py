@@ -0,0 +1,176 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    if stat == "thresh_exceed":
+        pass_dic["thresh_exceed"] = [1e-4, 5e-4]
+    if stat == "percentile":
+        pass_dic["percentile_list"] = [0.1, 0.5, 0.9]
+        pass_dic["compression"] = 1
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def run_both(data, pass_dic, n_data, step):
+    """Passes the same data to compute and compute_numpy and keeps
+    the last finished output of both"""
+    opa_xr = Opa(pass_dic)
+    opa_np = Opa(pass_dic)
+    values = data.pr.values
+    time_stamps = data.time.values
+    dm = output = None
+    for i in range(0, n_data, step):
+        out_xr = opa_xr.compute(data.isel(time=slice(i, i + step)))
+        out_np = opa_np.compute_numpy(
+            values[i:i + step], time_stamps[i:i + step]
+        )
+        if isinstance(out_xr, (xr.Dataset, tuple)):
+            dm = out_xr
+        if out_np is not None:
+            output = out_np
+    return dm, output
+
+
+@pytest.mark.parametrize(
+    "stat", ["mean", "var", "std", "sum", "thresh_exceed", "percentile"]
+)
+@pytest.mark.parametrize("step", [1, 5])
+def test_compute_numpy_matches_compute(data, stat, step):
+
+    dm, (final_stat, meta) = run_both(data, make_request(stat), 2 * 24, step)
+
+    assert np.allclose(final_stat, dm.pr.values, rtol=1e-10)
+    assert np.array_equal(meta["time"], dm.time.values)
+    assert meta["stat"] == stat
+    assert len(meta["dims"]) == final_stat.ndim
+
+
+@pytest.mark.parametrize("stat", ["min", "max"])
+@pytest.mark.parametrize("step", [1, 5])
+def test_compute_numpy_timings(data, stat, step):
+
+    pass_dic = make_request(stat, "daily", "weekly")
+    dm, (final_stat, meta) = run_both(data, pass_dic, 11 * 24, step)
+
+    assert np.array_equal(final_stat, dm.pr.values)
+    assert meta["timings"].dtype == np.dtype("datetime64[ns]")
+    assert np.array_equal(meta["timings"], dm.timings.values)
+
+
+def test_compute_numpy_append(data):
+
+    pass_dic = make_request("mean", "daily", "weekly")
+    # 2071-01-01 is a Thursday, so the first full week ends on the 11th
+    dm, (final_stat, meta) = run_both(data, pass_dic, 11 * 24, 12)
+
+    assert final_stat.shape[0] == 7
+    assert np.allclose(final_stat, dm.pr.values, rtol=1e-10)
+    assert np.array_equal(meta["time"], dm.time.values)
+
+
+def test_compute_numpy_append_checkpoint(data, tmp_path):
+
+    pass_dic = make_request(
+        "mean", "daily", "weekly", checkpoint=True,
+        checkpoint_filepath=str(tmp_path)
+    )
+    values = data.pr.values
+    time_stamps = data.time.values
+    for i in range(0, 11 * 24, 6):
+        output = Opa(pass_dic).compute_numpy(
+            values[i:i + 6], time_stamps[i:i + 6]
+        )
+
+    final_stat, meta = output
+    two_pass = data.pr.isel(time=slice(10 * 24, 11 * 24)).mean("time")
+    assert final_stat.shape[0] == 7
+    assert meta["time"][-1] == data.time.values[10 * 24]
+    assert np.allclose(final_stat[-1], two_pass.values, rtol=1e-10)
+
+
+def test_compute_numpy_segments(data):
+    # one chunk holding many complete statistics
+    pass_dic = make_request("var", "daily", "monthly")
+    dm, (final_stat, _) = run_both(data, pass_dic, 31 * 24, 31 * 24)
+
+    assert final_stat.shape[0] == 31
+    assert np.allclose(final_stat, dm.pr.values, rtol=1e-10)
+
+
+def test_compute_numpy_histogram(data):
+
+    dm, (final_stat, meta) = run_both(data, make_request("histogram"), 24, 6)
+
+    assert np.array_equal(final_stat, dm[0].pr.values)
+    assert np.allclose(meta["bin_edges"], dm[1].pr.values)
+
+
+def test_compute_numpy_as_xarray(data):
+
+    opa_stat = Opa(make_request("thresh_exceed"))
+    dm = opa_stat.compute_numpy(
+        data.pr.values[:24], data.time.values[:24], as_xarray=True,
+        dims=["time", "lat", "lon"],
+        coords={"lat": data.lat.values, "lon": data.lon.values},
+    )
+    two_pass = (data.pr.isel(time=slice(0, 24)) >= 1e-4).sum("time")
+
+    assert isinstance(dm, xr.Dataset)
+    assert dm.pr.dims == ("time", "thresholds", "lat", "lon")
+    assert np.array_equal(dm.lat.values, data.lat.values)
+    assert np.array_equal(dm.pr.values[0, 0], two_pass.values)
+
+
+def test_compute_numpy_not_supported():
+
+    with pytest.raises(ValueError):
+        Opa(make_request("raw")).compute_numpy(
+            np.zeros((1, 2)), np.array(["2071-01-01"], dtype="datetime64[ns]")
+        )
+
+    with pytest.raises(ValueError):
+        Opa(make_request("mean")).compute_numpy(
+            np.zeros((2, 2)), np.array(["2071-01-01"], dtype="datetime64[ns]")
+        )
@@ -0,0 +1,214 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass import check_request
+from one_pass.initialise import initialise_statistics
+from one_pass.opa import Opa
+from one_pass.statistics.ddsketch import DDSketch
+from one_pass.statistics.sample_buffer import SampleBuffer
+
+PERCENTILES = list(np.linspace(0, 1, 101))
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat_freq="monthly", output_freq="monthly", **kwargs):
+
+    pass_dic = {
+        "stat": "percentile",
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+        "percentile_list": PERCENTILES,
+        "sketch_backend": "ddsketch",
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def relative_error(result, values):
+    """Largest relative error to the lower percentiles of values"""
+    exact = np.nanquantile(values, PERCENTILES, axis=0, method="lower")
+    return np.max(np.abs(result - exact) / np.where(exact == 0, 1, np.abs(exact)))
+
+
+@pytest.mark.parametrize("step", [1, 37])
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_ddsketch_relative_error(step, relative_accuracy):
+
+    rng = np.random.default_rng(0)
+    values = np.concatenate(
+        [rng.gamma(0.5, 1e-4, (1000, 20)), rng.normal(size=(1000, 20))], axis=1
+    )
+    values[rng.random(values.shape) < 0.3] = 0
+    values[5, :3] = np.nan
+    values[:, 3] = np.nan
+    sketch = DDSketch(40, relative_accuracy)
+    for i in range(0, 1000, step):
+        sketch.update(values[i:i + step])
+
+    result = sketch.quantile(PERCENTILES)
+    assert np.all(np.isnan(result[:, 3]))
+    result = np.delete(result, 3, axis=1)
+    values = np.delete(values, 3, axis=1)
+    assert relative_error(result, values) <= relative_accuracy
+    assert np.array_equal(result[0], np.nanmin(values, axis=0))
+    assert np.array_equal(result[-1], np.nanmax(values, axis=0))
+
+
+def test_ddsketch_memory():
+
+    rng = np.random.default_rng(1)
+    sketch = DDSketch(10, n_buckets=64)
+    sketch.update(rng.gamma(1, 1, (5, 10)))
+    nbytes = sketch.nbytes
+    assert nbytes == 10 * (4 * 64 + 32)
+    for _ in range(20):
+        sketch.update(rng.gamma(1, 10, (100, 10)))
+    assert sketch.nbytes == nbytes
+    sketch.update(-rng.gamma(1, 1, (5, 10)))
+    assert sketch.nbytes == 10 * (8 * 64 + 40)
+
+
+def test_ddsketch_collapse():
+    # the 64 - 4 - 2 buckets below the largest value cover values down to
+    # about max / 3.2
+    values = np.random.default_rng(2).uniform(0, 10, (2000, 10))
+    sketch = DDSketch(10, n_buckets=64)
+    sketch.update(values)
+
+    result = sketch.quantile(PERCENTILES)
+    exact = np.quantile(values, PERCENTILES, axis=0, method="lower")
+    high = exact > np.max(values, axis=0) / 1.0201 ** 58
+    assert np.all(np.abs(result - exact)[high] <= 0.01 * exact[high])
+    # collapsed into the lowest bucket
+    assert np.max(np.abs(result - exact)[~high] / exact[~high]) > 0.01
+
+
+def test_ddsketch_merge():
+
+    rng = np.random.default_rng(3)
+    values = rng.normal(size=(1000, 20))
+    values[500:] *= 100
+    sketch = DDSketch(20)
+    sketch.update(values[:500])
+    other = DDSketch(20)
+    other.update(values[500:])
+    top = other.positive.top.copy()
+    sketch.merge(other)
+
+    assert np.array_equal(other.positive.top, top)
+    assert relative_error(sketch.quantile(PERCENTILES), values) <= 0.01
+    with pytest.raises(ValueError):
+        sketch.merge(DDSketch(20, 0.05))
+
+
+@pytest.mark.parametrize("step", [1, 24])
+def test_ddsketch_compute(data, step):
+
+    month = data.isel(time=slice(0, 31 * 24))
+    opa_stat = Opa(make_request())
+    for i in range(0, 31 * 24, step):
+        dm = opa_stat.compute(month.isel(time=slice(i, i + step)))
+
+    assert dm.pr.shape == (1, len(PERCENTILES), 16, 20)
+    values = month.pr.values.reshape(31 * 24, -1)
+    assert relative_error(dm.pr.values[0].reshape(len(PERCENTILES), -1),
+                          values) <= 0.01
+
+
+def test_ddsketch_checkpoint(data, tmp_path):
+
+    pass_dic = make_request(
+        "continuous", "monthly", checkpoint=True,
+        checkpoint_filepath=str(tmp_path), relative_accuracy=0.02,
+        sketch_buckets=256
+    )
+    opa_stat = Opa(make_request(
+        "continuous", "monthly", relative_accuracy=0.02, sketch_buckets=256
+    ))
+    for i in range(0, 31 * 24, 24):
+        dm = Opa(pass_dic).compute(data.isel(time=slice(i, i + 24)))
+        expected = opa_stat.compute(data.isel(time=slice(i, i + 24)))
+
+    assert np.array_equal(dm.pr, expected.pr)
+    assert opa_stat.statistics.digests_cum.nbytes == 320 * (4 * 256 + 32)
+
+
+def test_ddsketch_rollup(data):
+
+    opa_stat = Opa(make_request(
+        "daily", "monthly", rollup_freq="monthly"
+    ))
+    month = data.isel(time=slice(0, 31 * 24))
+    for i in range(0, 31 * 24, 24):
+        opa_stat.compute(month.isel(time=slice(i, i + 24)))
+    rolled_up = opa_stat.rollup.final_cum["monthly"]
+
+    values = month.pr.values.reshape(31 * 24, -1)
+    assert relative_error(
+        np.reshape(rolled_up.pr.values[0], (len(PERCENTILES), -1)), values
+    ) <= 0.01
+
+
+def test_custom_sketch_backend(data, monkeypatch):
+    # a new backend only needs a GridSketch and its statistics
+    monkeypatch.setitem(
+        initialise_statistics.SKETCH_BACKENDS, "buffer",
+        lambda opa_self, n_cells: SampleBuffer(opa_self.time.n_data, n_cells)
+    )
+    monkeypatch.setitem(
+        check_request.sketch_backend_options, "buffer", ("percentile",)
+    )
+    day = data.isel(time=slice(0, 24))
+    dm = Opa(make_request("daily", "daily", sketch_backend="buffer")).compute(day)
+
+    assert np.allclose(
+        dm.pr.values[0], day.pr.quantile(PERCENTILES, "time").values,
+        rtol=1e-12, atol=0
+    )
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(stat="histogram"),
+    dict(sketch_backend="crick", relative_accuracy=0.01),
+    dict(sketch_backend=None, sketch_buckets=100),
+    dict(relative_accuracy=1),
+    dict(relative_accuracy="0.01"),
+    dict(sketch_buckets=1),
+    dict(sketch_buckets=100.5),
+])
+def test_ddsketch_not_valid(kwargs):
+
+    with pytest.raises(ValueError):
+        Opa(make_request(**kwargs))
@@ -0,0 +1,169 @@
+import copy
+import glob
+import os
+import pickle
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.checkpointing import state_cache
+from one_pass.opa import Opa
+from one_pass.statistics.sharded_digests import ShardedDigests, find_shard_files
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat="percentile", stat_freq="daily", output_freq="daily",
+                 **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+        "sketch_backend": "crick",
+    }
+    if stat == "percentile":
+        pass_dic["percentile_list"] = [0.01, 0.5, 0.99]
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+@pytest.mark.parametrize("stat", ["percentile", "histogram"])
+@pytest.mark.parametrize("step", [1, 24])
+def test_digest_workers(data, stat, step):
+
+    day = data.isel(time=slice(0, 48))
+    opa_stat = Opa(make_request(stat, digest_workers=2))
+    expected_stat = Opa(make_request(stat))
+    for i in range(0, 48, step):
+        dm = opa_stat.compute(day.isel(time=slice(i, i + step)))
+        expected = expected_stat.compute(day.isel(time=slice(i, i + step)))
+
+    if stat == "histogram":
+        # bin counts and bin edges
+        for result, expected_result in zip(dm, expected):
+            assert np.array_equal(result.pr, expected_result.pr)
+    else:
+        assert np.array_equal(dm.pr, expected.pr)
+
+
+def test_digest_workers_default_backend(data):
+
+    pass_dic = make_request(digest_workers=3)
+    del pass_dic["sketch_backend"]
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 12)))
+
+    assert isinstance(opa_stat.statistics.digests_cum, ShardedDigests)
+    assert list(opa_stat.statistics.digests_cum.bounds) == [0, 106, 213, 320]
+
+
+@pytest.mark.parametrize("writer", [None, 1])
+def test_digest_workers_checkpoint(data, tmp_path, writer):
+
+    pass_dic = make_request(
+        stat_freq="monthly", output_freq="monthly", checkpoint=True,
+        checkpoint_filepath=str(tmp_path), digest_workers=2,
+        writer_workers=writer
+    )
+    # crick digests are compressed when pickled, so the expected
+    # percentiles are also restarted from checkpoints
+    (tmp_path / "serial").mkdir()
+    expected_dic = make_request(
+        stat_freq="monthly", output_freq="monthly", checkpoint=True,
+        checkpoint_filepath=str(tmp_path / "serial")
+    )
+    for i in range(0, 31 * 24, 24):
+        # restarted from the checkpoint and the shard files
+        state_cache.clear_state_cache()
+        opa_stat = Opa(pass_dic)
+        dm = opa_stat.compute(data.isel(time=slice(i, i + 24)))
+        expected = Opa(expected_dic).compute(data.isel(time=slice(i, i + 24)))
+        if i == 24 * 10:
+            # only the last two generations are kept
+            opa_stat.close()
+            assert len(find_shard_files(opa_stat.request.checkpoint_file)) == 4
+
+    opa_stat.close()
+    assert np.array_equal(dm.pr, expected.pr)
+    assert find_shard_files(opa_stat.request.checkpoint_file) == []
+    assert not os.path.exists(opa_stat.request.checkpoint_file)
+
+
+def test_digest_workers_pickle_between_checkpoints(data, tmp_path):
+
+    pass_dic = make_request(
+        stat_freq="monthly", output_freq="monthly", checkpoint=True,
+        checkpoint_filepath=str(tmp_path), digest_workers=2
+    )
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 24)))
+    shard_files = sorted(find_shard_files(opa_stat.request.checkpoint_file))
+    mtimes = [os.stat(file_name).st_mtime_ns for file_name in shard_files]
+
+    # pickles other than the checkpoint leave the shard files as they are
+    opa_stat.compute(data.isel(time=slice(24, 48)))
+    for _ in range(2):
+        opa_copy = copy.deepcopy(opa_stat)
+        pickle.dumps(opa_stat)
+    new_files = sorted(find_shard_files(opa_stat.request.checkpoint_file))
+    assert set(shard_files) <= set(new_files)
+    assert [
+        os.stat(file_name).st_mtime_ns for file_name in shard_files
+    ] == mtimes
+
+    # the copy has the digests of both days
+    expected = opa_stat.statistics.digests_cum.quantile([0.5])
+    assert np.array_equal(
+        opa_copy.statistics.digests_cum.quantile([0.5]), expected
+    )
+
+    # restarting from the checkpoint after a crash
+    state_cache.clear_state_cache()
+    opa_restart = Opa(pass_dic)
+    assert np.array_equal(
+        opa_restart.statistics.digests_cum.quantile([0.5]), expected
+    )
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(digest_workers=0),
+    dict(digest_workers=True),
+    dict(digest_workers=1.5),
+    dict(digest_workers=2, stat="mean"),
+    dict(digest_workers=2, sketch_backend="array"),
+    dict(digest_workers=2, stat_freq="daily", output_freq="daily",
+         rollup_freq="monthly"),
+])
+def test_digest_workers_not_valid(kwargs):
+
+    with pytest.raises(ValueError):
+        Opa(make_request(**kwargs))
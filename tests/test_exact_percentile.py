@@ -0,0 +1,153 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.statistics.sample_buffer import SampleBuffer
+
+PERCENTILES = [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": "percentile",
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+        "percentile_list": PERCENTILES,
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def two_pass(data_array):
+    return data_array.quantile(PERCENTILES, "time").values
+
+
+def test_sample_buffer_nan():
+
+    values = np.random.default_rng(0).random((24, 6))
+    values[3, 0] = np.nan
+    values[:20, 1] = np.nan
+    values[:, 2] = np.nan
+    buffer = SampleBuffer(24, 6)
+    buffer.update(values[:10])
+    buffer.update(values[10:])
+
+    result = buffer.quantile(PERCENTILES)
+    assert np.allclose(
+        result[:, [0, 1, 3, 4, 5]],
+        np.nanquantile(values[:, [0, 1, 3, 4, 5]], PERCENTILES, axis=0),
+        rtol=1e-12, atol=0
+    )
+    assert np.all(np.isnan(result[:, 2]))
+
+
+@pytest.mark.parametrize("step", [1, 5, 24])
+def test_exact_percentile_daily(data, step):
+
+    day = data.isel(time=slice(0, 24))
+    opa_stat = Opa(make_request())
+    for i in range(0, 24, step):
+        dm = opa_stat.compute(day.isel(time=slice(i, i + step)))
+
+    assert dm.pr.shape == (1, len(PERCENTILES), 16, 20)
+    assert np.allclose(dm.pr.values[0], two_pass(day.pr), rtol=1e-12, atol=0)
+
+
+def test_exact_percentile_segments(data):
+    # one chunk holding all the daily statistics of a month
+    month = data.isel(time=slice(0, 31 * 24))
+    dm = Opa(make_request(output_freq="monthly")).compute(month)
+
+    for day in (0, 17, 30):
+        assert np.allclose(
+            dm.pr.values[day],
+            two_pass(month.pr.isel(time=slice(day * 24, (day + 1) * 24))),
+            rtol=1e-12, atol=0
+        )
+
+
+def test_exact_percentile_checkpoint(data, tmp_path):
+
+    pass_dic = make_request(
+        "monthly", "monthly", sketch_backend="exact", checkpoint=True,
+        checkpoint_filepath=str(tmp_path)
+    )
+    month = data.isel(time=slice(0, 31 * 24))
+    for i in range(0, 31 * 24, 24):
+        dm = Opa(pass_dic).compute(month.isel(time=slice(i, i + 24)))
+
+    assert np.allclose(dm.pr.values[0], two_pass(month.pr), rtol=1e-12, atol=0)
+
+
+def test_exact_percentile_snapshot(data):
+
+    opa_stat = Opa(make_request())
+    opa_stat.compute(data.isel(time=slice(0, 12)))
+    partial_stat, _ = opa_stat.snapshot()
+
+    assert np.allclose(
+        partial_stat[0], two_pass(data.pr.isel(time=slice(0, 12))),
+        rtol=1e-12, atol=0
+    )
+
+
+@pytest.mark.parametrize("kwargs, start, exact", [
+    (dict(), "2071-01-01", True),
+    # 2071-01-05 is a Monday
+    (dict(stat_freq="weekly", output_freq="weekly"), "2071-01-05", True),
+    # too many time steps
+    (dict(stat_freq="monthly", output_freq="monthly"), "2071-01-01", False),
+    (dict(sketch_backend="crick"), "2071-01-01", False),
+    (dict(rollup_freq=["monthly"], output_freq="monthly"), "2071-01-01", False),
+])
+def test_exact_percentile_default(data, kwargs, start, exact):
+
+    opa_stat = Opa(make_request(**kwargs))
+    opa_stat.compute(data.sel(time=start).isel(time=slice(0, 2)))
+
+    assert isinstance(opa_stat.statistics.digests_cum, SampleBuffer) == exact
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(stat="histogram", sketch_backend="exact"),
+    dict(stat_freq="continuous", sketch_backend="exact"),
+    dict(rollup_freq="monthly", sketch_backend="exact"),
+])
+def test_exact_percentile_not_valid(kwargs):
+
+    with pytest.raises(ValueError):
+        Opa(make_request(**kwargs))
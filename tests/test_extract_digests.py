@@ -0,0 +1,132 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.statistics import extract_digests
+from one_pass.statistics.extract_digests import extract_histograms
+from one_pass.statistics.extract_digests import extract_percentiles
+
+PERCENTILES = [0.01, 0.25, 0.5, 0.75, 0.99]
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+@pytest.fixture
+def digests():
+    from crick import TDigest
+
+    values = np.random.default_rng(0).gamma(1, 1, (200, 50))
+    digests = np.empty(50, dtype=object)
+    for j in range(50):
+        digests[j] = TDigest(compression=1)
+        digests[j].update(values[:, j])
+    return digests
+
+
+def make_request(stat="percentile", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": "monthly",
+        "output_freq": "monthly",
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+        "sketch_backend": "crick",
+    }
+    if stat == "percentile":
+        pass_dic["percentile_list"] = PERCENTILES
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+@pytest.mark.parametrize("extract_workers", [1, 3, None])
+def test_extract_percentiles(digests, monkeypatch, extract_workers):
+    # several batches for the threads
+    monkeypatch.setattr(extract_digests, "EXTRACT_BATCH_SIZE", 7)
+    expected = np.array([digest.quantile(PERCENTILES) for digest in digests]).T
+
+    result = extract_percentiles(
+        digests, PERCENTILES, extract_workers=extract_workers
+    )
+    assert np.array_equal(result, expected)
+
+
+@pytest.mark.parametrize("hist_range", [None, (0, 5)])
+def test_extract_histograms(digests, monkeypatch, hist_range):
+
+    monkeypatch.setattr(extract_digests, "EXTRACT_BATCH_SIZE", 7)
+    counts = np.empty((8, 50), dtype=np.int32)
+    edges = np.empty((9, 50))
+
+    extract_histograms(digests, 8, hist_range, counts, edges, extract_workers=4)
+    for j, digest in enumerate(digests):
+        expected_counts, expected_edges = digest.histogram(8, range=hist_range)
+        assert np.array_equal(counts[:, j], expected_counts.astype(np.int32))
+        assert np.array_equal(edges[:, j], expected_edges)
+
+
+def test_extract_errors(digests, monkeypatch):
+
+    monkeypatch.setattr(extract_digests, "EXTRACT_BATCH_SIZE", 7)
+    digests[20] = None
+    with pytest.raises(AttributeError):
+        extract_percentiles(digests, PERCENTILES, extract_workers=2)
+
+
+def test_get_extract_workers(monkeypatch):
+
+    monkeypatch.setattr(extract_digests, "EXTRACT_BATCH_SIZE", 10)
+    assert extract_digests.get_extract_workers(25, 8) == 3
+    assert extract_digests.get_extract_workers(25, 2) == 2
+    assert extract_digests.get_extract_workers(0, 2) == 1
+
+
+@pytest.mark.parametrize("stat", ["percentile", "histogram"])
+def test_extract_workers_compute(data, monkeypatch, stat):
+
+    monkeypatch.setattr(extract_digests, "EXTRACT_BATCH_SIZE", 64)
+    month = data.isel(time=slice(0, 31 * 24))
+    dm = Opa(make_request(stat, extract_workers=3)).compute(month)
+    expected = Opa(make_request(stat, extract_workers=1)).compute(month)
+
+    if stat == "histogram":
+        for result, expected_result in zip(dm, expected):
+            assert np.array_equal(result.pr, expected_result.pr)
+    else:
+        assert np.array_equal(dm.pr, expected.pr)
+
+
+@pytest.mark.parametrize("extract_workers", [0, True, 2.0])
+def test_extract_workers_not_valid(extract_workers):
+
+    with pytest.raises(ValueError):
+        Opa(make_request(extract_workers=extract_workers))
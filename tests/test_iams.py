@@ -0,0 +1,139 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.checkpointing import state_cache
+from one_pass.checkpointing.write_pickle import write_pickle
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data.isel(lat=slice(0, 6), lon=slice(0, 8))
+
+
+def make_request(**kwargs):
+
+    pass_dic = {
+        "stat": "iams",
+        "stat_freq": "annually",
+        "output_freq": "annually",
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def two_pass(data_array, durations):
+    """Maximum of the sums over all the complete rolling windows of every
+    duration (in hours)"""
+    return np.stack([
+        np.maximum(
+            data_array.rolling(time=duration).sum().max("time").values, 0
+        )
+        for duration in durations
+    ])
+
+
+@pytest.mark.parametrize("step", [1, 7, 24, 500])
+def test_iams_rolling_sums(data, step):
+
+    n_data = 40 * 24
+    opa_stat = Opa(make_request())
+    for i in range(0, n_data, step):
+        opa_stat.compute(data.isel(time=slice(i, min(i + step, n_data))))
+
+    durations = [duration // 60 for duration in opa_stat.iams.durations]
+    assert opa_stat.iams.rolling_sums.shape[0] == durations[-1] + 1
+    assert np.allclose(
+        opa_stat.statistics.iams_cum,
+        two_pass(data.pr.isel(time=slice(0, n_data)), durations),
+        rtol=1e-10, atol=1e-14
+    )
+
+
+def test_iams_durations_key(data):
+
+    opa_stat = Opa(make_request(iams_durations=[360, 60, 1440, 60]))
+    for i in range(0, 10 * 24, 12):
+        opa_stat.compute(data.isel(time=slice(i, i + 12)))
+
+    assert opa_stat.iams.durations == [60, 360, 1440]
+    assert opa_stat.iams.rolling_sums.shape[0] == 25
+    assert np.allclose(
+        opa_stat.statistics.iams_cum,
+        two_pass(data.pr.isel(time=slice(0, 10 * 24)), [1, 6, 24]),
+        rtol=1e-10, atol=1e-14
+    )
+
+
+def test_iams_checkpoint(data, tmp_path):
+
+    pass_dic = make_request(
+        iams_durations=[60, 180, 2880], checkpoint=True,
+        checkpoint_filepath=str(tmp_path)
+    )
+    for i in range(0, 5 * 24, 5):
+        Opa(pass_dic).compute(data.isel(time=slice(i, i + 5)))
+
+    opa_stat = Opa(pass_dic)
+    assert np.allclose(
+        opa_stat.statistics.iams_cum,
+        two_pass(data.pr.isel(time=slice(0, 5 * 24)), [1, 3, 48]),
+        rtol=1e-10, atol=1e-14
+    )
+
+
+def test_iams_old_checkpoint(data, tmp_path):
+
+    pass_dic = make_request(checkpoint=True, checkpoint_filepath=str(tmp_path))
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 5)))
+
+    # checkpoint of an older version, with the raw data and no ring buffer
+    del opa_stat.iams.rolling_sums
+    opa_stat.iams.rolling_data = data.pr.isel(time=slice(0, 5)).values
+    write_pickle(opa_stat)
+    state_cache.clear_state_cache()
+
+    with pytest.raises(ValueError, match="older version"):
+        Opa(pass_dic)
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(iams_durations=[90]),
+    dict(iams_durations=[30]),
+    dict(iams_durations=60),
+    dict(iams_durations=[]),
+    dict(stat="max", iams_durations=[60]),
+])
+def test_iams_durations_not_valid(kwargs):
+
+    with pytest.raises(ValueError):
+        Opa(make_request(**kwargs))
@@ -0,0 +1,139 @@
+import glob
+import os
+import pickle
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+@pytest.mark.parametrize("stat, keys", [
+    ("mean", ["mean_cum"]),
+    ("var", ["mean_cum", "var_cum"]),
+    ("sum", ["sum_cum"]),
+])
+@pytest.mark.parametrize("step", [1, 4])
+def test_state_updated_in_place(data, stat, keys, step):
+
+    opa_stat = Opa(make_request(stat))
+    opa_stat.compute(data.isel(time=slice(0, step)))
+    arrays = [getattr(opa_stat.statistics, key) for key in keys]
+
+    for i in range(step, 20, step):
+        opa_stat.compute(data.isel(time=slice(i, i + step)))
+
+    for key, array in zip(keys, arrays):
+        assert getattr(opa_stat.statistics, key) is array
+
+    data_seen = data.pr.isel(time=slice(0, 20))
+    if stat == "var":
+        # var_cum holds the sum of squared differences until n_data
+        assert np.allclose(
+            opa_stat.statistics.var_cum / 19,
+            data_seen.var("time", ddof=1).values, rtol=1e-10
+        )
+    else:
+        assert np.allclose(
+            getattr(opa_stat.statistics, stat + "_cum"),
+            getattr(data_seen, stat)("time").values, rtol=1e-10
+        )
+
+
+@pytest.mark.parametrize("stat", ["min", "max"])
+@pytest.mark.parametrize("step", [1, 4])
+def test_timings_updated_in_place(data, stat, step):
+
+    opa_stat = Opa(make_request(stat))
+    opa_stat.compute(data.isel(time=slice(0, step)))
+    arrays = [getattr(opa_stat.statistics, stat + "_cum"),
+              opa_stat.statistics.timings_cum]
+
+    for i in range(step, 20, step):
+        opa_stat.compute(data.isel(time=slice(i, i + step)))
+
+    assert getattr(opa_stat.statistics, stat + "_cum") is arrays[0]
+    assert opa_stat.statistics.timings_cum is arrays[1]
+    assert opa_stat.statistics.timings_cum.dtype == np.int64
+
+    data_seen = data.pr.isel(time=slice(0, 20))
+    index = getattr(data_seen, "arg" + stat)("time").values
+    assert np.array_equal(
+        opa_stat.statistics.timings_cum.astype("datetime64[ns]"),
+        data_seen.time.values[index][np.newaxis]
+    )
+
+
+def test_continuous_output_not_changed(data):
+
+    opa_stat = Opa(make_request("var", "continuous", "daily"))
+    dm = opa_stat.compute(data.isel(time=slice(0, 24)))
+    first_day = dm.pr.values.copy()
+    opa_stat.compute(data.isel(time=slice(24, 30)))
+
+    assert np.array_equal(dm.pr.values, first_day)
+
+
+def test_scratch_not_checkpointed(data, tmp_path):
+
+    pass_dic = make_request(
+        "var", checkpoint=True, checkpoint_filepath=str(tmp_path)
+    )
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 5)))
+    assert len(opa_stat.scratch) > 0
+
+    with open(opa_stat.request.checkpoint_file, "rb") as file:
+        opa_checkpoint = pickle.load(file)
+    assert opa_checkpoint.scratch == {}
+
+
+def test_continuous_timings_not_changed(data):
+
+    opa_stat = Opa(make_request("max", "continuous", "daily"))
+    dm = opa_stat.compute(data.isel(time=slice(0, 24)))
+    first_day = dm.timings.values.copy()
+    opa_stat.compute(data.isel(time=slice(24, 48)))
+
+    assert np.array_equal(dm.timings.values, first_day)
@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import pytest
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+
+HEAVY_MODULES = ("zarr", "numcodecs", "crick", "dask", "tqdm")
+
+
+def imported_modules(code):
+    """Runs code in a fresh interpreter and returns which of the heavy
+    modules ended up in sys.modules"""
+    check = (
+        f"{code}\n"
+        "import sys\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check], cwd=path, capture_output=True,
+        text=True, check=True,
+    )
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+@pytest.mark.parametrize("module", ["one_pass", "one_pass.opa"])
+def test_import_is_lazy(module):
+
+    assert imported_modules(f"import {module}") == []
+
+
+def test_mean_does_not_import_heavy_modules():
+
+    code = (
+        "import numpy as np\n"
+        "from one_pass.opa import Opa\n"
+        "opa_stat = Opa({'stat': 'mean', 'stat_freq': 'daily',"
+        " 'output_freq': 'daily', 'time_step': 60, 'variable': 'pr',"
+        " 'save': False, 'checkpoint': False})\n"
+        "time_stamps = np.arange('2071-01-01T00', '2071-01-02T00',"
+        " dtype='datetime64[h]').astype('datetime64[ns]')\n"
+        "opa_stat.compute_numpy(np.ones((24, 2, 3)), time_stamps)\n"
+    )
+    assert imported_modules(code) == []
+
+
+@pytest.mark.parametrize("stat_freq, expected", [
+    # daily percentiles of hourly data are exact, without digests
+    ("daily", []), ("monthly", ["crick"])
+])
+def test_digests_import_crick(stat_freq, expected):
+
+    code = (
+        "import numpy as np\n"
+        "from one_pass.opa import Opa\n"
+        "opa_stat = Opa({'stat': 'percentile', 'percentile_list': [0.5],"
+        f" 'stat_freq': '{stat_freq}', 'output_freq': '{stat_freq}',"
+        " 'time_step': 60,"
+        " 'variable': 'pr', 'save': False, 'checkpoint': False})\n"
+        "time_stamps = np.arange('2071-01-01T00', '2071-01-01T02',"
+        " dtype='datetime64[h]').astype('datetime64[ns]')\n"
+        "opa_stat.compute_numpy(np.ones((2, 2, 3)), time_stamps)\n"
+    )
+    assert [name for name in imported_modules(code) if name == "crick"] == expected
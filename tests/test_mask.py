@@ -0,0 +1,272 @@
+import glob
+import os
+import sys
+import pickle
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.opa_group import OpaGroup
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+@pytest.fixture(scope="module")
+def mask(data):
+    # about 30 % of the grid is active
+    mask = np.zeros(data.pr.shape[1:], dtype=bool)
+    mask[2:9, 3:17] = True
+    mask[0, 0] = True
+    return mask
+
+
+def make_request(stat, stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    if stat == "thresh_exceed":
+        pass_dic["thresh_exceed"] = [1e-6, 1e-4]
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def run(pass_dic, data, n_time, step):
+    """Passes n_time time steps in chunks of step and returns the last
+    output that is not None"""
+    opa_stat = Opa(pass_dic)
+    output = None
+    for i in range(0, n_time, step):
+        dm = opa_stat.compute(data.isel(time=slice(i, i + step)))
+        if dm is not None:
+            output = dm
+    return opa_stat, output
+
+
+def assert_masked(masked, full, mask, fill=np.nan, rtol=0):
+    """Checks that masked is full on the active cells and fill on the
+    others"""
+    masked = np.asarray(masked)
+    full = np.asarray(full)
+    assert masked.shape == full.shape
+    if rtol:
+        assert np.allclose(masked[..., mask], full[..., mask], rtol=rtol)
+    else:
+        assert np.array_equal(
+            masked[..., mask], full[..., mask], equal_nan=True
+        )
+    assert np.array_equal(
+        masked[..., ~mask], np.full_like(masked[..., ~mask], fill),
+        equal_nan=True
+    )
+
+
+@pytest.mark.parametrize("step", [1, 24])
+@pytest.mark.parametrize(
+    "stat", ["mean", "sum", "var", "std", "min", "max", "thresh_exceed",
+             "percentile"]
+)
+def test_mask(data, mask, stat, step):
+
+    masked_stat, masked = run(
+        make_request(stat, mask=mask), data, 48, step
+    )
+    _, full = run(make_request(stat), data, 48, step)
+
+    assert masked.pr.dims == full.pr.dims
+    assert masked.lat.equals(full.lat) and masked.lon.equals(full.lon)
+    assert_masked(masked.pr, full.pr, mask)
+    if stat in ("min", "max"):
+        assert_masked(masked.timings, full.timings, mask, np.datetime64("NaT"))
+
+    # the rolling summaries only hold the active cells
+    assert masked_stat.data_set_info.size_data_source_tail == np.sum(mask)
+
+
+def test_mask_histogram(data, mask):
+
+    _, (counts, edges) = run(
+        make_request("histogram", mask=mask), data, 24, 6
+    )
+    _, (full_counts, full_edges) = run(
+        make_request("histogram"), data, 24, 6
+    )
+    # the inactive cells are NaN, not empty bins, so the counts are float
+    assert counts.pr.dtype == np.float64
+    assert_masked(counts.pr, full_counts.pr, mask)
+    assert not np.any(np.isnan(counts.pr.values[..., mask]))
+    assert_masked(edges.pr, full_edges.pr, mask)
+
+    # as in the snapshots
+    opa_stat, _ = run(make_request("histogram", mask=mask), data, 6, 6)
+    partial, _ = opa_stat.snapshot()
+    assert np.all(np.isnan(partial[..., ~mask]))
+    assert not np.any(np.isnan(partial[..., mask]))
+
+
+def test_mask_append_continuous(data, mask):
+
+    # from the first Monday
+    week = data.isel(time=slice(4 * 24, 11 * 24))
+    _, masked = run(
+        make_request("mean", "daily", "weekly", mask=mask), week, 7 * 24, 24
+    )
+    _, full = run(make_request("mean", "daily", "weekly"), week, 7 * 24, 24)
+    assert masked.pr.shape == (7, 16, 20)
+    assert_masked(masked.pr, full.pr, mask)
+
+    _, masked = run(
+        make_request("var", "continuous", "daily", mask=mask), data, 72, 12
+    )
+    _, full = run(make_request("var", "continuous", "daily"), data, 72, 12)
+    assert_masked(masked.pr, full.pr, mask)
+
+
+def test_mask_file(data, mask, tmp_path):
+    # a land sea mask with NaN over the sea and a time dimension
+    lsm = xr.DataArray(
+        np.where(mask, 1.0, np.nan)[None], dims=("time", "lat", "lon"),
+        coords={"time": data.time[:1], "lat": data.lat, "lon": data.lon},
+        name="lsm"
+    )
+    file_name = str(tmp_path / "lsm.nc")
+    lsm.to_netcdf(file_name)
+
+    _, masked = run(make_request("mean", mask=file_name), data, 24, 24)
+    _, full = run(make_request("mean"), data, 24, 24)
+    assert_masked(masked.pr, full.pr, mask)
+
+
+def test_mask_checkpoint(data, mask, tmp_path):
+
+    pass_dic = make_request(
+        "mean", "daily", "daily", mask=mask, checkpoint=True,
+        checkpoint_filepath=str(tmp_path)
+    )
+    full_dic = make_request(
+        "mean", "daily", "daily", checkpoint=True,
+        checkpoint_filepath=str(tmp_path / "full")
+    )
+    os.mkdir(tmp_path / "full")
+    for i in range(0, 23):
+        Opa(pass_dic).compute(data.isel(time=slice(i, i + 1)))
+        Opa(full_dic).compute(data.isel(time=slice(i, i + 1)))
+
+    masked_file = glob.glob(str(tmp_path / "*.pkl"))[0]
+    full_file = glob.glob(str(tmp_path / "full" / "*.pkl"))[0]
+    with open(masked_file, "rb") as f:
+        state = pickle.load(f)
+    assert state.grid_mask is None
+    assert np.shape(state.statistics.mean_cum) == (1, np.sum(mask))
+    assert os.path.getsize(masked_file) < os.path.getsize(full_file)
+
+    dm = Opa(pass_dic).compute(data.isel(time=slice(23, 24)))
+    _, full = run(make_request("mean"), data, 24, 24)
+    assert np.allclose(
+        dm.pr.values[..., mask], full.pr.values[..., mask], rtol=1e-12
+    )
+    assert np.all(np.isnan(dm.pr.values[..., ~mask]))
+
+
+def test_mask_numpy_snapshot(data, mask):
+
+    values = data.pr.values[:24]
+    time_stamps = data.time.values[:24]
+    opa_stat = Opa(make_request("max", mask=mask))
+    opa_stat.compute_numpy(values[:12], time_stamps[:12])
+
+    partial, meta = opa_stat.snapshot()
+    assert_masked(partial, np.max(values[:12], axis=0)[None], mask)
+    assert meta["dims"] == ("time", "dim_1", "dim_2")
+    assert meta["timings"].shape == (1, 16, 20)
+
+    final, meta = opa_stat.compute_numpy(
+        values[12:], time_stamps[12:], dims=("time", "lat", "lon")
+    )
+    assert_masked(final, np.max(values, axis=0)[None], mask)
+    assert meta["dims"] == ("time", "lat", "lon")
+    assert_masked(
+        meta["timings"],
+        time_stamps[np.argmax(values, axis=0)][None].astype("datetime64[ns]"),
+        mask, np.datetime64("NaT")
+    )
+
+
+def test_mask_rollup_group(data, mask):
+
+    week = data.isel(time=slice(4 * 24, 11 * 24))
+    opa_stat, _ = run(
+        make_request("mean", "daily", "daily", mask=mask,
+                     rollup_freq=["weekly"]),
+        week, 7 * 24, 24
+    )
+    week = week.pr.mean("time").values
+    assert np.allclose(
+        opa_stat.rollup.final_cum["weekly"].pr.values[0][mask], week[mask],
+        rtol=1e-12
+    )
+    assert np.all(np.isnan(opa_stat.rollup.final_cum["weekly"].pr.values[0][~mask]))
+
+    group = OpaGroup([
+        make_request("mean", mask=mask), make_request("sum"),
+        make_request("max", mask=mask)
+    ])
+    for i in range(0, 24, 6):
+        outputs = group.compute(data.isel(time=slice(i, i + 6)))
+    day = data.pr.isel(time=slice(0, 24))
+    assert_masked(
+        outputs[0].pr, day.mean("time").values[None], mask, rtol=1e-12
+    )
+    assert np.allclose(outputs[1].pr.values[0], day.sum("time").values)
+    assert_masked(outputs[2].pr, day.max("time").values[None], mask)
+
+
+def test_mask_wrong_shape(data):
+
+    opa_stat = Opa(make_request("mean", mask=np.ones((16, 21), dtype=bool)))
+    with pytest.raises(ValueError):
+        opa_stat.compute(data.isel(time=slice(0, 1)))
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(stat="raw"),
+    dict(mask="tests/no_such_mask.nc"),
+    dict(mask=True),
+    dict(mask=[]),
+])
+def test_mask_not_valid(mask, kwargs):
+
+    pass_dic = make_request("mean", mask=mask)
+    pass_dic.update(kwargs)
+    with pytest.raises(ValueError):
+        Opa(pass_dic)
@@ -0,0 +1,141 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.opa_group import OpaGroup
+from one_pass.statistics import moments
+from one_pass.statistics.moments import compute_moments
+from one_pass.statistics.moments import MomentsCache
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, stat_freq="daily", output_freq="daily"):
+
+    return {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+
+
+@pytest.mark.parametrize("axis", [0, 1])
+@pytest.mark.parametrize("block_bytes", [64, 2**18])
+def test_compute_moments(axis, block_bytes):
+
+    rng = np.random.default_rng(1)
+    values = rng.random((7, 5, 9)).astype(np.float32)
+    values = np.moveaxis(values, 0, axis)
+    result = compute_moments(values, moments.MOMENTS, axis, block_bytes)
+
+    values64 = values.astype(np.float64)
+    assert result["sum"].shape == np.sum(values64, axis, keepdims=True).shape
+    assert np.allclose(result["sum"], np.sum(values64, axis, keepdims=True))
+    assert np.allclose(result["mean"], np.mean(values64, axis, keepdims=True))
+    assert np.allclose(
+        result["m2"], np.var(values64, axis, keepdims=True) * 7
+    )
+    for name in ("min", "max"):
+        assert np.array_equal(
+            result[name], getattr(np, name)(values, axis, keepdims=True)
+        )
+        assert np.array_equal(
+            result["arg" + name],
+            np.expand_dims(getattr(np, "arg" + name)(values, axis), axis)
+        )
+
+
+def test_moments_cache():
+
+    values = np.arange(24.0).reshape(4, 6)
+    moments_cache = MomentsCache(("mean", "max"))
+    first = moments_cache.get(values, ("mean",))
+
+    # a view of the same data uses the cached moments
+    assert moments_cache.get(values[:], ("max",)) is first
+    # other data, or data missing moments, are computed again
+    assert moments_cache.get(values[:2], ("mean",)) is not first
+    assert "m2" in moments_cache.get(values[:2], ("m2",))
+
+    moments_cache.clear()
+    assert moments_cache.values is None
+
+
+def test_group_computes_moments_once(data, monkeypatch):
+
+    calls = []
+    compute = moments.compute_moments
+
+    def counting_compute(*args, **kwargs):
+        calls.append(args[1])
+        return compute(*args, **kwargs)
+
+    monkeypatch.setattr(moments, "compute_moments", counting_compute)
+
+    group = OpaGroup([
+        make_request("mean"), make_request("var"), make_request("max"),
+        make_request("sum", "daily", "weekly"),
+    ])
+    outputs = group.compute(data.isel(time=slice(0, 24)))
+
+    assert len(calls) == 1
+    assert calls[0] == {"sum", "mean", "m2", "max", "argmax"}
+    assert group.moments_cache.values is None
+
+    day = data.pr.isel(time=slice(0, 24))
+    assert np.allclose(outputs[0].pr.values[0], day.mean("time").values)
+    assert np.allclose(outputs[1].pr.values[0], day.var("time", ddof=1).values)
+    assert np.allclose(outputs[2].pr.values[0], day.max("time").values)
+    assert np.array_equal(
+        outputs[2].timings.values[0], day.time.values[day.argmax("time").values]
+    )
+
+
+@pytest.mark.parametrize("stat", ["min", "max"])
+@pytest.mark.parametrize("chunk", [1, 5, 168])
+@pytest.mark.parametrize("skipna", [False, True])
+def test_extreme_keeps_data_dtype(data, stat, chunk, skipna):
+    # the extremes are incoming values, so float32 data gives float32
+    # outputs, whichever update is used (a chunk of 168 time steps
+    # reduces the complete days after the first one in one step)
+    data = data.astype(np.float32).isel(time=slice(0, 168))
+    opa_stat = Opa(dict(
+        make_request(stat, output_freq="weekly"), skipna=skipna
+    ))
+    for i in range(0, 168, chunk):
+        dm = opa_stat.compute(data.isel(time=slice(i, i + chunk)))
+
+    two_pass = getattr(data.pr.resample(time="1D"), stat)()
+    assert dm.pr.dtype == np.float32
+    assert np.array_equal(dm.pr.values, two_pass.sel(time=dm.time).values)
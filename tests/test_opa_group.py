@@ -0,0 +1,118 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.opa_group import OpaGroup
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_requests(checkpoint):
+
+    requests = []
+    for stat, stat_freq in (("mean", "daily"), ("std", "daily"),
+                            ("max", "6hourly"), ("percentile", "daily")):
+        pass_dic = {
+            "stat": stat,
+            "stat_freq": stat_freq,
+            "output_freq": "daily",
+            "time_step": 60,
+            "variable": "pr",
+            "save": False,
+            "checkpoint": checkpoint,
+            "checkpoint_filepath": "tests/",
+            "save_filepath": "tests/",
+        }
+        if stat == "percentile":
+            pass_dic["percentile_list"] = [0.1, 0.5, 0.9]
+        requests.append(pass_dic)
+    return requests
+
+
+def run_single(data, pass_dic, n_data, step):
+
+    opa_stat = Opa(dict(pass_dic, checkpoint=False))
+    for i in range(0, n_data, step):
+        dm = opa_stat.compute(data.isel(time=slice(i, i + step)))
+    return dm
+
+
+def run_group(data, requests, n_data, step, with_checkpoint):
+
+    opa_group = OpaGroup(requests)
+    for i in range(0, n_data, step):
+        if with_checkpoint:
+            opa_group = OpaGroup(requests)
+        dms = opa_group.compute(data.isel(time=slice(i, i + step)))
+    return dms
+
+
+@pytest.mark.parametrize("with_checkpoint", [False, True])
+def test_group_matches_single(data, with_checkpoint):
+
+    for file in glob.glob("tests/checkpoint_group_*.pkl"):
+        os.remove(file)
+
+    n_data = 48
+    step = 6
+    requests = make_requests(with_checkpoint)
+
+    dms = run_group(data, requests, n_data, step, with_checkpoint)
+
+    for pass_dic, dm_group in zip(requests, dms):
+        dm_single = run_single(data, pass_dic, n_data, step)
+        assert np.allclose(
+            dm_group.pr.values, dm_single.pr.values, atol=1e-12
+        ), f"OpaGroup {pass_dic['stat']} differs from Opa"
+
+    # every statistic is complete so the checkpoint has been removed
+    assert not glob.glob("tests/checkpoint_group_*.pkl")
+
+
+def test_group_checkpoint_written(data):
+
+    for file in glob.glob("tests/checkpoint_group_*.pkl"):
+        os.remove(file)
+
+    requests = make_requests(True)
+    opa_group = OpaGroup(requests)
+    opa_group.compute(data.isel(time=slice(0, 5)))
+
+    assert len(glob.glob("tests/checkpoint_group_*.pkl")) == 1
+    # no individual checkpoint files are written
+    assert not glob.glob("tests/checkpoint_pr_6hourly_timestep_60_daily_max.pkl")
+    os.remove(opa_group.checkpoint_file)
+
+
+def test_group_different_variables():
+
+    requests = make_requests(False)
+    requests[1]["variable"] = "tas"
+
+    with pytest.raises(ValueError):
+        OpaGroup(requests)
@@ -0,0 +1,213 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, checkpoint=False):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": "daily",
+        "output_freq": "daily",
+        "rollup_freq": ["weekly", "monthly"],
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": checkpoint,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    if stat == "percentile":
+        pass_dic["percentile_list"] = [0.1, 0.5, 0.9]
+        pass_dic["compression"] = 1
+    return pass_dic
+
+
+def two_pass(data, stat):
+
+    if stat == "mean":
+        return data.mean("time")
+    if stat == "sum":
+        return data.sum("time")
+    if stat == "var":
+        return data.var("time", ddof=1)
+    if stat == "std":
+        return data.std("time", ddof=1)
+    if stat == "min":
+        return data.min("time")
+    return data.max("time")
+
+
+@pytest.mark.parametrize("stat", ["mean", "sum", "var", "std", "min", "max"])
+def test_rollup_monthly(data, stat):
+
+    n_data = 31 * 24
+    step = 7
+    opa_stat = Opa(make_request(stat))
+    for i in range(0, n_data, step):
+        opa_stat.compute(data.isel(time=slice(i, i + step)))
+
+    monthly = opa_stat.rollup.final_cum["monthly"]
+    expected = two_pass(data.pr.isel(time=slice(0, n_data)), stat)
+
+    assert monthly.sizes["time"] == 1
+    assert monthly.time.values[0] == data.time.values[0]
+    assert np.allclose(monthly.pr.values[0], expected.values, rtol=1e-10)
+
+    if stat in ("min", "max"):
+        chunk = data.pr.isel(time=slice(0, n_data))
+        if stat == "min":
+            index = chunk.argmin("time").values
+        else:
+            index = chunk.argmax("time").values
+        assert np.array_equal(
+            monthly.timings.values[0], chunk.time.values[index]
+        )
+
+
+def test_rollup_weekly_starts_on_monday(data):
+    # 2071-01-01 is a Thursday, so the first full week starts on the 5th
+    opa_stat = Opa(make_request("mean"))
+    n_data = 12 * 24
+    for i in range(0, n_data, 24):
+        opa_stat.compute(data.isel(time=slice(i, i + 24)))
+
+    weekly = opa_stat.rollup.final_cum["weekly"]
+    expected = data.pr.isel(time=slice(4 * 24, 11 * 24)).mean("time")
+
+    assert weekly.time.values[0] == data.time.values[4 * 24]
+    assert np.allclose(weekly.pr.values[0], expected.values, rtol=1e-10)
+
+
+def run_percentile(data, n_data, **kwargs):
+    """Passes n_data hourly time steps one day at a time to a percentile
+    request with a high compression"""
+    pass_dic = make_request("percentile")
+    pass_dic["compression"] = 100
+    pass_dic.update(kwargs)
+    opa_stat = Opa(pass_dic)
+    output = None
+    for i in range(0, n_data, 24):
+        dm = opa_stat.compute(data.isel(time=slice(i, i + 24)))
+        if dm is not None:
+            output = dm
+    return opa_stat, output
+
+
+@pytest.mark.parametrize("sketch_backend", ["crick", "array"])
+@pytest.mark.parametrize(
+    "rollup_freq", [["weekly", "monthly"], ["monthly", "yearly"]]
+)
+def test_rollup_percentile(data, rollup_freq, sketch_backend):
+
+    n_data = 31 * 24
+    opa_stat, _ = run_percentile(
+        data, n_data, rollup_freq=rollup_freq, sketch_backend=sketch_backend
+    )
+    monthly = opa_stat.rollup.final_cum["monthly"]
+    assert monthly.pr.shape == (1, 3, *data.pr.shape[1:])
+
+    # the same percentiles as a monthly request, up to the error of the
+    # digests, which merge differently
+    _, direct = run_percentile(
+        data, n_data, stat_freq="monthly", output_freq="monthly",
+        rollup_freq=None, sketch_backend=sketch_backend
+    )
+    assert np.allclose(monthly.pr.values, direct.pr.values, rtol=0.15, atol=0)
+
+    # a level starting on the same day as another one has its own digests
+    single_stat, _ = run_percentile(
+        data, n_data, rollup_freq=["monthly"], sketch_backend=sketch_backend
+    )
+    single = single_stat.rollup.final_cum["monthly"]
+    assert np.array_equal(monthly.pr.values, single.pr.values)
+
+
+@pytest.mark.parametrize("sketch_backend", ["crick", "array"])
+def test_rollup_levels_own_digests(data, sketch_backend):
+    # monthly and yearly both start on 1 January
+    opa_stat, _ = run_percentile(
+        data, 6 * 24, rollup_freq=["monthly", "yearly"],
+        sketch_backend=sketch_backend
+    )
+    monthly, yearly = opa_stat.rollup.levels
+    assert monthly.digests_cum is not yearly.digests_cum
+    for level in (monthly, yearly):
+        if sketch_backend == "crick":
+            weight = level.digests_cum[0].size()
+        else:
+            weight = level.digests_cum.total()[0]
+        assert weight == 6 * 24
+
+
+def test_rollup_with_checkpoint(data):
+
+    for file in glob.glob("tests/checkpoint_pr_daily_timestep_60_daily_mean.pkl"):
+        os.remove(file)
+
+    pass_dic = make_request("mean", checkpoint=True)
+    pass_dic["rollup_freq"] = "monthly"
+
+    n_data = 31 * 24
+    step = 24
+    for i in range(0, n_data, step):
+        opa_stat = Opa(pass_dic)
+        opa_stat.compute(data.isel(time=slice(i, i + step)))
+        if i + step < n_data:
+            # the checkpoint is kept for the monthly roll up
+            assert os.path.exists(opa_stat.request.checkpoint_file)
+
+    monthly = opa_stat.rollup.final_cum["monthly"]
+    expected = data.pr.isel(time=slice(0, n_data)).mean("time")
+    assert np.allclose(monthly.pr.values[0], expected.values, rtol=1e-10)
+    assert not os.path.exists(opa_stat.request.checkpoint_file)
+
+
+def test_rollup_in_one_chunk(data):
+    # roll up combined with the segmented reduction of whole days
+    n_data = 31 * 24
+    opa_stat = Opa(make_request("var"))
+    opa_stat.compute(data.isel(time=slice(0, n_data)))
+
+    monthly = opa_stat.rollup.final_cum["monthly"]
+    expected = data.pr.isel(time=slice(0, n_data)).var("time", ddof=1)
+    assert np.allclose(monthly.pr.values[0], expected.values, rtol=1e-10)
+
+
+def test_rollup_bad_freq():
+
+    pass_dic = make_request("mean")
+    pass_dic["stat_freq"] = "weekly"
+    pass_dic["output_freq"] = "weekly"
+    pass_dic["rollup_freq"] = "monthly"
+
+    with pytest.raises(ValueError):
+        Opa(pass_dic)
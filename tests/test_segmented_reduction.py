@@ -0,0 +1,108 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, stat_freq, output_freq, checkpoint=False):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": checkpoint,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    if stat == "thresh_exceed":
+        pass_dic["thresh_exceed"] = [1e-5, 1e-4]
+    return pass_dic
+
+
+def run_opa(data, pass_dic, chunks):
+
+    opa_stat = Opa(pass_dic)
+    for start, end in chunks:
+        dm = opa_stat.compute(data.isel(time=slice(start, end)))
+    return dm
+
+
+@pytest.mark.parametrize(
+    "stat", ["mean", "sum", "var", "std", "min", "max", "thresh_exceed"]
+)
+def test_daily_in_one_chunk(data, stat):
+    # one month of daily statistics given in one chunk (plus a partial
+    # day) against the same statistics given one day at a time
+    pass_dic = make_request(stat, "daily", "monthly")
+
+    one_chunk = run_opa(data, pass_dic, [(0, 31 * 24 + 5)])
+    per_day = run_opa(data, pass_dic, [(i, i + 24) for i in range(0, 31 * 24, 24)])
+
+    assert one_chunk.sizes["time"] == 31
+    assert np.allclose(one_chunk.pr.values, per_day.pr.values, rtol=1e-10)
+    assert np.array_equal(one_chunk.time.values, per_day.time.values)
+    if stat in ("min", "max"):
+        assert np.array_equal(one_chunk.timings.values, per_day.timings.values)
+
+
+@pytest.mark.parametrize("stat", ["var", "max"])
+def test_monthly_in_one_chunk(data, stat):
+    # periods of different lengths
+    pass_dic = make_request(stat, "monthly", "3monthly")
+    n_data = (31 + 28 + 31) * 24
+
+    one_chunk = run_opa(data, pass_dic, [(0, n_data)])
+    per_month = run_opa(
+        data, pass_dic, [(0, 31 * 24), (31 * 24, 59 * 24), (59 * 24, n_data)]
+    )
+
+    assert one_chunk.sizes["time"] == 3
+    assert np.allclose(one_chunk.pr.values, per_month.pr.values, rtol=1e-10)
+    if stat == "max":
+        assert np.array_equal(one_chunk.timings.values, per_month.timings.values)
+
+
+def test_tail_carried_to_checkpoint(data):
+    # the partial day at the end of the chunk is carried in the
+    # checkpoint and completed by the next chunk
+    for file in glob.glob("tests/checkpoint_pr_daily_timestep_60_daily_mean.pkl"):
+        os.remove(file)
+
+    pass_dic = make_request("mean", "daily", "daily", checkpoint=True)
+
+    Opa(pass_dic).compute(data.isel(time=slice(0, 3 * 24 + 5)))
+    dm = Opa(pass_dic).compute(data.isel(time=slice(3 * 24 + 5, 4 * 24)))
+
+    two_pass = data.pr.isel(time=slice(3 * 24, 4 * 24)).mean("time")
+    assert np.allclose(dm.pr.values[0], two_pass.values, atol=1e-12)
+    assert not glob.glob("tests/checkpoint_pr_daily_timestep_60_daily_mean.pkl")
@@ -0,0 +1,251 @@
+import glob
+import os
+import sys
+import warnings
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.opa_group import OpaGroup
+from one_pass.statistics.moments import MOMENTS
+from one_pass.statistics.moments import compute_moments
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+@pytest.fixture(scope="module")
+def nan_data(data):
+    # one week with 30 % of missing values, a cell that is always missing
+    # and a cell with only missing values on the first day
+    week = data.isel(time=slice(0, 7 * 24)).copy(deep=True)
+    values = week.pr.values
+    values[np.random.default_rng(0).random(values.shape) < 0.3] = np.nan
+    values[:, 0, 0] = np.nan
+    values[:24, 0, 1] = np.nan
+    return week
+
+
+def make_request(stat, stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+        "skipna": True,
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def nan_stat(stat, values):
+    """Expected statistic over the first axis, NaN for the cells without
+    any value"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if stat == "var":
+            return np.nanvar(values, axis=0, ddof=1)
+        if stat == "std":
+            return np.nanstd(values, axis=0, ddof=1)
+        result = getattr(np, "nan" + stat)(values, axis=0)
+    result[np.all(np.isnan(values), axis=0)] = np.nan
+    return result
+
+
+@pytest.mark.parametrize("axis", [0, 1])
+@pytest.mark.parametrize("block_bytes", [64, 2**18])
+def test_nan_moments(axis, block_bytes):
+
+    rng = np.random.default_rng(1)
+    values = rng.random((7, 5, 9))
+    values[rng.random(values.shape) < 0.4] = np.nan
+    values[:, 0, 0] = np.nan
+    expected = values
+    values = np.moveaxis(values, 0, axis)
+    result = compute_moments(values, MOMENTS, axis, block_bytes)
+    result = {name: np.moveaxis(value, axis, 0)[0]
+              for name, value in result.items()}
+
+    assert np.array_equal(result["count"], np.sum(~np.isnan(expected), axis=0))
+    assert np.allclose(result["nansum"], np.nansum(expected, axis=0))
+    assert np.allclose(result["nanmean"], nan_stat("mean", expected),
+                       equal_nan=True)
+    assert np.allclose(
+        result["nanm2"],
+        np.nan_to_num(nan_stat("var", expected) * (result["count"] - 1))
+    )
+    for name in ("min", "max"):
+        assert np.array_equal(result["nan" + name],
+                              nan_stat(name, expected), equal_nan=True)
+        # the cell without any value is skipped
+        arg = getattr(np, "nanarg" + name)(
+            expected.reshape(7, -1)[:, 1:], axis=0
+        )
+        assert np.array_equal(result["nanarg" + name].ravel()[1:], arg)
+
+
+@pytest.mark.parametrize("stat", ["mean", "sum", "var", "std", "min", "max"])
+@pytest.mark.parametrize("step", [1, 5, 24])
+def test_skipna(nan_data, stat, step):
+
+    opa_stat = Opa(make_request(stat))
+    outputs = []
+    for i in range(0, 48, step):
+        dm = opa_stat.compute(nan_data.isel(time=slice(i, i + step)))
+        if dm is not None:
+            outputs.append(dm)
+    first, dm = outputs
+
+    values = nan_data.pr.values
+    for dm, day in ((first, values[:24]), (dm, values[24:48])):
+        assert np.allclose(dm.pr.values[0], nan_stat(stat, day),
+                           equal_nan=True, rtol=1e-10)
+    assert np.isnan(first.pr.values[0, 0, :2]).all()
+    assert not np.isnan(dm.pr.values[0, 0, 1])
+    if stat in ("min", "max"):
+        index = getattr(np, "nanarg" + stat)(
+            values[24:48].reshape(24, -1)[:, 1:], axis=0
+        )
+        assert np.array_equal(
+            dm.timings.values[0].ravel()[1:], nan_data.time.values[24 + index]
+        )
+        assert np.isnat(dm.timings.values[0, 0, 0])
+
+
+@pytest.mark.parametrize("stat", ["mean", "var"])
+def test_skipna_continuous(nan_data, stat):
+
+    opa_stat = Opa(make_request(stat, "continuous", "daily"))
+    for i in range(0, 72, 12):
+        dm = opa_stat.compute(nan_data.isel(time=slice(i, i + 12)))
+
+    assert np.allclose(dm.pr.values[0], nan_stat(stat, nan_data.pr.values[:72]),
+                       equal_nan=True, rtol=1e-10)
+
+
+@pytest.mark.parametrize("min_coverage", [0.5, 0.75, 1])
+def test_min_coverage(nan_data, min_coverage):
+
+    day = nan_data.isel(time=slice(24, 48))
+    dm = Opa(make_request("mean", min_coverage=min_coverage)).compute(day)
+
+    values = day.pr.values
+    expected = nan_stat("mean", values)
+    expected[np.sum(~np.isnan(values), axis=0) < min_coverage * 24] = np.nan
+    assert np.allclose(dm.pr.values[0], expected, equal_nan=True, rtol=1e-10)
+    assert np.isnan(dm.pr.values).any()
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(stat="percentile", percentile_list=[0.1, 0.5, 0.9]),
+    dict(stat="percentile", percentile_list=[0.1, 0.5, 0.9],
+         sketch_backend="crick"),
+    dict(stat="histogram", range=[0, 1e-4], bins=5),
+    dict(stat="histogram", sketch_backend="crick", bins=5),
+    dict(stat="thresh_exceed", thresh_exceed=[1e-6, 1e-5]),
+])
+def test_skipna_distributions(nan_data, kwargs):
+
+    day = nan_data.isel(time=slice(0, 24))
+    expected_dm = Opa(make_request(skipna=False, **kwargs)).compute(day)
+    dm = Opa(make_request(min_coverage=0.6, **kwargs)).compute(day)
+
+    values = day.pr.values
+    low = np.sum(~np.isnan(values), axis=0) < 0.6 * 24
+    assert low.any() and not low.all()
+    if kwargs["stat"] == "histogram":
+        counts, edges = dm
+        assert np.all(counts.pr.values[0][:, low] == 0)
+        assert np.isnan(edges.pr.values[0][:, low]).all()
+        assert np.array_equal(counts.pr.values[0][:, ~low],
+                              expected_dm[0].pr.values[0][:, ~low])
+    else:
+        assert np.isnan(dm.pr.values[0][:, low]).all()
+        assert np.array_equal(dm.pr.values[0][:, ~low],
+                              expected_dm.pr.values[0][:, ~low])
+
+
+def test_skipna_numpy_snapshot(nan_data):
+
+    values = nan_data.pr.values[:24]
+    opa_stat = Opa(make_request("var", min_coverage=0.5))
+    opa_stat.compute_numpy(values[:12], nan_data.time.values[:12])
+    partial, meta = opa_stat.snapshot()
+    expected = nan_stat("var", values[:12])
+    expected[np.sum(~np.isnan(values[:12]), axis=0) < 6] = np.nan
+    assert np.allclose(partial[0], expected, equal_nan=True, rtol=1e-10)
+    assert meta["count"] == 12
+
+    final, _ = opa_stat.compute_numpy(values[12:], nan_data.time.values[12:24])
+    expected = nan_stat("var", values)
+    expected[np.sum(~np.isnan(values), axis=0) < 12] = np.nan
+    assert np.allclose(final[0], expected, equal_nan=True, rtol=1e-10)
+
+
+def test_skipna_checkpoint(nan_data, tmp_path):
+
+    pass_dic = make_request(
+        "std", "continuous", "daily", checkpoint=True,
+        checkpoint_filepath=str(tmp_path), state_dtype="float32"
+    )
+    for i in range(0, 48, 6):
+        dm = Opa(pass_dic).compute(nan_data.isel(time=slice(i, i + 6)))
+
+    assert np.allclose(dm.pr.values[0], nan_stat("std", nan_data.pr.values[:48]),
+                       equal_nan=True, rtol=1e-5)
+
+
+def test_skipna_group(nan_data):
+
+    requests = [make_request(stat) for stat in ("mean", "var", "max")]
+    requests.append(make_request("mean", skipna=False))
+    outputs = OpaGroup(requests).compute(nan_data.isel(time=slice(0, 24)))
+
+    values = nan_data.pr.values[:24]
+    for dm, stat in zip(outputs, ("mean", "var", "max")):
+        assert np.allclose(dm.pr.values[0], nan_stat(stat, values),
+                           equal_nan=True, rtol=1e-10)
+    assert np.isnan(outputs[3].pr.values).all()
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(skipna="yes"),
+    dict(skipna=False, min_coverage=0.5),
+    dict(min_coverage=0),
+    dict(min_coverage=1.5),
+    dict(stat="iams"),
+    dict(rollup_freq=["monthly"]),
+])
+def test_skipna_not_valid(kwargs):
+
+    pass_dic = make_request("mean")
+    pass_dic.update(kwargs)
+    with pytest.raises(ValueError):
+        Opa(pass_dic)
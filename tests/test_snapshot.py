@@ -0,0 +1,159 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    if stat == "percentile":
+        pass_dic["percentile_list"] = [0.1, 0.5, 0.9]
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+@pytest.mark.parametrize("stat", ["mean", "sum", "var", "std", "min", "max"])
+def test_snapshot_matches_two_pass(data, stat):
+
+    n_data = 10
+    opa_stat = Opa(make_request(stat))
+    opa_stat.compute(data.isel(time=slice(0, 4)))
+    opa_stat.compute(data.isel(time=slice(4, n_data)))
+    partial_stat, meta = opa_stat.snapshot()
+
+    data_seen = data.pr.isel(time=slice(0, n_data))
+    if stat in ("var", "std"):
+        two_pass = getattr(data_seen, stat)("time", ddof=1)
+    else:
+        two_pass = getattr(data_seen, stat)("time")
+
+    assert np.allclose(partial_stat[0], two_pass.values, rtol=1e-10)
+    assert meta["count"] == n_data
+    assert meta["n_data"] == 24
+    assert meta["time"][0] == data.time.values[0]
+    assert meta["time_stamp"] == data.time.values[n_data - 1]
+    if stat in ("min", "max"):
+        arg = getattr(data_seen, "arg" + stat)("time")
+        assert np.array_equal(
+            meta["timings"][0], data.time.values[arg.values]
+        )
+
+
+def test_snapshot_percentile(data):
+
+    opa_stat = Opa(make_request("percentile"))
+    opa_stat.compute(data.isel(time=slice(0, 12)))
+    partial_stat, meta = opa_stat.snapshot()
+
+    assert partial_stat.shape == (1, 3, 16, 20)
+    assert np.array_equal(meta["percentile"], [0.1, 0.5, 0.9])
+    # with compression 1 crick keeps every value
+    two_pass = data.pr.isel(time=slice(0, 12)).max("time")
+    assert np.all(partial_stat[0, 2] <= two_pass.values)
+
+
+def test_snapshot_leaves_state_unchanged(data, tmp_path):
+
+    pass_dic = make_request(
+        "var", checkpoint=True, checkpoint_filepath=str(tmp_path)
+    )
+    opa_snap = Opa(pass_dic)
+    opa_plain = Opa(make_request("var"))
+
+    for i in range(0, 24, 6):
+        opa_plain.compute(data.isel(time=slice(i, i + 6)))
+        dm = opa_snap.compute(data.isel(time=slice(i, i + 6)))
+        if i < 18:
+            with open(opa_snap.request.checkpoint_file, "rb") as file:
+                checkpoint = file.read()
+            opa_snap.snapshot()
+            with open(opa_snap.request.checkpoint_file, "rb") as file:
+                assert file.read() == checkpoint
+            assert np.array_equal(
+                opa_snap.statistics.var_cum, opa_plain.statistics.var_cum
+            )
+
+    two_pass = data.pr.isel(time=slice(0, 24)).var("time", ddof=1)
+    assert np.allclose(dm.pr.values[0], two_pass.values, rtol=1e-10)
+    # nothing has been added to the next statistic yet
+    assert opa_snap.snapshot() is None
+
+
+def test_snapshot_continuous(data):
+
+    opa_stat = Opa(make_request("var", "continuous", "daily"))
+    opa_stat.compute(data.isel(time=slice(0, 24)))
+    partial_at_output, _ = opa_stat.snapshot()
+    opa_stat.compute(data.isel(time=slice(24, 30)))
+    partial_stat, meta = opa_stat.snapshot()
+
+    assert np.allclose(
+        partial_at_output[0],
+        data.pr.isel(time=slice(0, 24)).var("time", ddof=1).values,
+        rtol=1e-10
+    )
+    assert np.allclose(
+        partial_stat[0],
+        data.pr.isel(time=slice(0, 30)).var("time", ddof=1).values,
+        rtol=1e-10
+    )
+    assert meta["count"] == 6
+
+
+def test_snapshot_as_xarray(data):
+
+    opa_stat = Opa(make_request("max"))
+    opa_stat.compute(data.isel(time=slice(0, 5)))
+    dm = opa_stat.snapshot(
+        as_xarray=True, coords={"lat": data.lat.values, "lon": data.lon.values}
+    )
+
+    assert isinstance(dm, xr.Dataset)
+    assert dm.pr.dims == data.pr.dims
+    assert np.array_equal(dm.lat.values, data.lat.values)
+    assert "timings" in dm
+
+
+def test_snapshot_not_supported(data):
+
+    assert Opa(make_request("mean")).snapshot() is None
+    with pytest.raises(ValueError):
+        Opa(make_request("raw")).snapshot()
@@ -0,0 +1,143 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.checkpointing import state_cache
+from one_pass.checkpointing.write_pickle import write_pickle
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(file_path, stat="var"):
+
+    return {
+        "stat": stat,
+        "stat_freq": "daily",
+        "output_freq": "daily",
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": True,
+        "checkpoint_filepath": str(file_path),
+        "save_filepath": str(file_path),
+    }
+
+
+def test_state_cache_recreating_opa(data, tmp_path):
+
+    pass_dic = make_request(tmp_path)
+    opa_old = None
+    for i in range(0, 24, 3):
+        opa_stat = Opa(pass_dic)
+        if opa_old is not None:
+            # the state is taken from the cache, not from the pickle file
+            assert opa_stat.statistics is opa_old.statistics
+        dm = opa_stat.compute(data.isel(time=slice(i, i + 3)))
+        opa_old = opa_stat
+
+    two_pass = data.pr.isel(time=slice(0, 24)).var("time", ddof=1)
+    assert np.allclose(dm.pr.values[0], two_pass.values, rtol=1e-10)
+    assert not os.path.exists(opa_stat.request.checkpoint_file)
+
+    # the finished state is not used by the next Opa
+    opa_stat = Opa(pass_dic)
+    assert opa_stat.statistics is not opa_old.statistics
+    assert opa_stat.time.count is None
+
+
+def test_state_cache_file_changed(data, tmp_path):
+
+    pass_dic = make_request(tmp_path, "mean")
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 5)))
+
+    # checkpoint re-written by someone else, with a different state
+    opa_other = Opa(make_request(tmp_path, "mean"))
+    opa_other.time.count = 3
+    os.remove(opa_stat.request.checkpoint_file)
+    write_pickle(opa_other, opa_stat.request.checkpoint_file)
+
+    opa_new = Opa(pass_dic)
+    assert opa_new.statistics is not opa_stat.statistics
+    assert opa_new.time.count == 3
+
+
+def test_state_cache_cleared(data, tmp_path):
+
+    pass_dic = make_request(tmp_path, "mean")
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 5)))
+
+    state_cache.clear_state_cache()
+    opa_new = Opa(pass_dic)
+    assert opa_new.statistics is not opa_stat.statistics
+    assert opa_new.time.count == 5
+    assert np.allclose(
+        opa_new.statistics.mean_cum, opa_stat.statistics.mean_cum
+    )
+
+
+def test_state_cache_keep_checkpoints(data, tmp_path):
+    # the kept checkpoint holds the state before the statistic finished
+    pass_dic = make_request(tmp_path, "mean")
+    opa_stat = Opa(pass_dic, keep_checkpoints=True)
+    opa_stat.compute(data.isel(time=slice(0, 20)))
+    opa_stat.compute(data.isel(time=slice(20, 24)))
+
+    opa_new = Opa(pass_dic, keep_checkpoints=True)
+    assert opa_new.statistics is not opa_stat.statistics
+    assert opa_new.time.count == 20
+
+
+def test_state_cache_handed_over(data, tmp_path):
+
+    pass_dic = make_request(tmp_path, "mean")
+    opa_stat = Opa(pass_dic)
+    opa_stat.compute(data.isel(time=slice(0, 5)))
+
+    # the first new Opa takes over the state, the old one is stale
+    opa_new = Opa(pass_dic)
+    assert opa_new.statistics is opa_stat.statistics
+    with pytest.raises(RuntimeError):
+        opa_stat.compute(data.isel(time=slice(5, 6)))
+    with pytest.raises(RuntimeError):
+        opa_stat.snapshot()
+
+    # any other Opa loads its own copy of the checkpoint
+    probe = Opa(pass_dic)
+    assert probe.statistics is not opa_new.statistics
+    mean_cum = probe.statistics.mean_cum.copy()
+
+    opa_new.compute(data.isel(time=slice(5, 6)))
+    assert probe.time.count == 5
+    assert np.array_equal(probe.statistics.mean_cum, mean_cum)
+    assert opa_new.time.count == 6
+    assert np.allclose(
+        opa_new.statistics.mean_cum[0],
+        data.pr.isel(time=slice(0, 6)).mean("time").values
+    )
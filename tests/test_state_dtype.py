@@ -0,0 +1,185 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+
+# documented relative tolerance of a float32 state against the float64
+# state (see the_data_request.rst): the rounding of the output to float32,
+# and of its square root for std, whatever the number of updates
+TOLERANCE = 1.5e-7
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat, state_dtype=None, **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": "daily",
+        "output_freq": "daily",
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    if state_dtype is not None:
+        pass_dic["state_dtype"] = state_dtype
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def run_numpy(pass_dic, values, time_stamps, step):
+    """Passes values to compute_numpy in chunks of step and returns the
+    last finished output"""
+    opa_stat = Opa(pass_dic)
+    output = None
+    for i in range(0, len(time_stamps), step):
+        out = opa_stat.compute_numpy(
+            values[i:i + step], time_stamps[i:i + step]
+        )
+        if out is not None:
+            output = out
+    return opa_stat, output[0]
+
+
+def max_relative_error(result, expected):
+    return np.max(np.abs(result - expected) / np.abs(expected))
+
+
+@pytest.mark.parametrize("step", [1, 30])
+@pytest.mark.parametrize("stat", ["mean", "sum", "var", "std"])
+def test_state_dtype_continuous_decade(stat, step):
+    # a decade of daily data, with a large offset from zero as for a
+    # temperature, passed one time step at a time
+    n_steps = 3650
+    rng = np.random.default_rng(0)
+    values = (280 + 10 * np.sin(np.arange(n_steps) * 2 * np.pi / 365)[:, None]
+              + 5 * rng.standard_normal((n_steps, 200)))
+    time_stamps = np.datetime64("2071-01-01", "ns") + np.arange(
+        n_steps
+    ) * np.timedelta64(1, "D")
+
+    kwargs = dict(stat_freq="continuous", output_freq="yearly",
+                  time_step=1440)
+    opa_64, expected = run_numpy(
+        make_request(stat, **kwargs), values, time_stamps, step
+    )
+    opa_32, result = run_numpy(
+        make_request(stat, "float32", **kwargs), values, time_stamps, step
+    )
+
+    key = "sum_cum" if stat == "sum" else "mean_cum"
+    assert getattr(opa_32.statistics, key).dtype == np.float32
+    assert (getattr(opa_32.statistics, key).nbytes
+            == getattr(opa_64.statistics, key).nbytes // 2)
+    assert result.dtype == np.float32
+    # the rounding errors of the 3650 updates are kept in the
+    # compensation, so they do not add up
+    assert getattr(opa_32.statistics, key.replace("_cum", "_comp_cum")).dtype \
+        == np.float32
+    assert max_relative_error(result[-1], expected[-1]) < TOLERANCE
+
+
+def test_state_dtype_checkpoint(tmp_path):
+    # a new Opa from the checkpoint for every time step, so the
+    # compensation has to be carried through the checkpoints
+    n_steps = 400
+    rng = np.random.default_rng(1)
+    values = 280 + 5 * rng.standard_normal((n_steps, 50))
+    time_stamps = np.datetime64("2071-01-01", "ns") + np.arange(
+        n_steps
+    ) * np.timedelta64(1, "D")
+
+    pass_dic = make_request(
+        "var", "float32", stat_freq="continuous", output_freq="yearly",
+        time_step=1440, checkpoint=True, checkpoint_filepath=str(tmp_path)
+    )
+    for i in range(n_steps):
+        out = Opa(pass_dic).compute_numpy(
+            values[i:i + 1], time_stamps[i:i + 1]
+        )
+        if out is not None:
+            result = out[0]
+
+    _, expected = run_numpy(
+        make_request("var", stat_freq="continuous", output_freq="yearly",
+                     time_step=1440),
+        values, time_stamps, 1
+    )
+    assert max_relative_error(result[-1], expected[-1]) < TOLERANCE
+
+
+@pytest.mark.parametrize("stat", ["mean", "var"])
+@pytest.mark.parametrize("step", [1, 24])
+def test_state_dtype_compute(data, stat, step):
+
+    data = data.isel(time=slice(0, 31 * 24))
+    outputs = {}
+    for state_dtype in ("float64", "float32"):
+        opa_stat = Opa(make_request(stat, state_dtype, output_freq="monthly"))
+        for i in range(0, 31 * 24, step):
+            dm = opa_stat.compute(data.isel(time=slice(i, i + step)))
+        outputs[state_dtype] = dm.pr.values
+
+    assert outputs["float32"].dtype == np.float32
+    # precipitation is zero in some cells
+    expected = outputs["float64"]
+    nonzero = np.abs(expected) > 1e-8
+    assert max_relative_error(
+        outputs["float32"][nonzero], expected[nonzero]
+    ) < TOLERANCE
+
+
+def test_state_dtype_segments(data):
+    # one chunk holding many complete statistics
+    values = data.pr.values[:31 * 24]
+    time_stamps = data.time.values[:31 * 24]
+    _, expected = run_numpy(
+        make_request("var", output_freq="monthly"), values, time_stamps,
+        31 * 24
+    )
+    _, result = run_numpy(
+        make_request("var", "float32", output_freq="monthly"), values,
+        time_stamps, 31 * 24
+    )
+
+    assert result.dtype == np.float32
+    assert np.allclose(result, expected, rtol=TOLERANCE, atol=1e-12)
+
+
+@pytest.mark.parametrize(
+    "stat, state_dtype",
+    [("mean", "float16"), ("mean", np.float32), ("max", "float32"),
+     ("percentile", "float32")]
+)
+def test_state_dtype_not_valid(stat, state_dtype):
+
+    with pytest.raises(ValueError):
+        Opa(make_request(stat, state_dtype))
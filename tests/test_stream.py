@@ -0,0 +1,127 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat="mean", stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": stat,
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+@pytest.mark.parametrize("prefetch", [0, 1, 3])
+def test_stream_matches_compute(data, prefetch):
+
+    n_data = 3 * 24
+    opa_stat = Opa(make_request())
+    outputs = list(
+        opa_stat.stream(
+            data.isel(time=slice(0, n_data)), chunk_size=5, prefetch=prefetch
+        )
+    )
+
+    assert len(outputs) == 3
+    for i, dm in enumerate(outputs):
+        two_pass = data.pr.isel(time=slice(i * 24, (i + 1) * 24)).mean("time")
+        assert dm.time.values[0] == data.time.values[i * 24]
+        assert np.allclose(dm.pr.values[0], two_pass.values, rtol=1e-10)
+
+
+def test_stream_lazy_file():
+
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+    opa_stat = Opa(make_request("max"))
+    with xr.open_dataset(file_path_data, engine="netcdf4") as data_lazy:
+        data_lazy = data_lazy.isel(time=slice(0, 2 * 24))
+        outputs = list(opa_stat.stream(data_lazy, chunk_size=12))
+        two_pass = data_lazy.pr.isel(time=slice(24, 48)).max("time")
+
+    assert len(outputs) == 2
+    assert np.allclose(outputs[1].pr.values[0], two_pass.values)
+
+
+def test_stream_iterator_with_append(data):
+
+    chunks = (data.isel(time=slice(i, i + 24)) for i in range(0, 14 * 24, 24))
+    opa_stat = Opa(make_request("sum", "daily", "weekly"))
+    outputs = list(opa_stat.stream(chunks))
+
+    # the week is only yielded once all of its days are appended. The
+    # data starts on a Thursday, so the first week only has 4 days
+    assert len(outputs) == 2
+    assert outputs[0].sizes["time"] == 4
+    assert outputs[1].sizes["time"] == 7
+    assert outputs[1].time.values[0] == data.time.values[4 * 24]
+
+
+def test_stream_flushes_batch(data):
+
+    opa_stat = Opa(make_request("mean", batch_size=10))
+    outputs = list(opa_stat.stream(data.isel(time=slice(0, 30))))
+
+    assert len(outputs) == 1
+    assert opa_stat.batch.weight == 0
+    assert opa_stat.time.count == 6
+
+
+def test_stream_read_error():
+
+    def chunks():
+        raise OSError("failed to read")
+        yield
+
+    opa_stat = Opa(make_request())
+    with pytest.raises(OSError):
+        list(opa_stat.stream(chunks()))
+
+
+def test_stream_stops_early(data):
+
+    opa_stat = Opa(make_request())
+    stream = opa_stat.stream(data.isel(time=slice(0, 5 * 24)), chunk_size=6)
+    next(stream)
+    stream.close()
+
+    # nothing is computed after the generator is closed
+    assert opa_stat.time.time_stamp == data.time.values[23]
@@ -0,0 +1,127 @@
+import glob
+import os
+import sys
+import pytest
+
+import numpy as np
+import xarray as xr
+
+path = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(path)
+os.chdir(path)
+
+from one_pass.opa import Opa
+from one_pass.statistics.exceedance import count_exceedances
+
+THRESHOLDS = list(np.linspace(0, 5e-4, 25)[::-1]) + [-1e-4, 1e-4]
+
+
+@pytest.fixture(scope="module")
+def data():
+    file_path_data = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), "pr_12_months.nc")
+    )
+
+    file_list = glob.glob(file_path_data)
+    file_list.sort()
+    if len(file_list) == 0 or not os.path.isfile(file_list[0]):
+        raise RuntimeError(
+            "Input file is missing. Please download using provided script (tests/get_data.sh)"
+        )
+    data = xr.open_dataset(file_list[0], engine="netcdf4")
+    data = data.compute()
+    data = data.astype(np.float64)
+    return data
+
+
+def make_request(stat_freq="daily", output_freq="daily", **kwargs):
+
+    pass_dic = {
+        "stat": "thresh_exceed",
+        "stat_freq": stat_freq,
+        "output_freq": output_freq,
+        "time_step": 60,
+        "variable": "pr",
+        "save": False,
+        "checkpoint": False,
+        "checkpoint_filepath": "tests/",
+        "save_filepath": "tests/",
+        "thresh_exceed": THRESHOLDS,
+    }
+    pass_dic.update(kwargs)
+    return pass_dic
+
+
+def two_pass(data_array):
+    """Exceedance counts of every threshold, one at a time"""
+    return np.stack([
+        (data_array >= abs(threshold)).sum("time").values
+        for threshold in THRESHOLDS
+    ])
+
+
+def test_count_exceedances_nan():
+
+    values = np.array([[0.5, np.nan, -1.0], [2.0, 0.1, 1.0]])
+    counts = count_exceedances(values, [1.0, -0.2, 0.0])
+
+    # as np.where(values < threshold, 0, 1), NaN is counted
+    assert np.array_equal(
+        counts[0], [[1, 1, 1], [2, 1, 1], [2, 2, 1]]
+    )
+
+
+@pytest.mark.parametrize("step", [1, 6, 24])
+def test_thresh_exceed_unstructured(data, step):
+    # one spatial dimension, as for an unstructured grid
+    day = data.isel(time=slice(0, 24)).stack(cell=("lat", "lon"))
+    day = day.drop_vars(["cell", "lat", "lon"])
+
+    opa_stat = Opa(make_request())
+    for i in range(0, 24, step):
+        dm = opa_stat.compute(day.isel(time=slice(i, i + step)))
+
+    assert dm.pr.dims == ("time", "thresholds", "cell")
+    assert dm.pr.dtype == np.float64
+    assert np.array_equal(dm.pr.values[0], two_pass(day.pr))
+
+
+@pytest.mark.parametrize("step", [1, 6])
+def test_thresh_exceed_levels(data, step):
+    # extra level dimension
+    day = data.isel(time=slice(0, 24))
+    day = xr.concat([day, day * 2], dim="level").transpose(
+        "time", "level", "lat", "lon"
+    )
+
+    opa_stat = Opa(make_request())
+    for i in range(0, 24, step):
+        dm = opa_stat.compute(day.isel(time=slice(i, i + step)))
+
+    assert dm.pr.dims == ("time", "thresholds", "level", "lat", "lon")
+    assert np.array_equal(dm.pr.values[0], two_pass(day.pr))
+
+
+@pytest.mark.parametrize("stat_freq, output_freq, dtype", [
+    ("daily", "daily", np.uint8),
+    ("monthly", "monthly", np.uint16),
+    ("continuous", "daily", np.uint32),
+])
+def test_thresh_exceed_counter_dtype(data, stat_freq, output_freq, dtype):
+
+    opa_stat = Opa(make_request(stat_freq, output_freq))
+    opa_stat.compute(data.isel(time=slice(0, 6)))
+
+    assert opa_stat.statistics.thresh_exceed_cum.dtype == dtype
+
+
+def test_thresh_exceed_segments(data):
+    # one chunk holding many complete statistics
+    month = data.isel(time=slice(0, 31 * 24))
+    dm = Opa(make_request("daily", "monthly")).compute(month)
+
+    for day in (0, 17, 30):
+        assert np.array_equal(
+            dm.pr.values[day],
+            two_pass(month.pr.isel(time=slice(day * 24, (day + 1) * 24)))
+        )